@@ -0,0 +1,255 @@
+import argparse
+import datetime
+import functools
+import importlib
+import os
+import tempfile
+import threading
+import time
+
+from fake_kite import FakeKiteConnect, FakeKiteTicker, fake_engine_clients
+from engine import RemoteTicker
+from metrics import metrics
+from sheet_backend import MemoryBook
+from instruments import InstrumentIndex
+from order_dispatcher import OrderDispatcher
+from quote_cache import rest_quote_cache
+from sheet_writer import sheet_writer
+import functions
+import webhook
+
+# Drives the real update functions and the real main loop against MemoryBook + FakeKite.
+# Usage: python benchmark.py --sizes 50 500 3000 --duration 10 --com-latency-ms 2 --tick-rate 2000
+#        python benchmark.py --sizes 3000 --com-latency-ms 50 --com-busy --engine-process   (ticker/REST in a separate process)
+
+SHEET_NAMES = ["INPUT", "Portfolio", "Holdings", "Orders", "Funds"]
+LTP_COLUMN = 6 # INPUT column F
+
+def _percentile(samples, p):
+    if not samples:
+        return None
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(p * len(samples)))]
+
+def _fmt_ms(seconds):
+    return "-" if seconds is None else f"{seconds * 1000:.1f}"
+
+def layout_input_sheet(inp, kite, n_instruments):
+    positions = kite.positions()["net"]
+    holdings = kite.holdings()
+    functions.autofill_input_sheet_with_portfolio_holdings(inp, positions, holdings, max_rows=functions.MAX_INPUT_ROWS, clear_all=True)
+    column_a = inp.range(f"A2:A{functions.MAX_INPUT_ROWS + 1}").value
+    first_free = next((i for i, v in enumerate(column_a) if not v), len(column_a))
+    free_rows = functions.MAX_INPUT_ROWS - first_free
+    symbols = kite.option_symbols()[:min(n_instruments, free_rows)]
+    if symbols:
+        inp.range(f"A{first_free + 2}").value = [[s] for s in symbols]
+
+class TickToCellProbe:
+    # Matches every LTP written to INPUT against the time the fake ticker first sent that price.
+    def __init__(self, kite, ticker):
+        self.kite = kite
+        self.ticker = ticker
+        self.latencies = []
+        self._lock = threading.Lock()
+
+    def on_write(self, sheet, row, col, values, written_at):
+        if sheet.name != "INPUT" or not isinstance(values, list) or not values or not isinstance(values[0], list):
+            return
+        if not (col <= LTP_COLUMN < col + len(values[0])):
+            return
+        offset = LTP_COLUMN - col
+        symbols = sheet.cells
+        for r_off, row_values in enumerate(values):
+            symbol = symbols.get((row + r_off, 1))
+            token = self.kite.symbol_to_token.get(symbol) if isinstance(symbol, str) else None
+            sent_at = self.ticker.emitted_prices.get((token, row_values[offset])) if token else None
+            if sent_at is not None:
+                with self._lock:
+                    self.latencies.append(written_at - sent_at)
+
+def bench_update_functions(n_instruments, com_latency_seconds, repeats=20):
+    kite = FakeKiteConnect(n_options=n_instruments)
+    book = MemoryBook(SHEET_NAMES, com_latency_seconds=com_latency_seconds)
+    inp, port, hold, ords, sett = (book.sheets[name] for name in SHEET_NAMES)
+    layout_input_sheet(inp, kite, n_instruments)
+    sheet_writer.invalidate()
+    rest_quote_cache.invalidate()
+    positions, holdings = kite.positions()["net"], kite.holdings()
+    quotes = {sym: kite._quote_for(tok) for tok, sym in kite.symbols.items()}
+    results = {}
+    calls = {
+        "update_input_sheet": lambda: functions.update_input_sheet(inp, kite, holdings, quotes, positions),
+        "update_portfolio_sheet": lambda: functions.update_portfolio_sheet(port, positions, quotes),
+        "update_holdings_sheet": lambda: functions.update_holdings_sheet(hold, holdings, quotes),
+        "update_orders_sheet": lambda: functions.update_orders_sheet(ords, kite.orders(), clear_all=False),
+        "update_settings_sheet": lambda: functions.update_settings_sheet(sett, kite.margins()),
+    }
+    for name, call in calls.items():
+        timings = []
+        writes_before = book.stats.range_writes
+        for _ in range(repeats):
+            started = time.perf_counter()
+            call()
+            timings.append(time.perf_counter() - started)
+        results[name] = {
+            "first_ms": timings[0] * 1000,
+            "steady_ms": (sum(timings[1:]) / max(len(timings) - 1, 1)) * 1000,
+            "com_writes_per_call": (book.stats.range_writes - writes_before) / repeats,
+        }
+    return results
+
+def _engine_latencies(summary):
+    ingest = summary.get('stage_seconds{stage="tick_ingest"}') or (0, None, None)
+    rest = summary.get('rest_call_seconds{endpoint="positions"}') or (0, None, None)
+    return ingest[2], rest[2]
+
+def bench_main_loop_engine_process(n_instruments, duration_seconds, com_latency_seconds, tick_rate, rest_latency_seconds=0.02, com_busy=False):
+    # Same loop with the fake ticker and REST client inside the engine process. Tick-to-cell comes
+    # from the exchange timestamps (one-second resolution) since the ticker's send times stay there.
+    global webhook
+    webhook = importlib.reload(webhook)
+    sheet_writer.invalidate()
+    rest_quote_cache.invalidate()
+    metrics.__init__()
+    kite = FakeKiteConnect(n_options=n_instruments) # same seed as the engine's, for the sheet layout
+    with tempfile.TemporaryDirectory() as tmp:
+        webhook.config_file = os.path.join(tmp, "last_clear_date.txt")
+        with open(webhook.config_file, "w") as f:
+            f.write(datetime.datetime.now().strftime("%Y-%m-%d"))
+        channel = webhook.start_engine(functools.partial(fake_engine_clients, n_options=n_instruments, ticks_per_second=tick_rate,
+                                                         rest_latency_seconds=rest_latency_seconds),
+                                       record_ticks=False, tick_table_path=os.path.join(tmp, "ticks.tbl"))
+        try:
+            webhook.instrument_index = InstrumentIndex(os.path.join(tmp, "instruments"), kite=webhook.kite)
+            webhook.instrument_index.ensure_fresh(["NSE", "NFO"], webhook.kite)
+            book = MemoryBook(SHEET_NAMES, com_latency_seconds=com_latency_seconds, com_busy=com_busy)
+            webhook.attach_workbook(book)
+            layout_input_sheet(webhook.inp, kite, n_instruments)
+            webhook.attach_ticker(RemoteTicker(channel))
+            webhook.subscribe_initial_input_symbols()
+            extra_tokens = [t for t in kite.tokens() if t not in webhook.subscriptions]
+            if extra_tokens:
+                channel.send("ticker", "subscribe", extra_tokens)
+                channel.send("ticker", "set_mode", "full", extra_tokens)
+            ticks_before = webhook.tick_store.ticks_applied
+            book.stats.__init__()
+            deadline = time.time() + duration_seconds
+            state = webhook.run_main_loop(should_stop=lambda: time.time() >= deadline)
+            ticks = webhook.tick_store.ticks_applied - ticks_before
+            engine_stats = channel.call("engine", "stats")
+        finally:
+            webhook.stop_engine()
+    tick_to_cell = metrics.histogram("tick_to_cell_seconds")
+    ingest_p99, rest_p99 = _engine_latencies(engine_stats["summary"])
+    return {
+        "instruments": n_instruments,
+        "ticks": ticks,
+        "loop_iterations": state["iterations"],
+        "tick_to_cell_p50": tick_to_cell.quantile(0.50) if tick_to_cell else None,
+        "tick_to_cell_p99": tick_to_cell.quantile(0.99) if tick_to_cell else None,
+        "cells_written_per_sec": book.stats.cells_written / duration_seconds,
+        "com_writes_per_sec": book.stats.range_writes / duration_seconds,
+        "rest_calls_per_min": None,
+        "ingest_cpu_us_per_tick": None,
+        "loop_cpu_us_per_tick": None,
+        "ingest_p99": ingest_p99,
+        "rest_p99": rest_p99,
+    }
+
+def bench_main_loop(n_instruments, duration_seconds, com_latency_seconds, tick_rate, rest_latency_seconds=0.02, com_busy=False):
+    global webhook
+    webhook = importlib.reload(webhook)
+    sheet_writer.invalidate()
+    rest_quote_cache.invalidate()
+    metrics.__init__()
+    kite = FakeKiteConnect(n_options=n_instruments, rest_latency_seconds=rest_latency_seconds)
+    ticker = FakeKiteTicker(kite, ticks_per_second=tick_rate)
+    probe = TickToCellProbe(kite, ticker)
+    with tempfile.TemporaryDirectory() as tmp:
+        webhook.config_file = os.path.join(tmp, "last_clear_date.txt")
+        with open(webhook.config_file, "w") as f:
+            f.write(datetime.datetime.now().strftime("%Y-%m-%d"))
+        webhook.kite = kite
+        webhook.instrument_index = InstrumentIndex(os.path.join(tmp, "instruments"), kite=kite)
+        webhook.instrument_index.ensure_fresh(["NSE", "NFO"], kite)
+        book = MemoryBook(SHEET_NAMES, com_latency_seconds=com_latency_seconds, com_busy=com_busy)
+        webhook.attach_workbook(book)
+        layout_input_sheet(webhook.inp, kite, n_instruments)
+        webhook.rest_scheduler = webhook.start_rest_scheduler(kite)
+        webhook.order_dispatcher = OrderDispatcher(kite)
+
+        ingest_cpu = [0.0]
+        on_ticks = webhook.on_ticks_background
+        def timed_on_ticks(ws, ticks):
+            started = time.thread_time()
+            on_ticks(ws, ticks)
+            ingest_cpu[0] += time.thread_time() - started
+        webhook.attach_ticker(ticker)
+        ticker.on_ticks = timed_on_ticks
+        ticker.connect(threaded=True)
+        webhook.subscribe_initial_input_symbols()
+        extra_tokens = [t for t in kite.tokens() if t not in webhook.subscriptions]
+        if extra_tokens:
+            ticker.subscribe(extra_tokens)
+            ticker.set_mode(ticker.MODE_FULL, extra_tokens)
+
+        rest_calls_before = sum(kite.call_counts.values())
+        book.stats.__init__()
+        book.on_write = probe.on_write
+        ticks_before = ticker.ticks_emitted
+        deadline = time.time() + duration_seconds
+        loop_cpu_started = time.thread_time()
+        state = webhook.run_main_loop(should_stop=lambda: time.time() >= deadline)
+        loop_cpu = time.thread_time() - loop_cpu_started
+        ticks = ticker.ticks_emitted - ticks_before
+        ticker.close()
+        webhook.rest_scheduler.stop()
+        webhook.order_dispatcher.shutdown()
+        rest_calls = sum(kite.call_counts.values()) - rest_calls_before
+    ingest_p99, rest_p99 = _engine_latencies(metrics.summary())
+    return {
+        "instruments": n_instruments,
+        "ticks": ticks,
+        "loop_iterations": state["iterations"],
+        "tick_to_cell_p50": _percentile(probe.latencies, 0.50),
+        "tick_to_cell_p99": _percentile(probe.latencies, 0.99),
+        "cells_written_per_sec": book.stats.cells_written / duration_seconds,
+        "com_writes_per_sec": book.stats.range_writes / duration_seconds,
+        "rest_calls_per_min": rest_calls * 60.0 / duration_seconds,
+        "ingest_cpu_us_per_tick": (ingest_cpu[0] / ticks * 1e6) if ticks else None,
+        "loop_cpu_us_per_tick": (loop_cpu / ticks * 1e6) if ticks else None,
+        "ingest_p99": ingest_p99,
+        "rest_p99": rest_p99,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Headless benchmark of the sheet update pipeline")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[50, 500, 3000])
+    parser.add_argument("--duration", type=float, default=10.0, help="Seconds to run the main loop per size")
+    parser.add_argument("--com-latency-ms", type=float, default=2.0, help="Injected delay per sheet range call")
+    parser.add_argument("--tick-rate", type=int, default=2000, help="Synthetic ticks per second across all instruments")
+    parser.add_argument("--com-busy", action="store_true", help="Spend the COM latency holding the GIL instead of sleeping")
+    parser.add_argument("--engine-process", action="store_true", help="Run the fake ticker and REST client in the engine process")
+    args = parser.parse_args()
+    com_latency = args.com_latency_ms / 1000.0
+
+    print(f"Update functions (COM latency {args.com_latency_ms} ms/call)")
+    for n in args.sizes:
+        for name, r in bench_update_functions(n, com_latency).items():
+            print(f"  n={n:<5} {name:<24} first {r['first_ms']:8.1f} ms  steady {r['steady_ms']:8.1f} ms  COM writes/call {r['com_writes_per_call']:.2f}")
+
+    print(f"\nMain loop ({args.duration:.0f}s per size, {args.tick_rate} ticks/s{', engine process' if args.engine_process else ''})")
+    header = (f"{'n':>5} {'ticks':>8} {'iters':>6} {'t2c p50 ms':>11} {'t2c p99 ms':>11} {'cells/s':>9} {'COM w/s':>8} {'REST/min':>9} "
+              f"{'ingest us/tick':>15} {'loop us/tick':>13} {'ingest p99 ms':>14} {'REST p99 ms':>12}")
+    print(header)
+    run = bench_main_loop_engine_process if args.engine_process else bench_main_loop
+    for n in args.sizes:
+        r = run(n, args.duration, com_latency, args.tick_rate, com_busy=args.com_busy)
+        print(f"{r['instruments']:>5} {r['ticks']:>8} {r['loop_iterations']:>6} {_fmt_ms(r['tick_to_cell_p50']):>11} {_fmt_ms(r['tick_to_cell_p99']):>11} "
+              f"{r['cells_written_per_sec']:>9.0f} {r['com_writes_per_sec']:>8.1f} {r['rest_calls_per_min'] or 0:>9.0f} "
+              f"{(r['ingest_cpu_us_per_tick'] or 0):>15.1f} {(r['loop_cpu_us_per_tick'] or 0):>13.1f} "
+              f"{_fmt_ms(r['ingest_p99']):>14} {_fmt_ms(r['rest_p99']):>12}")
+
+if __name__ == "__main__":
+    main()
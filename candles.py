@@ -0,0 +1,170 @@
+import datetime
+import threading
+import time
+from array import array
+from sheet_writer import sheet_writer
+
+CANDLE_INTERVALS_SECONDS = (60, 300) # 1-minute and 5-minute bars
+CANDLE_HISTORY_BARS = 120 # Ring depth per token per interval; older bars are overwritten
+CANDLE_STORE_INITIAL_TOKENS = 512
+CANDLES_SHEET = "Candles"
+CANDLES_DEFAULT_BARS = 10
+CANDLES_MAX_SYMBOLS = 20
+CANDLES_SYMBOL_COLUMN = 10 # Candles!J2:J21 lists the symbols to render
+CANDLES_TABLE_ROW = 3
+CANDLES_HEADER = ["Symbol", "Bar Start", "Open", "High", "Low", "Close", "Volume", "VWAP"]
+INTERVAL_LABELS = {"1m": 60, "1min": 60, "5m": 300, "5min": 300}
+_NAN = float("nan")
+
+class _IntervalRing:
+    # Fixed [slot * depth + position] columns for one bar interval; a slot's newest bar sits at
+    # head[slot] and the ring wraps, so memory depends only on tokens x depth.
+    FIELDS = ("start", "open", "high", "low", "close", "volume")
+
+    def __init__(self, interval, depth, capacity):
+        self.interval = interval
+        self.depth = depth
+        self.columns = {f: array("d", [_NAN]) * (capacity * depth) for f in self.FIELDS}
+        self.head = array("l", [-1]) * capacity
+        self.count = array("l", [0]) * capacity
+
+    def grow(self, extra):
+        for f in self.FIELDS:
+            self.columns[f].extend(array("d", [_NAN]) * (extra * self.depth))
+        self.head.extend(array("l", [-1]) * extra)
+        self.count.extend(array("l", [0]) * extra)
+
+    def apply(self, slot, ts, price, volume_delta):
+        bar_start = ts - (ts % self.interval)
+        cols = self.columns
+        head = self.head[slot]
+        i = slot * self.depth + head if head >= 0 else -1
+        if i >= 0 and cols["start"][i] == bar_start:
+            if price > cols["high"][i]: cols["high"][i] = price
+            if price < cols["low"][i]: cols["low"][i] = price
+            cols["close"][i] = price
+            cols["volume"][i] += volume_delta
+            return True
+        if i >= 0 and bar_start < cols["start"][i]:
+            return False # late tick for a closed bar
+        head = (head + 1) % self.depth
+        self.head[slot] = head
+        if self.count[slot] < self.depth:
+            self.count[slot] += 1
+        i = slot * self.depth + head
+        cols["start"][i] = bar_start
+        cols["open"][i] = cols["high"][i] = cols["low"][i] = cols["close"][i] = price
+        cols["volume"][i] = volume_delta
+        return True
+
+    def last(self, slot, n):
+        # Oldest-first list of up to n (start, open, high, low, close, volume) tuples, newest bar may be open.
+        n = min(n, self.count[slot])
+        head = self.head[slot]
+        base = slot * self.depth
+        cols = self.columns
+        out = []
+        for back in range(n - 1, -1, -1):
+            i = base + (head - back) % self.depth
+            out.append(tuple(cols[f][i] for f in self.FIELDS))
+        return out
+
+class CandleStore:
+    # Incremental OHLCV bars per token fed straight from the tick callback. Each tick costs a
+    # dict lookup plus a few array writes per interval. Bar volume comes from differences of
+    # the cumulative volume_traded, and the running VWAP weights each traded price by that
+    # same difference.
+    def __init__(self, intervals=CANDLE_INTERVALS_SECONDS, depth=CANDLE_HISTORY_BARS, capacity=CANDLE_STORE_INITIAL_TOKENS):
+        self.capacity = capacity
+        self.rings = {interval: _IntervalRing(interval, depth, capacity) for interval in intervals}
+        self.token_to_slot = {}
+        self.last_cum_volume = array("d", [_NAN]) * capacity
+        self.pv_sum = array("d", [0.0]) * capacity
+        self.v_sum = array("d", [0.0]) * capacity
+        self.late_ticks = 0
+        self._lock = threading.Lock()
+
+    def _slot_for(self, token):
+        slot = self.token_to_slot.get(token)
+        if slot is None:
+            slot = len(self.token_to_slot)
+            if slot >= self.capacity:
+                extra = self.capacity
+                for ring in self.rings.values():
+                    ring.grow(extra)
+                self.last_cum_volume.extend(array("d", [_NAN]) * extra)
+                self.pv_sum.extend(array("d", [0.0]) * extra)
+                self.v_sum.extend(array("d", [0.0]) * extra)
+                self.capacity += extra
+            self.token_to_slot[token] = slot
+        return slot
+
+    def update(self, ticks, received_at=None):
+        received_at = received_at if received_at is not None else time.time()
+        rings = list(self.rings.values())
+        with self._lock:
+            for t in ticks:
+                price = t.get("last_price")
+                if not price:
+                    continue
+                slot = self._slot_for(t["instrument_token"])
+                exchange_ts = t.get("exchange_timestamp")
+                ts = exchange_ts.timestamp() if hasattr(exchange_ts, "timestamp") else received_at
+                volume_delta = 0.0
+                cum_volume = t.get("volume_traded")
+                if cum_volume is not None:
+                    last = self.last_cum_volume[slot]
+                    if last == last and cum_volume >= last:
+                        volume_delta = cum_volume - last
+                    self.last_cum_volume[slot] = cum_volume
+                if volume_delta:
+                    self.pv_sum[slot] += price * volume_delta
+                    self.v_sum[slot] += volume_delta
+                for ring in rings:
+                    if not ring.apply(slot, ts, price, volume_delta):
+                        self.late_ticks += 1
+
+    def bars(self, token, interval, n):
+        ring = self.rings.get(interval)
+        with self._lock:
+            slot = self.token_to_slot.get(token)
+            if ring is None or slot is None:
+                return []
+            return ring.last(slot, n)
+
+    def vwap(self, token):
+        with self._lock:
+            slot = self.token_to_slot.get(token)
+            if slot is None or not self.v_sum[slot]:
+                return None
+            return self.pv_sum[slot] / self.v_sum[slot]
+
+    def __len__(self):
+        return len(self.token_to_slot)
+
+def read_candle_settings(sheet):
+    # Candles!B1 = interval ("1m"/"5m"), D1 = bars per symbol, J2:J21 = symbols.
+    header = sheet.range("A1:D1").value or []
+    header = list(header) + [None] * (4 - len(header))
+    interval = INTERVAL_LABELS.get(str(header[1] or "1m").strip().lower(), 60)
+    try:
+        n_bars = int(header[3]) if header[3] not in (None, "") else CANDLES_DEFAULT_BARS
+    except (TypeError, ValueError):
+        n_bars = CANDLES_DEFAULT_BARS
+    n_bars = max(1, min(n_bars, CANDLE_HISTORY_BARS))
+    symbols = sheet.range((2, CANDLES_SYMBOL_COLUMN), (CANDLES_MAX_SYMBOLS + 1, CANDLES_SYMBOL_COLUMN)).options(ndim=1).value or []
+    symbols = [s.strip().upper() for s in symbols if isinstance(s, str) and ":" in s]
+    return interval, n_bars, symbols
+
+def update_candles_sheet(sheet, candle_store, symbol_tokens, interval, n_bars, previous_rows=0, writer=sheet_writer):
+    # symbol_tokens: [(symbol, token), ...]. Returns the number of table rows written so the
+    # next call can blank rows left over from a longer table.
+    writer.write_cells(sheet, {(1, 1): "Interval", (1, 3): "Bars", (1, CANDLES_SYMBOL_COLUMN): "Symbols"})
+    rows = []
+    for symbol_str, token in symbol_tokens:
+        vwap = candle_store.vwap(token) if token is not None else None
+        for start, o, h, l, c, v in (candle_store.bars(token, interval, n_bars) if token is not None else []):
+            rows.append([symbol_str, datetime.datetime.fromtimestamp(start), o, h, l, c, v, round(vwap, 2) if vwap else ""])
+    table = [CANDLES_HEADER] + rows + [[""] * len(CANDLES_HEADER)] * max(previous_rows - len(rows), 0)
+    writer.write_block(sheet, CANDLES_TABLE_ROW, 1, table)
+    return len(rows)
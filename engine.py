@@ -0,0 +1,414 @@
+import datetime
+import itertools
+import multiprocessing
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from metrics import metrics, METRICS_PREFIX
+from candles import CandleStore
+from gap_fill import GapFiller
+from instruments import InstrumentIndex, INSTRUMENT_CACHE_DIR
+from order_book import OrderBook
+from order_dispatcher import OrderDispatcher
+from rest_scheduler import RestScheduler, RestSnapshot
+from rest_transport import install_transport, transport_stats
+from shared_ticks import SharedTickStore
+from tick_recorder import TickRecorder, TICK_DATA_DIR
+from ticker_pool import TickerPool
+
+ENGINE_PUBLISH_INTERVAL_SECONDS = 0.05 # How often REST results, order book changes and ticker state are pushed to the renderer
+ENGINE_TICKER_STATE_INTERVAL_SECONDS = 1 # Connection stats are pushed at most this often
+ENGINE_CALL_WORKERS = 4 # Engine threads serving renderer calls, so one slow REST call does not hold up the rest
+ENGINE_CALL_TIMEOUT_SECONDS = 30 # Renderer gives up waiting on an engine call after this long
+ENGINE_START_TIMEOUT_SECONDS = 180 # Instrument download plus the first REST fetches
+ENGINE_METRICS_PREFIX = f"{METRICS_PREFIX}_engine" # Engine metrics are exported next to the renderer's under this prefix
+# Renderer-callable methods per engine object; anything else is refused.
+ENGINE_REMOTE_METHODS = {
+    "kite": {"quote", "ltp", "ohlc", "instruments", "positions", "holdings", "orders", "order_history", "margins",
+             "place_order", "modify_order", "cancel_order"},
+    "order_dispatcher": {"submit_batch", "resolve", "latency_stats"},
+    "rest_scheduler": {"request_refresh", "refresh_now", "set_interval", "stats"},
+    "candle_store": {"bars", "vwap"},
+    "ticker": {"subscribe", "unsubscribe", "set_mode"},
+    "engine": {"metrics_text", "stats", "transport_stats"},
+}
+
+def dt_now_str_fn():
+    return datetime.datetime.now().strftime("%H:%M:%S.%f")[:-3]
+
+def kite_clients(api_key, access_token_file, connections):
+    # build_clients for live trading: REST client plus a pooled KiteTicker, created inside the engine process.
+    from kiteconnect import KiteConnect, KiteTicker
+    kite = KiteConnect(api_key=api_key)
+    kite.set_access_token(open(access_token_file).read().strip())
+    install_transport(kite)
+    ticker = TickerPool(lambda i: KiteTicker(api_key, kite.access_token, reconnect=True, reconnect_max_tries=50, reconnect_max_delay=60),
+                        connections=connections)
+    return kite, ticker
+
+def build_rest_scheduler(kite_client, snapshot, order_book, intervals):
+    scheduler = RestScheduler(kite_client, snapshot)
+    scheduler.register("positions", lambda k: k.positions().get("net", []), intervals["positions"])
+    scheduler.register("holdings", lambda k: k.holdings(), intervals["holdings"])
+    scheduler.register("orders", lambda k: order_book.reconcile(k.orders()), intervals["orders"])
+    scheduler.register("margins", lambda k: k.margins(), intervals["margins"])
+    for name in ("positions", "holdings", "orders", "margins"):
+        scheduler.refresh_now(name)
+    scheduler.start()
+    return scheduler
+
+class Engine:
+    # Runs in its own process and owns everything that talks to Kite: the ticker connections, the
+    # REST scheduler, order submission and the order book. Ticks go straight into the shared tick
+    # table, so nothing the renderer does (COM calls, recalcs) can delay them. REST results, order
+    # book changes and connection state are pushed to the renderer as events; the renderer's calls
+    # on kite/order_dispatcher/rest_scheduler/candle_store/ticker come back over the same pipe.
+    def __init__(self, conn, tick_table_path, build_clients, rest_intervals, prefetch_exchanges=(), record_ticks=True):
+        self.conn = conn
+        self.tick_table_path = tick_table_path
+        self.build_clients = build_clients
+        self.rest_intervals = rest_intervals
+        self.prefetch_exchanges = list(prefetch_exchanges)
+        self.record_ticks = record_ticks
+        self.tick_store = self.candle_store = self.tick_recorder = None
+        self.kite = self.ticker = self.rest_scheduler = self.order_dispatcher = self.gap_filler = None
+        self.rest_snapshot = RestSnapshot()
+        self.order_book = OrderBook()
+        self.calls_served = 0
+        self._send_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._pool = ThreadPoolExecutor(max_workers=ENGINE_CALL_WORKERS, thread_name_prefix="engine-call")
+
+    def _send(self, message):
+        with self._send_lock:
+            try:
+                self.conn.send(message)
+            except (OSError, EOFError):
+                self._stop.set() # renderer is gone
+
+    def start(self):
+        metrics.prefix = ENGINE_METRICS_PREFIX
+        self.tick_store = SharedTickStore(self.tick_table_path)
+        self.candle_store = CandleStore()
+        self.kite, self.ticker = self.build_clients()
+        instrument_index = InstrumentIndex(INSTRUMENT_CACHE_DIR, kite=self.kite)
+        if self.prefetch_exchanges:
+            print(f"[{dt_now_str_fn()}] Engine: checking instrument cache for {self.prefetch_exchanges}...")
+            instrument_index.ensure_fresh(self.prefetch_exchanges, self.kite)
+        # Only tokens still subscribed: the shared table also keeps rows for released option legs and symbols.
+        self.gap_filler = GapFiller(self.kite, self.tick_store, instrument_index.symbol_for, self.ticker.tokens)
+        self.rest_scheduler = build_rest_scheduler(self.kite, self.rest_snapshot, self.order_book, self.rest_intervals)
+        self.order_dispatcher = OrderDispatcher(self.kite)
+        if self.record_ticks:
+            self.tick_recorder = TickRecorder(TICK_DATA_DIR).start()
+        self.ticker.on_ticks = self.on_ticks
+        self.ticker.on_connect = self.on_connect
+        self.ticker.on_close = self.on_close
+        self.ticker.on_error = self.on_error
+        self.ticker.on_order_update = self.on_order_update
+        self._targets = {"kite": self.kite, "order_dispatcher": self.order_dispatcher, "rest_scheduler": self.rest_scheduler,
+                         "candle_store": self.candle_store, "ticker": self.ticker, "engine": self}
+        threading.Thread(target=self._publish_loop, name="engine-publish", daemon=True).start()
+        self._send(("ready",))
+        self.ticker.connect(threaded=True)
+        return self
+
+    def on_ticks(self, ws, ticks):
+        started = time.perf_counter()
+        received_at = time.time()
+        try:
+            self.tick_store.update(ticks, received_at)
+            self.candle_store.update(ticks, received_at)
+            if self.tick_recorder is not None:
+                self.tick_recorder.record(ticks, received_at)
+        except Exception as e_tick_ingest:
+            metrics.error("tick_ingest", e_tick_ingest)
+        metrics.observe("stage_seconds", time.perf_counter() - started, stage="tick_ingest")
+
+    def on_order_update(self, ws, data):
+        try:
+            self.order_book.apply_update(data)
+            self.order_dispatcher.on_order_update(data)
+        except Exception as e_order_update:
+            metrics.error("order_update", e_order_update)
+
+    def on_connect(self, ws, response):
+        print(f"[{dt_now_str_fn()}] Engine: WS connected.")
+        self._send(("connected",))
+        self.gap_filler.on_connect()
+
+    def on_close(self, ws, code, reason):
+        print(f"[{dt_now_str_fn()}] Engine: WS closed: {code} - {reason}")
+        self.gap_filler.on_close()
+
+    def on_error(self, ws, code, reason):
+        metrics.error("websocket")
+        print(f"[{dt_now_str_fn()}] Engine: WS error: {code} - {reason}")
+
+    def _ticker_state(self):
+        stats = self.ticker.connection_stats() if hasattr(self.ticker, "connection_stats") else None
+        return ("ticker_state", self.ticker.is_connected(), stats)
+
+    def _publish_loop(self):
+        # Versions are compared locally, so an idle engine sends nothing but the periodic ticker state.
+        rest_versions, rest_errors = {}, {}
+        order_book_version = -1
+        last_state, last_state_at = None, 0.0
+        while not self._stop.wait(ENGINE_PUBLISH_INTERVAL_SECONDS):
+            try:
+                for name in self.rest_intervals:
+                    version = self.rest_snapshot.version(name)
+                    if version != rest_versions.get(name):
+                        rest_versions[name] = version
+                        self._send(("rest", name, self.rest_snapshot.get(name)))
+                    error = self.rest_snapshot.error(name)
+                    if error != rest_errors.get(name):
+                        rest_errors[name] = error
+                        if error is not None:
+                            self._send(("rest_error", name, error))
+                if self.order_book.version != order_book_version:
+                    order_book_version = self.order_book.version
+                    self._send(("orders", self.order_book.orders()))
+                now = time.monotonic()
+                state = self._ticker_state()
+                if state[1] != (last_state and last_state[1]) or now - last_state_at >= ENGINE_TICKER_STATE_INTERVAL_SECONDS:
+                    self._send(state)
+                    last_state, last_state_at = state, now
+            except Exception as e_publish:
+                metrics.error("engine_publish", e_publish)
+                print(f"[{dt_now_str_fn()}] Engine: publish failed: {e_publish}")
+
+    def _call(self, call_id, target, method, args, kwargs):
+        try:
+            if method not in ENGINE_REMOTE_METHODS.get(target, ()):
+                raise AttributeError(f"engine does not expose {target}.{method}")
+            result, error = getattr(self._targets[target], method)(*args, **kwargs), None
+        except Exception as e_call:
+            result, error = None, e_call
+        self.calls_served += 1
+        if call_id is None:
+            if error is not None:
+                metrics.error(f"engine_{target}", error)
+                print(f"[{dt_now_str_fn()}] Engine: {target}.{method} failed: {error}")
+            return
+        try:
+            self._send(("reply", call_id, result, error))
+        except Exception as e_reply: # unpicklable result or exception
+            self._send(("reply", call_id, None, RuntimeError(f"{type(e_reply).__name__}: {e_reply}")))
+
+    def serve(self):
+        # One-way calls (subscription frames) run inline so they reach the ticker in order;
+        # calls waiting on a reply run on the pool.
+        while not self._stop.is_set():
+            try:
+                message = self.conn.recv()
+            except (EOFError, OSError):
+                break
+            if message[0] == "shutdown":
+                break
+            _, call_id, target, method, args, kwargs = message
+            if call_id is None:
+                self._call(call_id, target, method, args, kwargs)
+            else:
+                self._pool.submit(self._call, call_id, target, method, args, kwargs)
+        self.shutdown()
+
+    def metrics_text(self):
+        return metrics.render_prometheus()
+
+    def stats(self):
+        return {"ticks_applied": self.tick_store.ticks_applied, "instruments": len(self.tick_store),
+                "calls_served": self.calls_served, "summary": metrics.summary(),
+                "ticks_recorded": self.tick_recorder.ticks_recorded if self.tick_recorder else None,
+                "gap_fill": self.gap_filler.stats(), "rest_transport": self.transport_stats()}
+
+    def transport_stats(self):
+        return transport_stats(self.kite)
+
+    def shutdown(self):
+        self._stop.set()
+        print(f"[{dt_now_str_fn()}] Engine: shutting down...")
+        for stop in (lambda: self.ticker.stop_retry(), lambda: self.ticker.close(1000, "Engine shutdown"),
+                     lambda: self.order_dispatcher.shutdown(), lambda: self.rest_scheduler.stop(),
+                     lambda: self.tick_recorder and self.tick_recorder.stop(), lambda: self._pool.shutdown(wait=False)):
+            try:
+                stop()
+            except Exception as e_engine_shutdown:
+                print(f"[{dt_now_str_fn()}] Engine: error during shutdown: {e_engine_shutdown}")
+        self.tick_store.close()
+
+def run_engine(conn, tick_table_path, build_clients, rest_intervals, prefetch_exchanges=(), record_ticks=True):
+    # Engine process entry point.
+    engine = Engine(conn, tick_table_path, build_clients, rest_intervals, prefetch_exchanges, record_ticks)
+    try:
+        engine.start()
+    except Exception as e_engine_start:
+        conn.send(("failed", f"{type(e_engine_start).__name__}: {e_engine_start}"))
+        raise
+    engine.serve()
+
+class EngineChannel:
+    # Renderer end of the pipe. A reader thread matches replies to waiting calls and applies
+    # events to the renderer's mirrors: REST results into rest_snapshot, orders into order_book,
+    # connection state and reconnects onto the RemoteTicker.
+    def __init__(self, conn, process, rest_snapshot, order_book):
+        self.conn = conn
+        self.process = process
+        self.rest_snapshot = rest_snapshot
+        self.order_book = order_book
+        self.ticker = None
+        self._ids = itertools.count(1)
+        self._waiting = {} # call id -> [threading.Event, result, error]
+        self._send_lock = threading.Lock()
+        self._ready = threading.Event()
+        self.start_error = None
+        self.closed = False
+        self._reader = threading.Thread(target=self._read_loop, name="engine-channel", daemon=True)
+        self._reader.start()
+
+    def _read_loop(self):
+        while True:
+            try:
+                message = self.conn.recv()
+            except (EOFError, OSError):
+                break
+            try:
+                self._dispatch(message)
+            except Exception as e_engine_event:
+                metrics.error("engine_event", e_engine_event)
+                print(f"[{dt_now_str_fn()}] Engine event {message[0]!r} failed: {e_engine_event}")
+        self.closed = True
+        self._ready.set()
+        for waiter in list(self._waiting.values()):
+            waiter[2] = ConnectionError("engine process exited")
+            waiter[0].set()
+
+    def _dispatch(self, message):
+        kind = message[0]
+        if kind == "reply":
+            waiter = self._waiting.pop(message[1], None)
+            if waiter:
+                waiter[1], waiter[2] = message[2], message[3]
+                waiter[0].set()
+        elif kind == "rest":
+            self.rest_snapshot.publish(message[1], message[2])
+        elif kind == "rest_error":
+            self.rest_snapshot.fail(message[1], message[2])
+        elif kind == "orders":
+            self.order_book.reconcile(message[1])
+        elif kind == "ticker_state" and self.ticker:
+            self.ticker.connected, self.ticker.stats = message[1], message[2]
+        elif kind == "connected" and self.ticker:
+            self.ticker.connected = True
+            if self.ticker.on_connect:
+                self.ticker.on_connect(self.ticker, {})
+        elif kind == "ready":
+            self._ready.set()
+        elif kind == "failed":
+            self.start_error = message[1]
+            self._ready.set()
+
+    def wait_ready(self, timeout=ENGINE_START_TIMEOUT_SECONDS):
+        if not self._ready.wait(timeout):
+            raise TimeoutError(f"engine process not ready after {timeout}s")
+        if self.start_error or self.closed:
+            raise RuntimeError(f"engine process failed to start: {self.start_error or 'exited'}")
+
+    def send(self, target, method, *args, **kwargs):
+        # One-way: nothing waits for the engine.
+        with self._send_lock:
+            self.conn.send(("call", None, target, method, args, kwargs))
+
+    def call(self, target, method, *args, timeout=ENGINE_CALL_TIMEOUT_SECONDS, **kwargs):
+        if self.closed:
+            raise ConnectionError("engine process exited")
+        call_id = next(self._ids)
+        waiter = self._waiting[call_id] = [threading.Event(), None, None]
+        started = time.perf_counter()
+        with self._send_lock:
+            self.conn.send(("call", call_id, target, method, args, kwargs))
+        if not waiter[0].wait(timeout):
+            self._waiting.pop(call_id, None)
+            raise TimeoutError(f"engine call {target}.{method} timed out after {timeout}s")
+        metrics.observe("engine_call_seconds", time.perf_counter() - started, target=target)
+        if waiter[2] is not None:
+            raise waiter[2]
+        return waiter[1]
+
+    def shutdown(self, timeout=10):
+        if not self.closed:
+            try:
+                with self._send_lock:
+                    self.conn.send(("shutdown",))
+            except OSError:
+                pass
+        self.process.join(timeout)
+        if self.process.is_alive():
+            self.process.terminate()
+            self.process.join()
+
+class RemoteProxy:
+    # Stands in for an engine object: proxy.method(...) runs on the engine and returns its result.
+    def __init__(self, channel, target):
+        self._channel = channel
+        self._target = target
+
+    def __getattr__(self, method):
+        if method not in ENGINE_REMOTE_METHODS.get(self._target, ()):
+            raise AttributeError(f"{self._target}.{method} is not available from the engine process")
+        return lambda *args, **kwargs: self._channel.call(self._target, method, *args, **kwargs)
+
+    def __bool__(self):
+        return True
+
+class RemoteTicker:
+    # Ticker interface for the renderer. Subscription frames are forwarded one-way, so the
+    # SubscriptionManager flush never blocks; connection state mirrors the engine's pushes.
+    MODE_LTP, MODE_QUOTE, MODE_FULL = "ltp", "quote", "full"
+
+    def __init__(self, channel):
+        self.channel = channel
+        self.connected = False
+        self.stats = None
+        self.on_ticks = self.on_connect = self.on_close = self.on_error = self.on_order_update = None
+        channel.ticker = self
+
+    def subscribe(self, instrument_tokens):
+        self.channel.send("ticker", "subscribe", list(instrument_tokens))
+        return True
+
+    def unsubscribe(self, instrument_tokens):
+        self.channel.send("ticker", "unsubscribe", list(instrument_tokens))
+        return True
+
+    def set_mode(self, mode, instrument_tokens):
+        self.channel.send("ticker", "set_mode", mode, list(instrument_tokens))
+        return True
+
+    def is_connected(self):
+        return self.connected and not self.channel.closed
+
+    def connection_stats(self):
+        return self.stats or []
+
+    def connect(self, threaded=False, disable_ssl_verification=False, proxy=None):
+        pass # the engine connects its own ticker at startup
+
+    def stop_retry(self):
+        pass
+
+    def close(self, code=None, reason=None):
+        pass
+
+    def stop(self):
+        pass
+
+def start_engine_process(tick_table_path, build_clients, rest_intervals, rest_snapshot, order_book, prefetch_exchanges=(), record_ticks=True):
+    # build_clients must be picklable (a module-level function or functools.partial of one): on
+    # Windows the engine process is spawned and re-imports it. It returns (kite, ticker).
+    parent_conn, child_conn = multiprocessing.Pipe()
+    process = multiprocessing.Process(target=run_engine, name="kite-engine", daemon=True,
+                                      args=(child_conn, tick_table_path, build_clients, rest_intervals, prefetch_exchanges, record_ticks))
+    process.start()
+    child_conn.close()
+    return EngineChannel(parent_conn, process, rest_snapshot, order_book)
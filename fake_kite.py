@@ -0,0 +1,337 @@
+import datetime
+import random
+import threading
+import time
+from collections import deque
+
+# Synthetic stand-ins for KiteConnect and KiteTicker. They expose the methods and payload
+# shapes the project uses so the update functions and the main loop can run on any box.
+
+NSE_SEGMENT, NFO_SEGMENT, INDICES_SEGMENT = 1, 2, 9
+NIFTY_SPOT_TOKEN = 256265
+QUOTE_BATCH_LIMIT = 500
+
+def _round_tick(price):
+    return round(round(price / 0.05) * 0.05, 2)
+
+def next_weekly_expiry(today=None, weekday=3):
+    today = today or datetime.date.today()
+    return today + datetime.timedelta(days=(weekday - today.weekday()) % 7)
+
+class FakeKiteConnect:
+    def __init__(self, n_options=500, n_equities=20, n_positions=10, seed=7, rest_latency_seconds=0.0, spot=24000.0):
+        self.rng = random.Random(seed)
+        self.rest_latency_seconds = rest_latency_seconds
+        self.access_token = "fake-access-token"
+        self.ticker = None
+        self._lock = threading.Lock()
+        self._call_log = deque(maxlen=100000)
+        self.call_counts = {}
+        self._instruments = {"NSE": [], "NFO": []}
+        self.prices = {}
+        self.symbols = {}
+        self._orders = []
+        self._order_seq = 0
+        self._build_instruments(n_options, n_equities, spot)
+        self._build_portfolio(n_positions)
+
+    def _build_instruments(self, n_options, n_equities, spot):
+        self._instruments["NSE"].append(dict(
+            instrument_token=NIFTY_SPOT_TOKEN, exchange_token=1001, tradingsymbol="NIFTY 50", name="NIFTY 50",
+            last_price=0.0, expiry="", strike=0.0, tick_size=0.0, lot_size=0, instrument_type="EQ",
+            segment="INDICES", exchange="NSE"))
+        self.prices[NIFTY_SPOT_TOKEN] = spot
+        self.symbols[NIFTY_SPOT_TOKEN] = "NSE:NIFTY 50"
+        for i in range(n_equities):
+            token = ((5000 + i) << 8) | NSE_SEGMENT
+            tsym = f"STOCK{i}"
+            self._instruments["NSE"].append(dict(
+                instrument_token=token, exchange_token=5000 + i, tradingsymbol=tsym, name=tsym, last_price=0.0,
+                expiry="", strike=0.0, tick_size=0.05, lot_size=1, instrument_type="EQ", segment="NSE", exchange="NSE"))
+            self.prices[token] = _round_tick(self.rng.uniform(100, 3000))
+            self.symbols[token] = f"NSE:{tsym}"
+        expiry = next_weekly_expiry()
+        atm = round(spot / 50) * 50
+        n_strikes = max(1, (n_options + 1) // 2)
+        first_strike = atm - 50 * (n_strikes // 2)
+        exchange_token = 20000
+        for k in range(n_strikes):
+            strike = first_strike + 50 * k
+            for opt_type in ("CE", "PE"):
+                if len(self._instruments["NFO"]) >= n_options:
+                    break
+                exchange_token += 1
+                token = (exchange_token << 8) | NFO_SEGMENT
+                tsym = f"NIFTY{expiry.strftime('%y%b').upper()}{int(strike)}{opt_type}"
+                self._instruments["NFO"].append(dict(
+                    instrument_token=token, exchange_token=exchange_token, tradingsymbol=tsym, name="NIFTY",
+                    last_price=0.0, expiry=expiry, strike=float(strike), tick_size=0.05, lot_size=75,
+                    instrument_type=opt_type, segment="NFO-OPT", exchange="NFO"))
+                intrinsic = max(spot - strike, 0) if opt_type == "CE" else max(strike - spot, 0)
+                self.prices[token] = _round_tick(intrinsic + self.rng.uniform(5, 150))
+                self.symbols[token] = f"NFO:{tsym}"
+        self.symbol_to_token = {sym: tok for tok, sym in self.symbols.items()}
+
+    def _build_portfolio(self, n_positions):
+        options = self._instruments["NFO"][:n_positions]
+        self._positions = [dict(
+            tradingsymbol=inst["tradingsymbol"], exchange="NFO", instrument_token=inst["instrument_token"],
+            product="NRML", quantity=75 * self.rng.choice((-2, -1, 1, 2)),
+            average_price=self.prices[inst["instrument_token"]], multiplier=1, realised=0.0,
+            buy_value=0.0, sell_value=0.0, close_price=self.prices[inst["instrument_token"]],
+        ) for inst in options]
+        for pos in self._positions:
+            value = abs(pos["quantity"]) * pos["average_price"]
+            pos["buy_value" if pos["quantity"] > 0 else "sell_value"] = value
+        self._holdings = [dict(
+            tradingsymbol=inst["tradingsymbol"], exchange="NSE", instrument_token=inst["instrument_token"],
+            isin=f"INE{inst['exchange_token']:07d}", quantity=self.rng.randint(1, 100), t1_quantity=0,
+            average_price=self.prices[inst["instrument_token"]], close_price=self.prices[inst["instrument_token"]],
+        ) for inst in self._instruments["NSE"][1:]]
+
+    def _call(self, endpoint):
+        with self._lock:
+            self.call_counts[endpoint] = self.call_counts.get(endpoint, 0) + 1
+            self._call_log.append((time.time(), endpoint))
+        if self.rest_latency_seconds:
+            time.sleep(self.rest_latency_seconds)
+
+    def calls_per_minute(self, window_seconds=60.0):
+        cutoff = time.time() - window_seconds
+        with self._lock:
+            recent = [endpoint for ts, endpoint in self._call_log if ts >= cutoff]
+        scale = 60.0 / window_seconds
+        counts = {}
+        for endpoint in recent:
+            counts[endpoint] = counts.get(endpoint, 0) + 1
+        return {endpoint: n * scale for endpoint, n in counts.items()}, len(recent) * scale
+
+    def option_symbols(self):
+        return [f"NFO:{inst['tradingsymbol']}" for inst in self._instruments["NFO"]]
+
+    def tokens(self):
+        return list(self.symbols)
+
+    def instruments(self, exchange=None):
+        self._call("instruments")
+        if exchange:
+            return [dict(i) for i in self._instruments.get(exchange, [])]
+        return [dict(i) for rows in self._instruments.values() for i in rows]
+
+    def _quote_for(self, token):
+        ltp = self.prices[token]
+        return {
+            "instrument_token": token, "last_price": ltp, "volume": 1000, "average_price": ltp,
+            "ohlc": {"open": ltp, "high": ltp, "low": ltp, "close": ltp},
+            "depth": {"buy": [{"price": _round_tick(ltp - 0.05), "quantity": 75, "orders": 1}],
+                      "sell": [{"price": _round_tick(ltp + 0.05), "quantity": 75, "orders": 1}]},
+        }
+
+    def quote(self, instruments):
+        self._call("quote")
+        if isinstance(instruments, str):
+            instruments = [instruments]
+        if len(instruments) > QUOTE_BATCH_LIMIT:
+            raise ValueError(f"quote accepts at most {QUOTE_BATCH_LIMIT} instruments")
+        return {sym: self._quote_for(self.symbol_to_token[sym]) for sym in instruments if sym in self.symbol_to_token}
+
+    def ltp(self, instruments):
+        self._call("ltp")
+        return {sym: {"instrument_token": self.symbol_to_token[sym], "last_price": self.prices[self.symbol_to_token[sym]]}
+                for sym in instruments if sym in self.symbol_to_token}
+
+    def positions(self):
+        self._call("positions")
+        net = []
+        for pos in self._positions:
+            ltp = self.prices[pos["instrument_token"]]
+            p = dict(pos, last_price=ltp)
+            p["pnl"] = (p["sell_value"] - p["buy_value"]) + p["quantity"] * ltp * p["multiplier"]
+            p["m2m"] = p["pnl"]
+            p["unrealised"] = p["pnl"]
+            net.append(p)
+        return {"net": net, "day": []}
+
+    def holdings(self):
+        self._call("holdings")
+        out = []
+        for h in self._holdings:
+            ltp = self.prices[h["instrument_token"]]
+            out.append(dict(h, last_price=ltp, pnl=(ltp - h["average_price"]) * h["quantity"],
+                            day_change=ltp - h["close_price"], day_change_percentage=(ltp / h["close_price"] - 1) * 100))
+        return out
+
+    def margins(self, segment=None):
+        self._call("margins")
+        return {"equity": {"net": 500000.0, "utilised": {"debits": 120000.0}, "available": {"cash": 380000.0}}}
+
+    def orders(self):
+        self._call("orders")
+        with self._lock:
+            return [dict(o) for o in self._orders]
+
+    def order_history(self, order_id):
+        self._call("order_history")
+        with self._lock:
+            return [dict(o) for o in self._orders if o["order_id"] == str(order_id)]
+
+    def place_order(self, variety, exchange, tradingsymbol, transaction_type, quantity, product, order_type,
+                    price=None, trigger_price=None, validity=None, tag=None, **kwargs):
+        self._call("place_order")
+        with self._lock:
+            self._order_seq += 1
+            order_id = f"2510{self._order_seq:011d}"
+            order = dict(order_id=order_id, variety=variety, exchange=exchange, tradingsymbol=tradingsymbol,
+                         transaction_type=transaction_type, quantity=quantity, product=product, order_type=order_type,
+                         price=price or 0.0, trigger_price=trigger_price or 0.0, validity=validity, tag=tag,
+                         status="OPEN", filled_quantity=0, pending_quantity=quantity, average_price=0.0,
+                         order_timestamp=datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"), parent_order_id=None)
+            self._orders.append(order)
+        if self.ticker is not None:
+            self.ticker.push_order_update(dict(order))
+            if order_type == "MARKET":
+                token = self.symbol_to_token.get(f"{exchange}:{tradingsymbol}")
+                with self._lock:
+                    order.update(status="COMPLETE", filled_quantity=quantity, pending_quantity=0,
+                                 average_price=self.prices.get(token, 0.0))
+                self.ticker.push_order_update(dict(order))
+        return order_id
+
+    def modify_order(self, variety, order_id, **kwargs):
+        self._call("modify_order")
+        with self._lock:
+            for order in self._orders:
+                if order["order_id"] == str(order_id):
+                    order.update({k: v for k, v in kwargs.items() if v is not None})
+        return order_id
+
+    def cancel_order(self, variety, order_id, parent_order_id=None):
+        self._call("cancel_order")
+        with self._lock:
+            for order in self._orders:
+                if order["order_id"] == str(order_id):
+                    order["status"] = "CANCELLED"
+        return order_id
+
+class FakeKiteTicker:
+    MODE_LTP, MODE_QUOTE, MODE_FULL = "ltp", "quote", "full"
+
+    def __init__(self, kite, ticks_per_second=1000, batch_interval_seconds=0.05, seed=11):
+        self.kite = kite
+        kite.ticker = kite.ticker or self # the first ticker created receives order updates
+        self.ticks_per_second = ticks_per_second
+        self.batch_interval_seconds = batch_interval_seconds
+        self.rng = random.Random(seed)
+        self.on_ticks = self.on_connect = self.on_close = self.on_error = self.on_order_update = None
+        self.subscribed_tokens = {}
+        self.ticks_emitted = 0
+        self.last_emitted_at = {} # token -> wall time of the most recent tick, used for latency measurement
+        self.emitted_prices = {} # (token, ltp) -> wall time that price was last sent
+        self._connected = False
+        self._stop = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def subscribe(self, instrument_tokens):
+        with self._lock:
+            for token in instrument_tokens:
+                self.subscribed_tokens.setdefault(token, self.MODE_QUOTE)
+        return True
+
+    def unsubscribe(self, instrument_tokens):
+        with self._lock:
+            for token in instrument_tokens:
+                self.subscribed_tokens.pop(token, None)
+        return True
+
+    def tokens(self):
+        with self._lock:
+            return list(self.subscribed_tokens)
+
+    def set_mode(self, mode, instrument_tokens):
+        with self._lock:
+            for token in instrument_tokens:
+                self.subscribed_tokens[token] = mode
+        return True
+
+    def is_connected(self):
+        return self._connected
+
+    def _tick(self, token, mode, now):
+        prices = self.kite.prices
+        ltp = _round_tick(max(0.05, prices[token] + self.rng.choice((-0.1, -0.05, 0.05, 0.1))))
+        prices[token] = ltp
+        tick = {"tradable": True, "mode": mode, "instrument_token": token, "last_price": ltp}
+        if mode != self.MODE_LTP:
+            tick.update({"last_traded_quantity": 75, "average_traded_price": ltp, "volume_traded": self.ticks_emitted,
+                         "total_buy_quantity": 1000, "total_sell_quantity": 1000,
+                         "ohlc": {"open": ltp, "high": ltp, "low": ltp, "close": ltp}})
+        if mode == self.MODE_FULL:
+            ts = datetime.datetime.fromtimestamp(now)
+            tick.update({"last_trade_time": ts, "exchange_timestamp": ts, "oi": 100000,
+                         "depth": {"buy": [{"price": _round_tick(ltp - 0.05), "quantity": 75, "orders": 1}] * 5,
+                                   "sell": [{"price": _round_tick(ltp + 0.05), "quantity": 75, "orders": 1}] * 5}})
+        self.last_emitted_at[token] = now
+        self.emitted_prices[(token, ltp)] = now
+        return tick
+
+    def _run(self):
+        carry = 0.0
+        while not self._stop.is_set():
+            started = time.time()
+            with self._lock:
+                subscribed = list(self.subscribed_tokens.items())
+            carry += self.ticks_per_second * self.batch_interval_seconds
+            n = int(carry)
+            carry -= n
+            if subscribed and n and self.on_ticks:
+                batch = [self._tick(token, mode, started) for token, mode in
+                         (subscribed[self.rng.randrange(len(subscribed))] for _ in range(n))]
+                self.ticks_emitted += len(batch)
+                self.on_ticks(self, batch)
+            self._stop.wait(max(0.0, self.batch_interval_seconds - (time.time() - started)))
+
+    def connect(self, threaded=False, disable_ssl_verification=False, proxy=None):
+        self._stop.clear()
+        self._connected = True
+        if self.on_connect:
+            self.on_connect(self, {})
+        self._thread = threading.Thread(target=self._run, name="fake-ticker", daemon=True)
+        self._thread.start()
+        if not threaded:
+            self._thread.join()
+
+    def push_order_update(self, order):
+        if self.on_order_update:
+            self.on_order_update(self, order)
+
+    def drop_connection(self, reconnect_after_seconds=0.5):
+        # Simulates a socket drop: the server forgets subscriptions and the client reconnects.
+        self._connected = False
+        with self._lock:
+            self.subscribed_tokens = {}
+        if self.on_close:
+            self.on_close(self, 1006, "connection dropped")
+        def reconnect():
+            time.sleep(reconnect_after_seconds)
+            self._connected = True
+            if self.on_connect:
+                self.on_connect(self, {})
+        threading.Thread(target=reconnect, daemon=True).start()
+
+    def stop_retry(self):
+        pass
+
+    def close(self, code=None, reason=None):
+        self._stop.set()
+        self._connected = False
+        if self.on_close:
+            self.on_close(self, code, reason)
+
+    def stop(self):
+        self.close()
+
+def fake_engine_clients(n_options=500, ticks_per_second=1000, rest_latency_seconds=0.0):
+    # build_clients for engine.start_engine_process, so the engine process can run on synthetic data.
+    kite = FakeKiteConnect(n_options=n_options, rest_latency_seconds=rest_latency_seconds)
+    return kite, FakeKiteTicker(kite, ticks_per_second=ticks_per_second)
@@ -1,11 +1,20 @@
 import datetime
 import os
-from kiteconnect.exceptions import KiteException
+import time
+from quote_cache import rest_quote_cache
+from sheet_writer import sheet_writer, cell_to_row_col
+from sheet_snapshot import SheetSnapshot
+from order_dispatcher import new_order_tag, OrderUnconfirmedError, OrderInFlightError
+from metrics import metrics
+from order_book import TERMINAL_ORDER_STATUSES
 
 MAX_INPUT_ROWS = 200
 MAX_PORTFOLIO_ROWS = 50 
 MAX_HOLDINGS_ROWS = 100 
 MAX_ORDERS_ROWS = 100
+INPUT_LAST_COLUMN = 25 # INPUT!A:Y holds everything the per-cycle processors read
+INPUT_SECTION_LABELS = ("HOLDINGS", "PORTFOLIO", "MANUAL")
+EXCEL_UNION_ADDRESS_MAX_CHARS = 255 # Excel rejects longer multi-area Range addresses
 
 def dt_now_str_fn():
     return datetime.datetime.now().strftime("%H:%M:%S.%f")[:-3]
@@ -19,29 +28,45 @@ def get_default_lot_size(symbol):
     elif "SENSEX" in symbol_upper: return 10
     else: return 1
 
-def fetch_holdings(kite):
+def update_sheet_with_data(sheet, data_rows, start_cell_str, num_data_cols, max_total_rows_in_display_area, timestamp_cell_str=None, writer=sheet_writer):
     try:
-        return kite.holdings()
-    except KiteException as e:
-        print(f"[{dt_now_str_fn()}] Kite API Error fetching holdings: {e}")
-    except Exception as e:
-        print(f"[{dt_now_str_fn()}] General Error fetching holdings: {e}")
-    return []
-
-def update_sheet_with_data(sheet, data_rows, start_cell_str, num_data_cols, max_total_rows_in_display_area, timestamp_cell_str=None):
-    try:
-        if data_rows and isinstance(data_rows, list) and len(data_rows) > 0:
-            sheet.range(start_cell_str).value = data_rows
+        if not isinstance(data_rows, list):
+            data_rows = []
+        start_row, _ = cell_to_row_col(start_cell_str)
+        display_rows = max(max_total_rows_in_display_area - start_row + 1, len(data_rows))
+        padded_rows = [(list(r) + [""] * num_data_cols)[:num_data_cols] for r in data_rows]
+        padded_rows += [[""] * num_data_cols] * (display_rows - len(padded_rows))
+        writer.write_range(sheet, start_cell_str, padded_rows)
         if timestamp_cell_str:
-            sheet.range(timestamp_cell_str).value = f"Last Updated: {datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')}"
+            writer.write_range(sheet, timestamp_cell_str, [[f"Last Updated: {datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')}"]])
             
     except Exception as e_update_sheet_helper:
+        metrics.error("update_sheet_with_data", e_update_sheet_helper)
         print(f"[{dt_now_str_fn()}] ERROR in update_sheet_with_data for {sheet.name}: {e_update_sheet_helper}")
 
-def clear_row_except_column_a(sheet, row_num, max_col=25):
-    sheet.range((row_num, 2), (row_num, max_col)).value = [[""] * (max_col - 1)]
+def set_column_bold(sheet, col_letter, first_row, last_row, bold_rows):
+    # Two format calls instead of one per cell: un-bold the whole column block, then bold the
+    # wanted rows through comma-joined union addresses.
+    sheet.range(f"{col_letter}{first_row}:{col_letter}{last_row}").font.bold = False
+    chunk = []
+    for row in bold_rows:
+        address = f"{col_letter}{row}"
+        if chunk and len(",".join(chunk)) + len(address) + 1 > EXCEL_UNION_ADDRESS_MAX_CHARS:
+            sheet.range(",".join(chunk)).font.bold = True
+            chunk = []
+        chunk.append(address)
+    if chunk:
+        sheet.range(",".join(chunk)).font.bold = True
+
+def read_input_snapshot(inp_sheet, max_rows=MAX_INPUT_ROWS):
+    return SheetSnapshot.read(inp_sheet, 1, 1, max_rows + 1, INPUT_LAST_COLUMN)
 
-def update_input_sheet(sheet, kite, holdings, quotes, current_positions):
+def clear_row_except_column_a(sheet, row_num, max_col=25, writer=sheet_writer):
+    writer.write_block(sheet, row_num, 2, [[""] * (max_col - 1)])
+
+def update_input_sheet(sheet, kite, holdings, quotes, current_positions, writer=sheet_writer, rows=None, stale_after_seconds=None):
+    # rows: optional set of sheet rows to draw this frame; the rest keep their current values.
+    # stale_after_seconds: rows whose live tick is older than this show "STALE <tick time>" in column R.
     pos_qty_map, pos_pnl_map = {}, {}
     if current_positions:
         for pos in current_positions:
@@ -57,7 +82,11 @@ def update_input_sheet(sheet, kite, holdings, quotes, current_positions):
             hold_pnl_map[key] = h.get('pnl', None)
 
     symbols_data = sheet.range(f"A2:A{MAX_INPUT_ROWS + 1}").value
+    if rows is not None:
+        symbols_data = [s if i + 2 in rows else None for i, s in enumerate(symbols_data)]
+    prefetch_quote_fallbacks(symbols_data, quotes, kite)
     now_str_timestamp = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    stale_before = time.time() - stale_after_seconds if stale_after_seconds else None
 
     qty_list = []
     price_rows = []
@@ -74,7 +103,7 @@ def update_input_sheet(sheet, kite, holdings, quotes, current_positions):
             continue
         symbol_str = symbol_cell.strip().upper()
         if symbol_str in ("HOLDINGS", "PORTFOLIO", "MANUAL") or ":" not in symbol_str:
-            clear_row_except_column_a(sheet, row_num, max_col=25)
+            clear_row_except_column_a(sheet, row_num, max_col=25, writer=writer)
             qty_list.append("")
             price_rows.append([""]*9)
             timestamp_list.append("")
@@ -84,21 +113,36 @@ def update_input_sheet(sheet, kite, holdings, quotes, current_positions):
         if qty == "" or qty == 0:
             qty = hold_qty_map.get(symbol_str, "")
         qty_list.append(qty)
-        price_row = get_price_fields_with_fallback(symbol_str, quotes, kite)
-        price_rows.append(price_row)
-        timestamp_list.append(now_str_timestamp)
+        q_data = quote_with_fallback(symbol_str, quotes, kite)
+        price_rows.append(price_fields(q_data))
+        received_at = q_data.get("received_at") if stale_before else None
+        if q_data.get("stale_since"):
+            # REST fallback quote kept on screen while its refresh is failing.
+            timestamp_list.append(f"STALE {datetime.datetime.fromtimestamp(q_data['stale_since']).strftime('%H:%M:%S')}")
+        elif received_at and received_at < stale_before:
+            timestamp_list.append(f"STALE {datetime.datetime.fromtimestamp(received_at).strftime('%H:%M:%S')}")
+        else:
+            timestamp_list.append(now_str_timestamp)
         pnl_val = pos_pnl_map.get(symbol_str)
         if pnl_val in ("", None):
             pnl_val = hold_pnl_map.get(symbol_str)
         pnl_list.append(pnl_val if pnl_val not in (None, "") else "")
 
-    # Now write in batch:
-    sheet.range(f"B2:B{MAX_INPUT_ROWS+1}").value = [[q] for q in qty_list]
-    sheet.range(f"C2:K{MAX_INPUT_ROWS+1}").value = price_rows
-    sheet.range(f"R2:R{MAX_INPUT_ROWS+1}").value = [[t] for t in timestamp_list]
-    sheet.range(f"Q2:Q{MAX_INPUT_ROWS+1}").value = [[p] for p in pnl_list]
+    # Only cells that changed since the last pass reach Excel:
+    if rows is None:
+        writer.write_block(sheet, 2, 2, [[q] + p for q, p in zip(qty_list, price_rows)])
+        writer.write_block(sheet, 2, 17, [[p, t] for p, t in zip(pnl_list, timestamp_list)])
+        return
+    cells = {}
+    for row_num in rows:
+        i = row_num - 2
+        if 0 <= i < len(qty_list):
+            for c_off, value in enumerate([qty_list[i]] + price_rows[i]):
+                cells[(row_num, 2 + c_off)] = value
+            cells[(row_num, 17)], cells[(row_num, 18)] = pnl_list[i], timestamp_list[i]
+    writer.write_cells(sheet, cells)
 
-def update_portfolio_sheet(sheet_port, positions, quotes):
+def update_portfolio_sheet(sheet_port, positions, quotes, writer=sheet_writer):
     portfolio_rows_data = []
     if positions:
         for pos in positions:
@@ -114,11 +158,11 @@ def update_portfolio_sheet(sheet_port, positions, quotes):
             portfolio_rows_data.append([
                 pos.get('instrument_token', ''), tsym_p, exch_p, pos.get('quantity'),
                 pos.get('average_price'), live_ltp_p, pnl_p,
-                pos.get('realised_pnl', ''), pos.get('m2m', pos.get('unrealised_pnl', pnl_p))
+                pos.get('realised', pos.get('realised_pnl', '')), pos.get('m2m', pos.get('unrealised_pnl', pnl_p))
             ])
-    update_sheet_with_data(sheet_port, portfolio_rows_data, "A2", 9, MAX_PORTFOLIO_ROWS + 1, "K1")
+    update_sheet_with_data(sheet_port, portfolio_rows_data, "A2", 9, MAX_PORTFOLIO_ROWS + 1, "K1", writer=writer)
 
-def update_holdings_sheet(sheet_hold, holdings, quotes):
+def update_holdings_sheet(sheet_hold, holdings, quotes, writer=sheet_writer):
     holding_rows_data = []
     if holdings:
         for h_item in holdings:
@@ -134,14 +178,13 @@ def update_holdings_sheet(sheet_hold, holdings, quotes):
                 h_item.get('average_price'), live_ltp_h, h_item.get('close_price', ''), pnl_h,
                 h_item.get('day_change', ''), h_item.get('day_change_percentage', '')
             ])
-    update_sheet_with_data(sheet_hold, holding_rows_data, "A2", 11, MAX_HOLDINGS_ROWS + 1, "L1")
+    update_sheet_with_data(sheet_hold, holding_rows_data, "A2", 11, MAX_HOLDINGS_ROWS + 1, "L1", writer=writer)
 
-def update_orders_sheet(sheet_ords, kite, clear_all):
+def update_orders_sheet(sheet_ords, orders_api_data, clear_all, writer=sheet_writer):
     try:
         if clear_all:
-            sheet_ords.range("A2:P201").value = [[""]*16]*200
+            writer.write_block(sheet_ords, 2, 1, [[""]*16]*200, force=True)
 
-        orders_api_data = kite.orders()
         orders_rows_for_sheet = []
         if orders_api_data:
             for o_item in orders_api_data:
@@ -163,8 +206,9 @@ def update_orders_sheet(sheet_ords, kite, clear_all):
                     o_item.get("order_timestamp"),
                     o_item.get("parent_order_id", "")
                 ])
-        update_sheet_with_data(sheet_ords, orders_rows_for_sheet, "A2", 16, MAX_ORDERS_ROWS + 1, "AA1")
+        update_sheet_with_data(sheet_ords, orders_rows_for_sheet, "A2", 16, MAX_ORDERS_ROWS + 1, "AA1", writer=writer)
     except Exception as e:
+        metrics.error("update_orders_sheet", e)
         print(f"Error updating orders sheet: {e}")
 
 def process_order_modifications(sheet_ords, kite):
@@ -189,13 +233,15 @@ def process_order_modifications(sheet_ords, kite):
             if cancel_flag in ["YES", "CANCEL", "C"]:
                 if status in ["OPEN", "TRIGGER PENDING", "AMO MODIFIED", "AMO REQ RECEIVED"]:
                     try:
-                        if variety == 'co' and parent_order_id:
-                            kite.cancel_order(variety=variety, order_id=order_id, parent_order_id=str(parent_order_id))
-                        else:
-                            kite.cancel_order(variety=variety, order_id=order_id)
+                        with metrics.timer("rest_call_seconds", endpoint="cancel_order"):
+                            if variety == 'co' and parent_order_id:
+                                kite.cancel_order(variety=variety, order_id=order_id, parent_order_id=str(parent_order_id))
+                            else:
+                                kite.cancel_order(variety=variety, order_id=order_id)
                         sheet_ords.range(f"R{excel_row_num}").value = "Cancelled"
                         print(f"Order {order_id} cancelled successfully")
                     except Exception as e:
+                        metrics.error("rest_cancel_order", e)
                         print(f"Order can't be cancelled with reason : {e}")
                         sheet_ords.range(f"R{excel_row_num}").value = f"Cancel Error: {str(e)[:20]}"
                 else:
@@ -234,12 +280,14 @@ def process_order_modifications(sheet_ords, kite):
                             modify_params["parent_order_id"] = str(parent_order_id)
                         
                         print(f"Modifying order with params: {modify_params}")
-                        modified_order_id = kite.modify_order(**modify_params)
+                        with metrics.timer("rest_call_seconds", endpoint="modify_order"):
+                            modified_order_id = kite.modify_order(**modify_params)
                         sheet_ords.range(f"Q{excel_row_num}").value = f"Modified: {modified_order_id}"
                         sheet_ords.range(f"S{excel_row_num}:X{excel_row_num}").value = ""
                         print(f"Order {order_id} modified successfully")
                         
                     except Exception as e:
+                        metrics.error("rest_modify_order", e)
                         error_msg = f"Modify Error: {str(e)[:30]}"
                         sheet_ords.range(f"Q{excel_row_num}").value = error_msg
                         print(f"Modify failed for {order_id}: {e}")
@@ -247,27 +295,32 @@ def process_order_modifications(sheet_ords, kite):
                     sheet_ords.range(f"Q{excel_row_num}").value = "Not Modifiable"
                     
     except Exception as e:
+        metrics.error("process_order_modifications", e)
         print(f"Error in process_order_modifications: {e}")
         import traceback
         traceback.print_exc()
 
-def update_settings_sheet(sheet_sett, kite):
+def update_settings_sheet(sheet_sett, margins, writer=sheet_writer, error=None):
+    # error: the last margins refresh failure, if it failed after margins were fetched.
+    if error and "timed out" in error.lower():
+        print(f"[{dt_now_str_fn()}] Kite API Error fetching margin info: {error}")
+        writer.write_range(sheet_sett, "B4", [["Timeout"]])
+        return
+    if not margins:
+        return
     try:
-        margins = kite.margins() 
         net_margin = margins.get("equity", {}).get("net", "") 
         used_margin = margins.get("equity", {}).get("utilised", {}).get("debits", "")
         available_cash = margins.get("equity", {}).get("available", {}).get("cash", "") 
         data_to_write_margins = [
             ["Available Margin", net_margin], ["Used Margin", used_margin], ["Available Cash", available_cash]
         ]
-        sheet_sett.range("A4").value = data_to_write_margins 
-        sheet_sett.range("C1").value = f"Last Updated: {datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')}"
-    except KiteException as ke_margins:
-        print(f"[{dt_now_str_fn()}] Kite API Error fetching/writing margin info: {ke_margins}")
-        if "timed out" in str(ke_margins).lower(): sheet_sett.range("B4").value = "Timeout" 
+        writer.write_range(sheet_sett, "A4", data_to_write_margins)
+        writer.write_range(sheet_sett, "C1", [[f"Last Updated: {datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')}"]])
     except Exception as e_margin_gen:
-        print(f"[{dt_now_str_fn()}] General Error fetching/writing margin info: {e_margin_gen}")
-        sheet_sett.range("B4").value = "Error"
+        metrics.error("update_settings_sheet", e_margin_gen)
+        print(f"[{dt_now_str_fn()}] General Error writing margin info: {e_margin_gen}")
+        writer.write_range(sheet_sett, "B4", [["Error"]])
 
 def should_clear_today(config_file="last_clear_date.txt"):
     today_str = datetime.datetime.now().strftime("%Y-%m-%d")
@@ -281,11 +334,12 @@ def should_clear_today(config_file="last_clear_date.txt"):
         return True
     return False
 
-def autofill_input_sheet_with_portfolio_holdings(inp_sheet, positions, holdings, max_rows=200, clear_all=False):
+def autofill_input_sheet_with_portfolio_holdings(inp_sheet, positions, holdings, max_rows=200, clear_all=False, writer=sheet_writer, snapshot=None):
+    # Returns the INPUT snapshot with column A as this call left it.
+    snapshot = snapshot or SheetSnapshot.read(inp_sheet, 1, 1, max_rows + 1, 1)
     if clear_all:
-        inp_sheet.range(f"A2:A{max_rows+1}").value = [[""]] * max_rows
-        inp_sheet.range(f"B2:K{max_rows+1}").value = [[""]*10] * max_rows
-        inp_sheet.range(f"Q2:R{max_rows+1}").value = [[""]*2] * max_rows
+        writer.write_block(inp_sheet, 2, 2, [[""]*10] * max_rows, force=True)
+        writer.write_block(inp_sheet, 2, 17, [[""]*2] * max_rows, force=True)
     holdings_syms = []
     holdings_set = set()
     for h in holdings:
@@ -317,15 +371,11 @@ def autofill_input_sheet_with_portfolio_holdings(inp_sheet, positions, holdings,
             all_rows.append("PORTFOLIO")
             all_rows.extend(portfolio_syms)
         all_rows.append("MANUAL")
-        inp_sheet.range(f"A2:A{max_rows+1}").value = [[s] for s in all_rows] + [[""]] * (max_rows - len(all_rows))
-        for i, s in enumerate(all_rows):
-            cell = inp_sheet.range(f"A{2 + i}")
-            if s in ("HOLDINGS", "PORTFOLIO", "MANUAL"):
-                cell.font.bold = True
-            else:
-                cell.font.bold = False
-        return
-    existing = inp_sheet.range(f"A2:A{max_rows+1}").value
+        column_a = all_rows + [""] * (max_rows - len(all_rows))
+        inp_sheet.range(f"A2:A{max_rows+1}").value = [[s] for s in column_a]
+        set_column_bold(inp_sheet, "A", 2, max_rows + 1, [2 + i for i, s in enumerate(all_rows) if s in INPUT_SECTION_LABELS])
+        return snapshot.with_values({(2 + i, 1): s for i, s in enumerate(column_a)})
+    existing = snapshot.column(1, 2, max_rows + 1)
     manual_start = None
     for i, s in enumerate(existing):
         if isinstance(s, str) and s.strip().upper() == "MANUAL":
@@ -339,18 +389,41 @@ def autofill_input_sheet_with_portfolio_holdings(inp_sheet, positions, holdings,
         all_rows.append("PORTFOLIO")
         all_rows.extend(portfolio_syms)
     if manual_start is not None:
-        inp_sheet.range(f"A2:A{2+manual_start}").value = [[s] for s in all_rows + ["MANUAL"]]
-    else:
-        inp_sheet.range(f"A2:A{len(all_rows)+2}").value = [[s] for s in all_rows]
+        all_rows.append("MANUAL")
+    if not all_rows:
+        return snapshot
+    # Rewriting column A with what is already there only costs a COM call.
+    if [s.strip().upper() if isinstance(s, str) else s for s in existing[:len(all_rows)]] == all_rows:
+        return snapshot
+    inp_sheet.range(f"A2:A{len(all_rows)+1}").value = [[s] for s in all_rows]
+    return snapshot.with_values({(2 + i, 1): s for i, s in enumerate(all_rows)})
 
-def get_price_fields_with_fallback(symbol_str, quotes, kite):
+def needs_quote_fallback(q_data):
+    return not q_data or not q_data.get("last_price")
+
+def prefetch_quote_fallbacks(symbol_cells, quotes, kite, quote_cache=rest_quote_cache):
+    missing = []
+    for symbol_cell in symbol_cells:
+        if not isinstance(symbol_cell, str) or ":" not in symbol_cell:
+            continue
+        symbol_str = symbol_cell.strip().upper()
+        if needs_quote_fallback(quotes.get(symbol_str)):
+            missing.append(symbol_str)
+    if missing:
+        quote_cache.prefetch(missing, kite)
+
+def quote_with_fallback(symbol_str, quotes, kite, quote_cache=rest_quote_cache):
     q_data = quotes.get(symbol_str, {})
-    if not q_data or not q_data.get("last_price"):
-        try:
-            rest_quote = kite.quote([symbol_str])
-            q_data = rest_quote.get(symbol_str, q_data)
-        except Exception:
-            pass
+    if needs_quote_fallback(q_data):
+        rest_q_data = quote_cache.get(symbol_str, kite)
+        if rest_q_data:
+            q_data = rest_q_data
+    return q_data
+
+def get_price_fields_with_fallback(symbol_str, quotes, kite, quote_cache=rest_quote_cache):
+    return price_fields(quote_with_fallback(symbol_str, quotes, kite, quote_cache))
+
+def price_fields(q_data):
     volume_val = q_data.get("volume")
     if not volume_val:
         volume_val = q_data.get("volume_traded", "")
@@ -379,9 +452,83 @@ def get_price_fields_with_fallback(symbol_str, quotes, kite):
     ]
     return price_row
 
-def process_input_sheet_orders(sheet_inp, kite, order_id_map):
+def build_order_params(row):
+    symbol, qty, direction = row[0], row[11], row[12]
+    variety, order_type, product, validity = row[18], row[19], row[20], row[21]
+    price, trigger_price, ttl_minutes = row[22], row[23], row[24]
+    exchange, tradingsymbol = symbol.strip().upper().split(":")
+    order_params = dict(
+        variety=variety.strip().lower(),
+        exchange=exchange,
+        tradingsymbol=tradingsymbol,
+        transaction_type=direction.strip().upper(),
+        quantity=int(qty),
+        order_type=order_type.strip().upper(),
+        product=product.strip().upper(),
+        validity=validity.strip().upper()
+    )
+    if order_type.strip().upper() in ["LIMIT", "SL", "SL-M"] and price:
+        order_params["price"] = float(price)
+    if order_type.strip().upper() in ["SL", "SL-M"] and trigger_price:
+        order_params["trigger_price"] = float(trigger_price)
+    if validity.strip().upper() == "TTL" and ttl_minutes:
+        order_params["validity_ttl"] = int(ttl_minutes)
+    return order_params
+
+def order_status_cell_text(order):
+    status = order.get('status')
+    filled_qty = order.get('filled_quantity')
+    if status in ["TRIGGER PENDING", "OPEN"]:
+        return f"TRIGGER PENDING ({filled_qty})"
+    elif status == "COMPLETE":
+        return f"ORDERED ({filled_qty})"
+    elif status == "PARTIAL":
+        return f"PARTIAL ({filled_qty})"
+    elif status in ["REJECTED", "CANCELLED"]:
+        return f"ERROR: {status}"
+    return f"PENDING ({filled_qty})"
+
+def render_input_order_statuses(sheet_inp, order_book, order_id_map, writer=sheet_writer):
+    status_cells = {}
+    finished_rows = []
+    for idx, order_id in list(order_id_map.items()):
+        order = order_book.get(order_id)
+        if not order:
+            continue
+        status_cells[(idx, 16)] = order_status_cell_text(order)
+        if order.get('status') in TERMINAL_ORDER_STATUSES:
+            finished_rows.append(idx)
+    if status_cells:
+        writer.write_cells(sheet_inp, status_cells)
+    for idx in finished_rows:
+        order_id_map.pop(idx, None)
+
+def apply_order_outcome(idx, order_id, error, order_params, status_cells, order_id_map, risk=None):
+    # Status text for one dispatched row; its entry signal is cleared once the outcome is final.
+    if error is None:
+        order_id_map[idx] = order_id
+        status_cells[(idx, 16)] = f"Placed: {order_id}"
+        if risk is not None:
+            risk.record_sent(order_params)
+    else:
+        status_cells[(idx, 16)] = f"ERROR: {str(error)}"
+    status_cells[(idx, 14)] = ""
+
+def process_input_sheet_orders(sheet_inp, dispatcher, order_id_map, writer=sheet_writer, snapshot=None, risk=None, pending_orders=None):
+    # pending_orders: {row: (tag, order_params)} for rows marked SUBMITTING or UNCONFIRMED whose
+    # outcome is not known yet; a later call settles them through dispatcher.resolve().
+    pending_orders = {} if pending_orders is None else pending_orders
     try:
-        data = sheet_inp.range("A2:Y201").value
+        status_cells = {}
+        if pending_orders:
+            pending = dict(pending_orders)
+            row_for_tag = {tag: idx for idx, (tag, _) in pending.items()}
+            for tag, (order_id, error) in dispatcher.resolve(list(row_for_tag)).items():
+                idx = row_for_tag[tag]
+                pending_orders.pop(idx, None)
+                apply_order_outcome(idx, order_id, error, pending[idx][1], status_cells, order_id_map, risk)
+        data = snapshot.rows(2, MAX_INPUT_ROWS + 1, 1, INPUT_LAST_COLUMN) if snapshot else sheet_inp.range("A2:Y201").value
+        orders_to_submit = []
         for i, row in enumerate(data):
             idx = i + 2
             row = (row + [None]*25)[:25]
@@ -394,83 +541,63 @@ def process_input_sheet_orders(sheet_inp, kite, order_id_map):
             order_type = row[19]
             product = row[20]
             validity = row[21]
-            price = row[22]
-            trigger_price = row[23]
-            ttl_minutes = row[24]
             if (symbol and qty and direction and entry_signal and variety and order_type and product and validity and
-                str(entry_signal).strip().lower() == "yes" and (not entry_status or entry_status == "")):
+                str(entry_signal).strip().lower() == "yes" and (not entry_status or entry_status == "") and idx not in pending_orders):
                 try:
-                    symbol = symbol.strip().upper()
-                    exchange, tradingsymbol = symbol.split(":")
-                    order_params = dict(
-                        variety=variety.strip().lower(),
-                        exchange=exchange,
-                        tradingsymbol=tradingsymbol,
-                        transaction_type=direction.strip().upper(),
-                        quantity=int(qty),
-                        order_type=order_type.strip().upper(),
-                        product=product.strip().upper(),
-                        validity=validity.strip().upper()
-                    )
-                    if order_type.strip().upper() in ["LIMIT", "SL", "SL-M"] and price:
-                        order_params["price"] = float(price)
-                    if order_type.strip().upper() in ["SL", "SL-M"] and trigger_price:
-                        order_params["trigger_price"] = float(trigger_price)
-                    if validity.strip().upper() == "TTL" and ttl_minutes:
-                        order_params["validity_ttl"] = int(ttl_minutes)
-                    order_id = kite.place_order(**order_params)
-                    order_id_map[idx] = order_id
-                    sheet_inp.range(f"P{idx}").value = f"Placed: {order_id}"
-                    sheet_inp.range(f"N{idx}").value = ""
+                    order_params = build_order_params(row)
+                    orders_to_submit.append((idx, order_params, new_order_tag(idx, order_params)))
                 except Exception as e:
-                    sheet_inp.range(f"P{idx}").value = f"ERROR: {str(e)}"
-                    sheet_inp.range(f"N{idx}").value = "" 
-            elif entry_status and isinstance(entry_status, str) and (
-                "TRIGGER PENDING" in entry_status or "PENDING" in entry_status or "OPEN" in entry_status):
-                order_id = order_id_map.get(idx)
-                if order_id:
-                    try:
-                        order_history = kite.order_history(order_id=order_id)
-                        if order_history:
-                            last_update = order_history[-1]
-                            status = last_update['status']
-                            filled_qty = last_update['filled_quantity']
-                            if status in ["TRIGGER PENDING", "OPEN"]:
-                                entry_cell = f"TRIGGER PENDING ({filled_qty})"
-                            elif status == "COMPLETE":
-                                entry_cell = f"ORDERED ({filled_qty})"
-                            elif status == "PARTIAL":
-                                entry_cell = f"PARTIAL ({filled_qty})"
-                            elif status in ["REJECTED", "CANCELLED"]:
-                                entry_cell = f"ERROR: {status}"
-                            else:
-                                entry_cell = f"PENDING ({filled_qty})"
-                            sheet_inp.range(f"P{idx}").value = entry_cell
-                    except Exception as e:
-                        sheet_inp.range(f"P{idx}").value = f"ERROR: {str(e)}"
+                    status_cells[(idx, 16)] = f"ERROR: {str(e)}"
+                    status_cells[(idx, 14)] = ""
+        if orders_to_submit and risk is not None:
+            # Local pre-trade checks; a rejected row gets its reason and its entry signal cleared.
+            orders_to_submit, rejected = risk.check_batch(orders_to_submit)
+            for idx, reason in rejected.items():
+                status_cells[(idx, 16)] = f"RISK: {reason}"
+                status_cells[(idx, 14)] = ""
+        if orders_to_submit:
+            # Rows are marked SUBMITTING before dispatch, so a batch whose result is lost (engine
+            # call timeout) is not sent again next cycle; resolve() settles them instead.
+            for idx, order_params, tag in orders_to_submit:
+                pending_orders[idx] = (tag, order_params)
+                status_cells[(idx, 16)] = "SUBMITTING"
+            writer.write_cells(sheet_inp, status_cells, force=True)
+            status_cells = {}
+            for idx, (order_id, error) in dispatcher.submit_batch(orders_to_submit).items():
+                if isinstance(error, (OrderUnconfirmedError, OrderInFlightError)):
+                    status_cells[(idx, 16)] = f"UNCONFIRMED: {pending_orders[idx][0]}" if isinstance(error, OrderUnconfirmedError) else "SUBMITTING"
+                    continue
+                tag, order_params = pending_orders.pop(idx)
+                apply_order_outcome(idx, order_id, error, order_params, status_cells, order_id_map, risk)
+            print(f"[{dt_now_str_fn()}] Dispatched {len(orders_to_submit)} orders; submit latency: {dispatcher.latency_stats()}")
+        if status_cells:
+            writer.write_cells(sheet_inp, status_cells, force=True)
     except Exception as e:
+        metrics.error("process_input_sheet_orders", e)
         print(f"Error in process_input_sheet_orders: {e}")
 
-def set_input_sheet_defaults(inp_sheet, max_rows=200):
-    for i in range(max_rows):
-        row_num = i + 2
-        symbol = inp_sheet.range(f"A{row_num}").value
+def set_input_sheet_defaults(inp_sheet, max_rows=200, writer=sheet_writer, snapshot=None):
+    # Fills blank variety (S), product (U) and validity (V) for every symbol row from one read,
+    # then writes only the cells that were blank. force=True because a user may have cleared a
+    # cell the shadow still remembers writing. Returns the snapshot with the defaults applied.
+    snapshot = snapshot or SheetSnapshot.read(inp_sheet, 1, 1, max_rows + 1, 22)
+    defaults = {}
+    for row_num in range(2, max_rows + 2):
+        symbol = snapshot.value(row_num, 1)
         if not symbol or not isinstance(symbol, str) or not symbol.strip():
             continue
         symbol_up = symbol.strip().upper()
-        if symbol_up in ("HOLDINGS", "PORTFOLIO", "MANUAL"):
+        if symbol_up in INPUT_SECTION_LABELS:
             continue
-        s_val = inp_sheet.range(f"S{row_num}").value
-        if not s_val:
-            inp_sheet.range(f"S{row_num}").value = "regular"
-        u_val = inp_sheet.range(f"U{row_num}").value
-        if not u_val:
+        if not snapshot.value(row_num, 19):
+            defaults[(row_num, 19)] = "regular"
+        if not snapshot.value(row_num, 21):
             if "BFO" in symbol_up or "NFO" in symbol_up:
-                inp_sheet.range(f"U{row_num}").value = "NRML"
+                defaults[(row_num, 21)] = "NRML"
             elif "BSE" in symbol_up or "NSE" in symbol_up:
-                inp_sheet.range(f"U{row_num}").value = "CNC"
-            else:
-                inp_sheet.range(f"U{row_num}").value = ""
-        v_val = inp_sheet.range(f"V{row_num}").value
-        if not v_val:
-            inp_sheet.range(f"V{row_num}").value = "DAY"
+                defaults[(row_num, 21)] = "CNC"
+        if not snapshot.value(row_num, 22):
+            defaults[(row_num, 22)] = "DAY"
+    if defaults:
+        writer.write_cells(inp_sheet, defaults, force=True)
+    return snapshot.with_values(defaults)
@@ -0,0 +1,121 @@
+import datetime
+import threading
+import time
+from quote_cache import QUOTE_BATCH_LIMIT
+from rest_scheduler import kite_rate_limiter
+from metrics import metrics
+
+GAP_FILL_WARMUP_SECONDS = 1.0 # Tokens that tick within this long after a (re)connect need no REST snapshot
+
+def dt_now_str_fn():
+    return datetime.datetime.now().strftime("%H:%M:%S.%f")[:-3]
+
+def quote_to_tick(q_data):
+    # kite.quote() row in the shape TickStore.update reads. The exchange timestamp is cleared rather
+    # than left out: the slot would keep its pre-drop value and the fill would read as tick-to-cell
+    # latency as long as the outage.
+    tick = {"instrument_token": q_data["instrument_token"], "exchange_timestamp": None}
+    if q_data.get("last_price") is not None:
+        tick["last_price"] = q_data["last_price"]
+    if q_data.get("volume") is not None:
+        tick["volume_traded"] = q_data["volume"]
+    if q_data.get("average_price") is not None:
+        tick["average_traded_price"] = q_data["average_price"]
+    for key in ("ohlc", "depth", "oi"):
+        if q_data.get(key) is not None:
+            tick[key] = q_data[key]
+    return tick
+
+class GapFiller:
+    # Bridges a websocket reconnect. The drop time is noted on close; once the socket is back and
+    # the resubscribed stream has had GAP_FILL_WARMUP_SECONDS to start, every subscribed token that
+    # has still not ticked gets a chunked bulk kite.quote snapshot written into the tick store, so
+    # rows are fresh again within seconds instead of whenever each instrument next trades. Recovery
+    # time (drop to every token fresh) is recorded per reconnect.
+    def __init__(self, kite, tick_store, symbol_for, tokens_for=None, rate_limiter=kite_rate_limiter,
+                 warmup_seconds=GAP_FILL_WARMUP_SECONDS, batch_limit=QUOTE_BATCH_LIMIT):
+        self.kite = kite
+        self.tick_store = tick_store
+        self.symbol_for = symbol_for # token -> "EXCHANGE:TRADINGSYMBOL" or None
+        self.tokens_for = tokens_for or (lambda: list(self.tick_store.token_to_slot))
+        self.rate_limiter = rate_limiter
+        self.warmup_seconds = warmup_seconds
+        self.batch_limit = batch_limit
+        self.dropped_at = None
+        self.fills = 0
+        self.quotes_filled = 0
+        self.last_recovery_seconds = None
+        self._pending = None # store version at the latest connect not yet filled
+        self._pending_dropped_at = None # drop that connect recovered from
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def on_close(self):
+        with self._lock:
+            if self.dropped_at is None:
+                self.dropped_at = time.time()
+
+    def on_connect(self):
+        # Connections of a pool may come back one after another; one worker covers them all.
+        with self._lock:
+            self._pending = self.tick_store.version
+            if self.dropped_at is not None:
+                self._pending_dropped_at = self._pending_dropped_at or self.dropped_at
+                self.dropped_at = None
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="gap-fill", daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.warmup_seconds)
+            with self._lock:
+                connected_version, dropped_at = self._pending, self._pending_dropped_at
+                self._pending = self._pending_dropped_at = None
+            try:
+                self.fill(connected_version, dropped_at)
+            except Exception as e_gap_fill:
+                metrics.error("gap_fill", e_gap_fill)
+                print(f"[{dt_now_str_fn()}] Gap fill failed: {e_gap_fill}")
+            with self._lock:
+                if self._pending is None:
+                    self._thread = None
+                    return
+
+    def fill(self, connected_version, dropped_at=None):
+        # Snapshots every token that has not ticked since the store was at connected_version.
+        store = self.tick_store
+        symbols = {}
+        for token in self.tokens_for():
+            if store.token_version(token) <= connected_version:
+                symbol_str = self.symbol_for(token)
+                if symbol_str:
+                    symbols[symbol_str] = token
+        missing = list(symbols)
+        filled = 0
+        for start in range(0, len(missing), self.batch_limit):
+            chunk = missing[start:start + self.batch_limit]
+            if self.rate_limiter is not None:
+                self.rate_limiter.acquire("quote")
+            with metrics.timer("rest_call_seconds", endpoint="quote"):
+                rest_quotes = self.kite.quote(chunk) or {}
+            ticks = [quote_to_tick(dict(q_data, instrument_token=symbols[symbol_str]))
+                     for symbol_str, q_data in rest_quotes.items() if symbol_str in symbols]
+            if ticks:
+                store.update(ticks, time.time())
+                filled += len(ticks)
+        self.fills += 1
+        self.quotes_filled += filled
+        metrics.inc("gap_fill_quotes", filled)
+        if dropped_at is not None:
+            if filled == len(missing):
+                self.last_recovery_seconds = time.time() - dropped_at
+                metrics.observe("reconnect_recovery_seconds", self.last_recovery_seconds)
+                print(f"[{dt_now_str_fn()}] Reconnect recovered in {self.last_recovery_seconds:.1f}s; {filled} quiet tokens filled from REST")
+            else:
+                print(f"[{dt_now_str_fn()}] Reconnect gap fill incomplete: {filled} of {len(missing)} quiet tokens filled from REST")
+        return filled
+
+    def stats(self):
+        return {"fills": self.fills, "quotes_filled": self.quotes_filled, "last_recovery_seconds": self.last_recovery_seconds,
+                "disconnected_since": self.dropped_at}
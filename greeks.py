@@ -0,0 +1,252 @@
+import datetime
+import math
+import time
+import numpy as np
+from option_chain import UNDERLYING_SPOT_SYMBOLS
+from sheet_writer import sheet_writer
+
+RISK_FREE_RATE = 0.065 # Annualised, continuously compounded
+IV_MIN, IV_MAX = 0.005, 5.0 # Bracket for the IV solver (0.5% .. 500%)
+IV_PRICE_TOLERANCE = 1e-4 # Rupees; well below the 0.05 tick
+IV_MAX_ITERATIONS = 40
+EXPIRY_TIME = datetime.time(15, 30) # NSE/BSE options expire at the equity close
+EXPIRY_TIMES = { # Per-exchange expiry time where it differs from EXPIRY_TIME
+    "MCX": datetime.time(23, 30), # Commodity options expire at the evening close (23:55 while US daylight saving is on)
+    "CDS": datetime.time(12, 0), # Expiring currency contracts stop trading at noon
+}
+SECONDS_PER_YEAR = 365.0 * 24 * 3600
+MIN_TIME_TO_EXPIRY_YEARS = 60.0 / SECONDS_PER_YEAR
+GREEKS_FIRST_COLUMN = 26 # INPUT column Z
+NET_GREEKS_FIRST_COLUMN = 32 # INPUT column AF
+NET_GREEKS_MAX_ROWS = 10
+GREEKS_HEADER = ["IV %", "Delta", "Gamma", "Theta", "Vega"]
+NET_GREEKS_HEADER = ["Underlying", "Net Delta", "Net Gamma", "Net Theta", "Net Vega"]
+OPTION_EXCHANGES = ("NFO", "BFO", "MCX", "CDS")
+FUTURES_UNDERLYING_EXCHANGES = ("MCX", "CDS") # Options here are on a futures contract, not on a cash instrument
+
+_SQRT_2PI = math.sqrt(2.0 * math.pi)
+
+def norm_pdf(x):
+    return np.exp(-0.5 * x * x) / _SQRT_2PI
+
+def norm_cdf(x):
+    # Abramowitz & Stegun 26.2.17, |error| < 7.5e-8; numpy has no vectorized erf.
+    ax = np.abs(x)
+    k = 1.0 / (1.0 + 0.2316419 * ax)
+    poly = k * (0.319381530 + k * (-0.356563782 + k * (1.781477937 + k * (-1.821255978 + k * 1.330274429))))
+    tail = norm_pdf(ax) * poly
+    return np.where(x >= 0, 1.0 - tail, tail)
+
+def _d1_d2(spot, strike, t, rate, sigma):
+    vol_sqrt_t = sigma * np.sqrt(t)
+    d1 = (np.log(spot / strike) + (rate + 0.5 * sigma * sigma) * t) / vol_sqrt_t
+    return d1, d1 - vol_sqrt_t
+
+def _carry(spot, t, rate, on_future):
+    # Black-76 for options on a future: the future costs nothing to carry, so it enters
+    # Black-Scholes as its discounted value F*exp(-r t). Cash underlyings pass through.
+    return spot * np.where(on_future, np.exp(-rate * t), 1.0)
+
+def bs_price(spot, strike, t, rate, sigma, is_call, on_future=False):
+    spot = _carry(spot, t, rate, on_future)
+    d1, d2 = _d1_d2(spot, strike, t, rate, sigma)
+    discounted_strike = strike * np.exp(-rate * t)
+    call = spot * norm_cdf(d1) - discounted_strike * norm_cdf(d2)
+    # Put-call parity: one pair of CDF evaluations serves both sides
+    return np.where(is_call, call, call - spot + discounted_strike)
+
+def implied_volatility(price, spot, strike, t, rate, is_call, on_future=False, max_iterations=IV_MAX_ITERATIONS):
+    # Newton steps safeguarded by a shrinking [lo, hi] bracket, solved for every option at once.
+    # Only still-unconverged options are carried into the next iteration. Prices outside the
+    # no-arbitrage bounds give NaN.
+    price, spot, strike, t, is_call, on_future = (np.atleast_1d(a).astype(float) for a in np.broadcast_arrays(price, spot, strike, t, is_call, on_future))
+    is_call = is_call.astype(bool)
+    sigma = np.full(price.shape[0], np.nan)
+    with np.errstate(invalid="ignore", divide="ignore", over="ignore"):
+        spot = _carry(spot, t, rate, on_future.astype(bool))
+        discounted_strike = strike * np.exp(-rate * t)
+        lower = np.where(is_call, np.maximum(spot - discounted_strike, 0.0), np.maximum(discounted_strike - spot, 0.0))
+        upper = np.where(is_call, spot, discounted_strike)
+        valid = np.isfinite(price) & np.isfinite(spot) & (spot > 0) & (strike > 0) & (t > 0) & (price > lower) & (price < upper)
+        idx = np.nonzero(valid)[0]
+        # Solve on call prices; puts are converted once through parity
+        target = np.where(is_call, price, price + spot - discounted_strike)[idx]
+        p_spot, p_dk, sqrt_t = spot[idx], discounted_strike[idx], np.sqrt(t[idx])
+        log_moneyness = np.log(p_spot / p_dk)
+        lo, hi = np.full(idx.size, IV_MIN), np.full(idx.size, IV_MAX)
+        # Brenner-Subrahmanyam ATM approximation as the starting point
+        s = np.clip(_SQRT_2PI / sqrt_t * price[idx] / p_spot, 0.05, 2.0)
+        for _ in range(max_iterations):
+            if not idx.size:
+                break
+            vol_sqrt_t = s * sqrt_t
+            d1 = log_moneyness / vol_sqrt_t + 0.5 * vol_sqrt_t
+            diff = p_spot * norm_cdf(d1) - p_dk * norm_cdf(d1 - vol_sqrt_t) - target
+            done = (np.abs(diff) < IV_PRICE_TOLERANCE) | (hi - lo < 1e-7)
+            if done.any():
+                sigma[idx[done]] = s[done]
+                keep = ~done
+                idx, s, diff, d1, lo, hi = idx[keep], s[keep], diff[keep], d1[keep], lo[keep], hi[keep]
+                target, p_spot, p_dk, sqrt_t, log_moneyness = target[keep], p_spot[keep], p_dk[keep], sqrt_t[keep], log_moneyness[keep]
+                if not idx.size:
+                    break
+            hi = np.where(diff > 0, s, hi)
+            lo = np.where(diff < 0, s, lo)
+            newton = s - diff / (p_spot * norm_pdf(d1) * sqrt_t)
+            s = np.where((newton > lo) & (newton < hi), newton, 0.5 * (lo + hi))
+        if idx.size:
+            sigma[idx] = s
+    return sigma
+
+def bs_greeks(spot, strike, t, rate, sigma, is_call, on_future=False):
+    # Delta, gamma, theta per calendar day and vega per 1 vol point. For options on a future
+    # (Black-76) delta and gamma are with respect to the future's price, and theta holds it fixed.
+    with np.errstate(invalid="ignore", divide="ignore"):
+        sqrt_t = np.sqrt(t)
+        carried = _carry(spot, t, rate, on_future)
+        discount = carried / spot # exp(-r t) on a future, 1 on cash
+        d1, d2 = _d1_d2(carried, strike, t, rate, sigma)
+        pdf_d1 = norm_pdf(d1)
+        discounted_strike = strike * np.exp(-rate * t)
+        bs_delta = np.where(is_call, norm_cdf(d1), norm_cdf(d1) - 1.0)
+        delta = discount * bs_delta
+        gamma = discount * pdf_d1 / (spot * sigma * sqrt_t)
+        decay = -carried * pdf_d1 * sigma / (2.0 * sqrt_t)
+        theta = np.where(is_call, decay - rate * discounted_strike * norm_cdf(d2), decay + rate * discounted_strike * norm_cdf(-d2))
+        # The discounted future grows at r as expiry nears; holding the future fixed gives that back.
+        theta = (theta + np.where(on_future, rate * carried * bs_delta, 0.0)) / 365.0
+        vega = carried * pdf_d1 * sqrt_t / 100.0
+    return {"delta": delta, "gamma": gamma, "theta": theta, "vega": vega}
+
+def spot_symbol_for(underlying, exchange="NFO", instrument_index=None, expiry=None):
+    # Price the options are written on: the index/stock for NFO and BFO, the nearest future expiring
+    # with or after the option for MCX and CDS (None when that cannot be resolved; those rows stay blank).
+    if exchange in FUTURES_UNDERLYING_EXCHANGES:
+        return instrument_index.nearest_future(underlying, exchange, expiry) if instrument_index is not None else None
+    return UNDERLYING_SPOT_SYMBOLS.get(underlying, f"NSE:{underlying}")
+
+class OptionLayout:
+    # Static per-symbol inputs (strike, expiry, call/put, underlying) as arrays, built once per
+    # distinct symbol list so each recompute only gathers prices.
+    def __init__(self, symbols, instrument_index):
+        self.symbols = list(symbols)
+        n = len(self.symbols)
+        self.tokens = [None] * n
+        self.strike = np.full(n, np.nan)
+        self.expiry_epoch = np.full(n, np.nan)
+        self.is_call = np.zeros(n, dtype=bool)
+        self.is_option = np.zeros(n, dtype=bool)
+        self.is_future = np.zeros(n, dtype=bool)
+        self.on_future = np.zeros(n, dtype=bool) # option written on a futures contract: priced with Black-76
+        self.underlyings = []
+        underlying_codes = {}
+        underlying_keys = [] # (exchange, name, earliest option expiry) per code, for resolving spot_symbols
+        self.underlying_idx = np.full(n, -1, dtype=np.int64)
+        for i, symbol_str in enumerate(self.symbols):
+            if not isinstance(symbol_str, str) or ":" not in symbol_str or symbol_str.split(":", 1)[0] not in OPTION_EXCHANGES:
+                continue
+            inst = instrument_index.instrument(symbol_str.strip().upper())
+            if not inst or not inst.get("expiry") or not inst.get("name"):
+                continue
+            inst_type = inst.get("instrument_type")
+            exchange = symbol_str.split(":", 1)[0]
+            if inst_type in ("CE", "PE"):
+                self.is_option[i] = True
+                self.is_call[i] = inst_type == "CE"
+                self.on_future[i] = exchange in FUTURES_UNDERLYING_EXCHANGES
+                self.strike[i] = inst["strike"]
+                self.expiry_epoch[i] = datetime.datetime.combine(inst["expiry"], EXPIRY_TIMES.get(exchange, EXPIRY_TIME)).timestamp()
+            elif inst_type == "FUT":
+                self.is_future[i] = True
+            else:
+                continue
+            self.tokens[i] = inst["instrument_token"]
+            code = underlying_codes.get((exchange, inst["name"]))
+            if code is None:
+                code = underlying_codes[(exchange, inst["name"])] = len(self.underlyings)
+                self.underlyings.append(inst["name"])
+                underlying_keys.append([exchange, inst["name"], None])
+            if inst_type in ("CE", "PE") and (underlying_keys[code][2] is None or inst["expiry"] < underlying_keys[code][2]):
+                underlying_keys[code][2] = inst["expiry"]
+            self.underlying_idx[i] = code
+        self.spot_symbols = [spot_symbol_for(name, exchange, instrument_index, expiry) for exchange, name, expiry in underlying_keys]
+
+class GreeksResult:
+    def __init__(self, layout, iv, greeks):
+        self.layout = layout
+        self.iv = iv
+        self.greeks = greeks
+
+    def rows(self, decimals=4):
+        # One [IV %, delta, gamma, theta, vega] row per input symbol; blanks where nothing was solved.
+        columns = [np.round(self.iv * 100.0, 2)] + [np.round(self.greeks[k], decimals) for k in ("delta", "gamma", "theta", "vega")]
+        has_values = self.layout.is_future | np.isfinite(self.iv)
+        out = []
+        for i, row in enumerate(zip(*(c.tolist() for c in columns))):
+            out.append(["" if not has_values[i] or v != v else v for v in row])
+        return out
+
+class GreeksEngine:
+    def __init__(self, instrument_index, rate=RISK_FREE_RATE, max_layouts=8):
+        self.instrument_index = instrument_index
+        self.rate = rate
+        self.max_layouts = max_layouts
+        self._layouts = {}
+        self.last_compute_seconds = 0.0
+
+    def layout(self, symbols):
+        key = tuple(symbols)
+        layout = self._layouts.get(key)
+        if layout is None:
+            if len(self._layouts) >= self.max_layouts:
+                self._layouts.clear()
+            layout = self._layouts[key] = OptionLayout(key, self.instrument_index)
+        return layout
+
+    def compute(self, symbols, prices_for, spot_for, now=None, fallback_prices=None):
+        # prices_for(tokens) -> float array (NaN if unknown); spot_for(spot_symbol) -> float or None.
+        started = time.perf_counter()
+        layout = self.layout(symbols)
+        now = time.time() if now is None else now
+        ltp = np.frombuffer(prices_for([t if t is not None else -1 for t in layout.tokens]), dtype=np.float64)
+        if fallback_prices is not None:
+            ltp = np.where(np.isnan(ltp), np.asarray(fallback_prices, dtype=float), ltp)
+        spots = np.array([spot_for(s) or np.nan for s in layout.spot_symbols] + [np.nan], dtype=float)
+        spot = spots[layout.underlying_idx]
+        t = np.maximum((layout.expiry_epoch - now) / SECONDS_PER_YEAR, MIN_TIME_TO_EXPIRY_YEARS)
+        iv = implied_volatility(np.where(layout.is_option, ltp, np.nan), spot, layout.strike, t, self.rate, layout.is_call, layout.on_future)
+        greeks = bs_greeks(spot, layout.strike, t, self.rate, iv, layout.is_call, layout.on_future)
+        greeks["delta"] = np.where(layout.is_future, 1.0, greeks["delta"])
+        for name in ("gamma", "theta", "vega"):
+            greeks[name] = np.where(layout.is_future, 0.0, greeks[name])
+        self.last_compute_seconds = time.perf_counter() - started
+        return GreeksResult(layout, iv, greeks)
+
+    def net_greeks(self, positions, prices_for, spot_for, now=None):
+        # Position-weighted Greeks summed per underlying: {"NIFTY": {"delta": ..., ...}, ...}
+        open_positions = [p for p in positions or [] if p.get("quantity") and p.get("exchange") in OPTION_EXCHANGES]
+        if not open_positions:
+            return {}
+        symbols = [f"{p['exchange']}:{p['tradingsymbol']}" for p in open_positions]
+        fallback = [p.get("last_price") or np.nan for p in open_positions]
+        result = self.compute(symbols, prices_for, spot_for, now=now, fallback_prices=fallback)
+        layout = result.layout
+        weights = np.array([p["quantity"] * (p.get("multiplier") or 1) for p in open_positions], dtype=float)
+        known = layout.underlying_idx >= 0
+        net = {}
+        for name in ("delta", "gamma", "theta", "vega"):
+            values = np.nan_to_num(result.greeks[name][known]) * weights[known]
+            sums = np.bincount(layout.underlying_idx[known], weights=values, minlength=len(layout.underlyings))
+            for code, underlying in enumerate(layout.underlyings):
+                totals = net.setdefault(underlying, {})
+                totals[name] = totals.get(name, 0.0) + float(sums[code])
+        return net
+
+def update_input_greeks(sheet, result, writer=sheet_writer):
+    writer.write_block(sheet, 1, GREEKS_FIRST_COLUMN, [GREEKS_HEADER])
+    writer.write_block(sheet, 2, GREEKS_FIRST_COLUMN, result.rows())
+
+def update_net_greeks(sheet, net, writer=sheet_writer):
+    rows = [[u, round(g["delta"], 2), round(g["gamma"], 4), round(g["theta"], 2), round(g["vega"], 2)] for u, g in sorted(net.items())]
+    rows = rows[:NET_GREEKS_MAX_ROWS] + [[""] * 5] * (NET_GREEKS_MAX_ROWS - len(rows))
+    writer.write_block(sheet, 1, NET_GREEKS_FIRST_COLUMN, [NET_GREEKS_HEADER] + rows)
@@ -0,0 +1,270 @@
+import datetime
+import glob
+import os
+import pickle
+import threading
+import time
+from array import array
+from concurrent.futures import ThreadPoolExecutor
+
+INSTRUMENT_CACHE_DIR = "instrument_cache" # One compact file per exchange per trading day
+INSTRUMENT_FILE_VERSION = 1
+
+def dt_now_str_fn():
+    return datetime.datetime.now().strftime("%H:%M:%S.%f")[:-3]
+
+def _to_ordinal(expiry):
+    if isinstance(expiry, datetime.datetime):
+        return expiry.date().toordinal()
+    if isinstance(expiry, datetime.date):
+        return expiry.toordinal()
+    if isinstance(expiry, str) and expiry:
+        try:
+            return datetime.date.fromisoformat(expiry[:10]).toordinal()
+        except ValueError:
+            return 0
+    return 0
+
+class ExchangeInstruments:
+    # Column arrays for one exchange's instrument dump plus O(1) symbol/token lookups.
+    # Secondary indexes (underlying -> expiry -> strike) are built the first time they are used.
+    def __init__(self, exchange, columns):
+        self.exchange = exchange
+        self.tokens = columns["tokens"]
+        self.tradingsymbols = columns["tradingsymbols"]
+        self.names = columns["names"]
+        self.expiries = columns["expiries"]
+        self.strikes = columns["strikes"]
+        self.instrument_types = columns["instrument_types"]
+        self.lot_sizes = columns["lot_sizes"]
+        self.tick_sizes = columns["tick_sizes"]
+        self.symbol_to_row = columns["symbol_to_row"]
+        self.token_to_row = columns["token_to_row"]
+        self._by_underlying = None
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_instrument_list(cls, exchange, instrument_list):
+        interned = {}
+        def intern(value):
+            value = value or ""
+            return interned.setdefault(value, value)
+        tokens, expiries, lot_sizes = array("q"), array("i"), array("i")
+        strikes, tick_sizes = array("d"), array("d")
+        tradingsymbols, names, instrument_types = [], [], []
+        symbol_to_row, token_to_row = {}, {}
+        for row, inst in enumerate(instrument_list):
+            token = int(inst["instrument_token"])
+            tsym = inst["tradingsymbol"]
+            tokens.append(token)
+            tradingsymbols.append(tsym)
+            names.append(intern(inst.get("name")))
+            expiries.append(_to_ordinal(inst.get("expiry")))
+            strikes.append(float(inst.get("strike") or 0.0))
+            instrument_types.append(intern(inst.get("instrument_type")))
+            lot_sizes.append(int(inst.get("lot_size") or 0))
+            tick_sizes.append(float(inst.get("tick_size") or 0.0))
+            symbol_to_row[tsym] = row
+            token_to_row[token] = row
+        return cls(exchange, {
+            "tokens": tokens, "tradingsymbols": tradingsymbols, "names": names, "expiries": expiries,
+            "strikes": strikes, "instrument_types": instrument_types, "lot_sizes": lot_sizes,
+            "tick_sizes": tick_sizes, "symbol_to_row": symbol_to_row, "token_to_row": token_to_row,
+        })
+
+    def to_columns(self):
+        return {
+            "tokens": self.tokens, "tradingsymbols": self.tradingsymbols, "names": self.names,
+            "expiries": self.expiries, "strikes": self.strikes, "instrument_types": self.instrument_types,
+            "lot_sizes": self.lot_sizes, "tick_sizes": self.tick_sizes,
+            "symbol_to_row": self.symbol_to_row, "token_to_row": self.token_to_row,
+        }
+
+    def __len__(self):
+        return len(self.tokens)
+
+    def row_for_symbol(self, tradingsymbol):
+        return self.symbol_to_row.get(tradingsymbol)
+
+    def row_for_token(self, token):
+        return self.token_to_row.get(token)
+
+    def record(self, row):
+        expiry_ord = self.expiries[row]
+        return {
+            "instrument_token": self.tokens[row],
+            "tradingsymbol": self.tradingsymbols[row],
+            "name": self.names[row],
+            "expiry": datetime.date.fromordinal(expiry_ord) if expiry_ord else "",
+            "strike": self.strikes[row],
+            "instrument_type": self.instrument_types[row],
+            "lot_size": self.lot_sizes[row],
+            "tick_size": self.tick_sizes[row],
+            "exchange": self.exchange,
+        }
+
+    def by_underlying(self):
+        # name -> expiry ordinal -> sorted [(strike, {"CE": row, "PE": row}), ...] plus futures under strike 0
+        if self._by_underlying is None:
+            with self._lock:
+                if self._by_underlying is None:
+                    index = {}
+                    for row, name in enumerate(self.names):
+                        expiry_ord = self.expiries[row]
+                        if not name or not expiry_ord:
+                            continue
+                        strikes = index.setdefault(name, {}).setdefault(expiry_ord, {})
+                        strikes.setdefault(self.strikes[row], {})[self.instrument_types[row]] = row
+                    for expiries in index.values():
+                        for expiry_ord, strikes in expiries.items():
+                            expiries[expiry_ord] = sorted(strikes.items())
+                    self._by_underlying = index
+        return self._by_underlying
+
+class InstrumentIndex:
+    def __init__(self, cache_dir=INSTRUMENT_CACHE_DIR, kite=None):
+        self.cache_dir = cache_dir
+        self.kite = kite
+        self._exchanges = {}
+        self._lock = threading.Lock()
+
+    def _path(self, exchange, day=None):
+        day = day or datetime.date.today()
+        return os.path.join(self.cache_dir, f"{exchange}_{day.isoformat()}.pkl")
+
+    def is_fresh(self, exchange):
+        return exchange in self._exchanges or os.path.exists(self._path(exchange))
+
+    def _save(self, exch_instruments):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        path = self._path(exch_instruments.exchange)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "wb") as f:
+            pickle.dump((INSTRUMENT_FILE_VERSION, exch_instruments.to_columns()), f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+        for old_path in glob.glob(os.path.join(self.cache_dir, f"{exch_instruments.exchange}_*.pkl")):
+            if old_path != path:
+                try: os.remove(old_path)
+                except OSError: pass
+
+    def _read(self, exchange):
+        path = self._path(exchange)
+        if not os.path.exists(path):
+            return None
+        try:
+            with open(path, "rb") as f:
+                version, columns = pickle.load(f)
+            if version != INSTRUMENT_FILE_VERSION:
+                return None
+            return ExchangeInstruments(exchange, columns)
+        except Exception as e:
+            print(f"[{dt_now_str_fn()}] Instrument cache for {exchange} unreadable, refetching: {e}")
+            return None
+
+    def _download(self, exchange, kite):
+        started = time.perf_counter()
+        exch_instruments = ExchangeInstruments.from_instrument_list(exchange, kite.instruments(exchange=exchange))
+        self._save(exch_instruments)
+        print(f"[{dt_now_str_fn()}] Downloaded {len(exch_instruments)} {exchange} instruments in {time.perf_counter() - started:.2f}s")
+        return exch_instruments
+
+    def ensure_fresh(self, exchanges, kite=None, max_workers=5):
+        kite = kite or self.kite
+        stale = [exch for exch in exchanges if not self.is_fresh(exch)]
+        for exch in exchanges:
+            if exch not in stale:
+                self.exchange(exch) # today's file is already on disk: load it so token lookups see it
+        if not stale or kite is None:
+            return
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(stale))) as pool:
+            futures = {exch: pool.submit(self._download, exch, kite) for exch in stale}
+        for exch, future in futures.items():
+            try:
+                with self._lock:
+                    self._exchanges[exch] = future.result()
+            except Exception as e:
+                print(f"[{dt_now_str_fn()}] Failed to download {exch} instruments: {e}")
+
+    def exchange(self, exchange):
+        exch_instruments = self._exchanges.get(exchange)
+        if exch_instruments is not None:
+            return exch_instruments
+        with self._lock:
+            exch_instruments = self._exchanges.get(exchange)
+            if exch_instruments is None:
+                exch_instruments = self._read(exchange)
+                if exch_instruments is None and self.kite is not None:
+                    try:
+                        exch_instruments = self._download(exchange, self.kite)
+                    except Exception as e:
+                        print(f"[{dt_now_str_fn()}] Failed to download {exchange} instruments: {e}")
+                if exch_instruments is not None:
+                    self._exchanges[exchange] = exch_instruments
+        return exch_instruments
+
+    def loaded_exchanges(self):
+        return list(self._exchanges)
+
+    def token_for(self, symbol_str):
+        if not symbol_str or ":" not in symbol_str:
+            return None
+        exch, tsym = symbol_str.split(":", 1)
+        exch_instruments = self.exchange(exch)
+        if exch_instruments is None:
+            return None
+        row = exch_instruments.row_for_symbol(tsym)
+        return exch_instruments.tokens[row] if row is not None else None
+
+    def symbol_for(self, token, exchanges=None):
+        for exch in (exchanges or list(self._exchanges)):
+            exch_instruments = self.exchange(exch)
+            if exch_instruments is None:
+                continue
+            row = exch_instruments.row_for_token(token)
+            if row is not None:
+                return f"{exch}:{exch_instruments.tradingsymbols[row]}"
+        return None
+
+    def instrument(self, symbol_str):
+        if not symbol_str or ":" not in symbol_str:
+            return None
+        exch, tsym = symbol_str.split(":", 1)
+        exch_instruments = self.exchange(exch)
+        if exch_instruments is None:
+            return None
+        row = exch_instruments.row_for_symbol(tsym)
+        return exch_instruments.record(row) if row is not None else None
+
+    def expiries(self, underlying, exchange="NFO"):
+        exch_instruments = self.exchange(exchange)
+        if exch_instruments is None:
+            return []
+        return [datetime.date.fromordinal(e) for e in sorted(exch_instruments.by_underlying().get(underlying, {}))]
+
+    def nearest_future(self, underlying, exchange, on_or_after=None):
+        # "EXCH:TRADINGSYMBOL" of the first future of underlying expiring on or after the given date (default today).
+        exch_instruments = self.exchange(exchange)
+        if exch_instruments is None:
+            return None
+        first_ord = _to_ordinal(on_or_after or datetime.date.today())
+        for expiry_ord, strikes in sorted(exch_instruments.by_underlying().get(underlying, {}).items()):
+            if expiry_ord < first_ord:
+                continue
+            for _, legs in strikes:
+                if "FUT" in legs:
+                    return f"{exchange}:{exch_instruments.tradingsymbols[legs['FUT']]}"
+        return None
+
+    def option_strikes(self, underlying, expiry, exchange="NFO"):
+        # Sorted [(strike, {"CE": "NFO:...", "PE": "NFO:..."}), ...] for one underlying and expiry.
+        exch_instruments = self.exchange(exchange)
+        if exch_instruments is None:
+            return []
+        strikes = exch_instruments.by_underlying().get(underlying, {}).get(_to_ordinal(expiry), [])
+        tsyms = exch_instruments.tradingsymbols
+        chain = []
+        for strike, legs in strikes:
+            option_legs = {t: f"{exchange}:{tsyms[row]}" for t, row in legs.items() if t in ("CE", "PE")}
+            if option_legs:
+                chain.append((strike, option_legs))
+        return chain
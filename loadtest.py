@@ -0,0 +1,125 @@
+import argparse
+import http.client
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+import urllib.parse
+
+# Fires /refresh_symbol at a fixed rate and reports latency percentiles and status counts.
+# Latency is measured from each request's scheduled send time, so a stalled server cannot hide queueing delay.
+# Usage: python loadtest.py --rate 1000 --duration 10                 (starts its own webhook server)
+#        python loadtest.py --url http://127.0.0.1:5000 --rate 1000   (against a running webhook.py)
+#        python loadtest.py --rate 1000 --stall                       (nothing drains the queue; expect 503 "busy")
+
+LOADTEST_PORT = 5055
+SYMBOLS = ["NSE:INFY", "NSE:RELIANCE", "NSE:TCS", "NFO:NIFTY25JAN24000CE", "NFO:BANKNIFTY25JAN51000PE"]
+
+def _percentile(samples, p):
+    if not samples:
+        return None
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(p * len(samples)))]
+
+def _fmt_ms(seconds):
+    return "-" if seconds is None else f"{seconds * 1000:.2f}"
+
+def serve_only(port, stall):
+    # Child process: the real Flask app under the real waitress config, with a thread standing in for the main loop.
+    import webhook
+    webhook.WEBHOOK_PORT = port
+    def drain():
+        while True:
+            if not stall:
+                webhook.drain_refresh_queue()
+            webhook.last_loop_iteration_at = time.time()
+            time.sleep(0.01)
+    threading.Thread(target=drain, daemon=True).start()
+    webhook.start_webhook_server()
+
+def wait_for_health(host, port, timeout=15):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            conn = http.client.HTTPConnection(host, port, timeout=1)
+            conn.request("GET", "/health")
+            conn.getresponse().read()
+            return True
+        except OSError:
+            time.sleep(0.1)
+    return False
+
+def run_load(host, port, rate, duration, workers):
+    total = int(rate * duration)
+    latencies = [[] for _ in range(workers)]
+    statuses = [{} for _ in range(workers)]
+    started = time.perf_counter() + 0.2
+    def worker(w):
+        conn = http.client.HTTPConnection(host, port, timeout=10)
+        for i in range(w, total, workers):
+            scheduled = started + i / rate
+            delay = scheduled - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            body = json.dumps({"row": 2 + i % 200, "symbol": SYMBOLS[i % len(SYMBOLS)]})
+            try:
+                conn.request("POST", "/refresh_symbol", body, {"Content-Type": "application/json"})
+                response = conn.getresponse()
+                response.read()
+                status = response.status
+            except OSError as e_request:
+                status = type(e_request).__name__
+                conn.close()
+                conn = http.client.HTTPConnection(host, port, timeout=10)
+            latencies[w].append(time.perf_counter() - scheduled)
+            statuses[w][status] = statuses[w].get(status, 0) + 1
+        conn.close()
+    threads = [threading.Thread(target=worker, args=(w,), daemon=True) for w in range(workers)]
+    for t in threads: t.start()
+    for t in threads: t.join()
+    elapsed = time.perf_counter() - started
+    merged = {}
+    for counts in statuses:
+        for status, n in counts.items():
+            merged[status] = merged.get(status, 0) + n
+    return [x for per_worker in latencies for x in per_worker], merged, elapsed
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test for the /refresh_symbol webhook")
+    parser.add_argument("--url", help="Base URL of a running webhook.py; omit to start a local server")
+    parser.add_argument("--rate", type=float, default=1000, help="Requests per second")
+    parser.add_argument("--duration", type=float, default=10, help="Seconds to run")
+    parser.add_argument("--workers", type=int, default=32, help="Client connections")
+    parser.add_argument("--stall", action="store_true", help="Local server never drains the queue, to exercise the busy path")
+    parser.add_argument("--serve-only", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--port", type=int, default=LOADTEST_PORT, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.serve_only:
+        serve_only(args.port, args.stall)
+        return
+
+    server = None
+    if args.url:
+        parsed = urllib.parse.urlparse(args.url)
+        host, port = parsed.hostname, parsed.port or 80
+    else:
+        host, port = "127.0.0.1", args.port
+        command = [sys.executable, os.path.abspath(__file__), "--serve-only", "--port", str(port)] + (["--stall"] if args.stall else [])
+        server = subprocess.Popen(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        if not wait_for_health(host, port):
+            print(f"Webhook server at {host}:{port} did not come up")
+            return
+        latencies, statuses, elapsed = run_load(host, port, args.rate, args.duration, args.workers)
+    finally:
+        if server:
+            server.terminate()
+            server.wait()
+    print(f"{len(latencies)} requests in {elapsed:.1f}s ({len(latencies) / elapsed:.0f}/s), statuses {statuses}")
+    print(f"latency ms  p50 {_fmt_ms(_percentile(latencies, 0.50))}  p90 {_fmt_ms(_percentile(latencies, 0.90))}  "
+          f"p99 {_fmt_ms(_percentile(latencies, 0.99))}  max {_fmt_ms(max(latencies) if latencies else None)}")
+
+if __name__ == "__main__":
+    main()
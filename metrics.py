@@ -0,0 +1,161 @@
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+METRICS_PREFIX = "kite_excel"
+# Upper bounds in seconds, roughly x2.5 apart: 100us .. 30s covers a tick decode up to a stuck COM call
+LATENCY_BUCKETS_SECONDS = (
+    0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+    0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0,
+)
+METRIC_HELP = {
+    "stage_seconds": "Time spent per pipeline stage",
+    "sheet_update_seconds": "Duration of each update_* sheet function",
+    "sheet_write_seconds": "Duration of each range write sent to Excel",
+    "rest_call_seconds": "Duration of each Kite REST call",
+    "rest_http_seconds": "Duration of each HTTP attempt to the Kite API, by endpoint, retries included",
+    "rest_http_failures": "Failed HTTP attempts to the Kite API, by endpoint and reason (timeout, connection, http_5xx, circuit_open)",
+    "rest_http_retries": "Read calls retried after a failed attempt, by endpoint",
+    "rest_circuit_opened": "Times an endpoint's circuit breaker opened",
+    "tick_to_cell_seconds": "Exchange timestamp of a tick to the INPUT render that showed it",
+    "errors": "Exceptions caught per stage",
+    "webhook_busy": "Refresh requests rejected with 503 because the refresh queue was full",
+    "stream_connects": "Clients connected to /stream",
+    "stream_rejected": "/stream connections refused because the stream was at its client limit",
+    "render_frame_seconds": "Time to draw one frame of a sheet, used to pace that sheet's redraws",
+    "gap_fill_quotes": "Instruments refreshed from a REST quote snapshot after a websocket reconnect",
+    "reconnect_recovery_seconds": "Time from a websocket drop until every subscribed instrument had fresh data again",
+    "risk_rejected": "Orders stopped by a local pre-trade check, by check",
+    "render_frames_skipped": "Sheet states replaced by newer ones before they were drawn, at most one per sheet minimum frame interval",
+}
+
+class Histogram:
+    # Fixed buckets, one counter per bucket; observe is a bisect and two adds.
+    def __init__(self, buckets=LATENCY_BUCKETS_SECONDS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.total += value
+        self.count += 1
+
+    def quantile(self, q):
+        # Upper bound of the bucket holding the q-th sample; good enough for log lines.
+        if not self.count:
+            return None
+        target = q * self.count
+        running = 0
+        for bound, n in zip(self.buckets + (float("inf"),), self.counts):
+            running += n
+            if running >= target:
+                return bound
+        return float("inf")
+
+def _label_key(labels):
+    return tuple(sorted(labels.items()))
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def _format_labels(key, extra=None):
+    items = list(key) + ([extra] if extra else [])
+    if not items:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in items) + "}"
+
+def _format_bound(bound):
+    return "+Inf" if bound == float("inf") else repr(bound)
+
+class MetricsRegistry:
+    # Process-wide histograms and counters, rendered in Prometheus text format by /metrics.
+    def __init__(self, prefix=METRICS_PREFIX, buckets=LATENCY_BUCKETS_SECONDS):
+        self.prefix = prefix
+        self.buckets = tuple(buckets)
+        self._histograms = {} # name -> {label_key: Histogram}
+        self._counters = {} # name -> {label_key: value}
+        self.last_errors = {} # stage -> last error message
+        self._lock = threading.Lock()
+
+    def observe(self, name, seconds, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            family = self._histograms.setdefault(name, {})
+            hist = family.get(key)
+            if hist is None:
+                hist = family[key] = Histogram(self.buckets)
+            hist.observe(seconds)
+
+    def observe_many(self, name, values, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            family = self._histograms.setdefault(name, {})
+            hist = family.get(key)
+            if hist is None:
+                hist = family[key] = Histogram(self.buckets)
+            for seconds in values:
+                hist.observe(seconds)
+
+    @contextmanager
+    def timer(self, name, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - started, **labels)
+
+    def inc(self, name, amount=1, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            family = self._counters.setdefault(name, {})
+            family[key] = family.get(key, 0) + amount
+
+    def error(self, stage, exc=None):
+        self.inc("errors", stage=stage)
+        if exc is not None:
+            with self._lock:
+                self.last_errors[stage] = f"{type(exc).__name__}: {exc}"
+
+    def histogram(self, name, **labels):
+        with self._lock:
+            return self._histograms.get(name, {}).get(_label_key(labels))
+
+    def counter(self, name, **labels):
+        with self._lock:
+            return self._counters.get(name, {}).get(_label_key(labels), 0)
+
+    def summary(self):
+        # Compact {name{labels}: (count, p50, p99)} view for shutdown logs.
+        out = {}
+        with self._lock:
+            for name, family in self._histograms.items():
+                for key, hist in family.items():
+                    out[f"{name}{_format_labels(key)}"] = (hist.count, hist.quantile(0.5), hist.quantile(0.99))
+        return out
+
+    def render_prometheus(self):
+        lines = []
+        with self._lock:
+            for name in sorted(self._histograms):
+                full_name = f"{self.prefix}_{name}"
+                lines.append(f"# HELP {full_name} {METRIC_HELP.get(name, name)}")
+                lines.append(f"# TYPE {full_name} histogram")
+                for key, hist in sorted(self._histograms[name].items()):
+                    running = 0
+                    for bound, n in zip(hist.buckets + (float("inf"),), hist.counts):
+                        running += n
+                        lines.append(f"{full_name}_bucket{_format_labels(key, ('le', _format_bound(bound)))} {running}")
+                    lines.append(f"{full_name}_sum{_format_labels(key)} {hist.total!r}")
+                    lines.append(f"{full_name}_count{_format_labels(key)} {hist.count}")
+            for name in sorted(self._counters):
+                full_name = f"{self.prefix}_{name}_total"
+                lines.append(f"# HELP {full_name} {METRIC_HELP.get(name, name)}")
+                lines.append(f"# TYPE {full_name} counter")
+                for key, value in sorted(self._counters[name].items()):
+                    lines.append(f"{full_name}{_format_labels(key)} {value}")
+        return "\n".join(lines) + "\n"
+
+metrics = MetricsRegistry()
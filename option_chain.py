@@ -0,0 +1,147 @@
+import datetime
+import math
+from array import array
+from bisect import bisect_left
+from sheet_writer import sheet_writer
+
+OPTION_CHAIN_SHEET = "OptionChain"
+OPTION_CHAIN_STRIKES_EACH_SIDE = 10 # Default +/- strikes around ATM when OptionChain!F1 is blank
+OPTION_CHAIN_MAX_STRIKES_EACH_SIDE = 50
+OPTION_CHAIN_FIRST_ROW = 4
+OPTION_CHAIN_RECENTER_HYSTERESIS = 0.25 # Spot must cross the midpoint between strikes by this fraction of the gap before the window moves
+UNDERLYING_SPOT_SYMBOLS = {
+    "NIFTY": "NSE:NIFTY 50",
+    "BANKNIFTY": "NSE:NIFTY BANK",
+    "FINNIFTY": "NSE:NIFTY FIN SERVICE",
+    "MIDCPNIFTY": "NSE:NIFTY MID SELECT",
+    "SENSEX": "BSE:SENSEX",
+    "BANKEX": "BSE:BANKEX",
+}
+UNDERLYING_OPTION_EXCHANGES = {"SENSEX": "BFO", "BANKEX": "BFO"}
+OPTION_CHAIN_HEADER = ["CE OI", "CE Volume", "CE Bid", "CE Ask", "CE LTP", "Strike", "PE LTP", "PE Bid", "PE Ask", "PE Volume", "PE OI"]
+
+def _expiry_date(value):
+    if isinstance(value, datetime.datetime):
+        return value.date()
+    if isinstance(value, datetime.date):
+        return value
+    if isinstance(value, str) and value.strip():
+        try:
+            return datetime.date.fromisoformat(value.strip()[:10])
+        except ValueError:
+            return None
+    return None
+
+class OptionChain:
+    # Calls and puts for one underlying and expiry, with a window of +/- N strikes around
+    # ATM. Strikes come sorted from the instrument index, so finding ATM is a bisect and a
+    # shift only reports the legs that entered or left the window.
+    def __init__(self, instrument_index, underlying, expiry=None, strikes_each_side=OPTION_CHAIN_STRIKES_EACH_SIDE, exchange=None):
+        self.underlying = underlying.strip().upper()
+        self.exchange = exchange or UNDERLYING_OPTION_EXCHANGES.get(self.underlying, "NFO")
+        self.strikes_each_side = max(0, min(int(strikes_each_side), OPTION_CHAIN_MAX_STRIKES_EACH_SIDE))
+        self.expiry = _expiry_date(expiry) or self._nearest_expiry(instrument_index)
+        legs_by_strike = instrument_index.option_strikes(self.underlying, self.expiry, self.exchange) if self.expiry else []
+        self.strikes = array("d", [strike for strike, _ in legs_by_strike])
+        self.symbols = [(legs.get("CE"), legs.get("PE")) for _, legs in legs_by_strike]
+        self.tokens = [tuple(instrument_index.token_for(s) if s else None for s in pair) for pair in self.symbols]
+        self.spot_symbol = UNDERLYING_SPOT_SYMBOLS.get(self.underlying)
+        self.spot_token = instrument_index.token_for(self.spot_symbol) if self.spot_symbol else None
+        self.window = (0, 0) # half-open index range into self.strikes
+        self.atm_index = None
+
+    def _nearest_expiry(self, instrument_index):
+        today = datetime.date.today()
+        upcoming = [e for e in instrument_index.expiries(self.underlying, self.exchange) if e >= today]
+        return upcoming[0] if upcoming else None
+
+    def settings_key(self):
+        return (self.underlying, self.expiry, self.strikes_each_side)
+
+    def __len__(self):
+        return len(self.strikes)
+
+    def atm_index_for(self, spot):
+        i = bisect_left(self.strikes, spot)
+        if i == 0:
+            return 0
+        if i == len(self.strikes):
+            return len(self.strikes) - 1
+        return i if self.strikes[i] - spot < spot - self.strikes[i - 1] else i - 1
+
+    def _keep_current_atm(self, spot, new_atm):
+        current = self.atm_index
+        if current is None or new_atm == current:
+            return new_atm == current
+        neighbour = current + (1 if new_atm > current else -1)
+        gap = abs(self.strikes[neighbour] - self.strikes[current])
+        return abs(spot - self.strikes[current]) < gap * (0.5 + OPTION_CHAIN_RECENTER_HYSTERESIS)
+
+    def _window_tokens(self, lo, hi):
+        return {t for pair in self.tokens[lo:hi] for t in pair if t}
+
+    def recenter(self, spot):
+        # Returns (tokens_added, tokens_removed) for the move; both empty when ATM did not change.
+        if not self.strikes or spot is None or not spot or (isinstance(spot, float) and math.isnan(spot)):
+            return [], []
+        atm = self.atm_index_for(spot)
+        if self._keep_current_atm(spot, atm):
+            return [], []
+        n = self.strikes_each_side
+        lo, hi = max(0, atm - n), min(len(self.strikes), atm + n + 1)
+        old_lo, old_hi = self.window
+        old_tokens = self._window_tokens(old_lo, old_hi)
+        new_tokens = self._window_tokens(lo, hi)
+        self.window, self.atm_index = (lo, hi), atm
+        return sorted(new_tokens - old_tokens), sorted(old_tokens - new_tokens)
+
+    def window_tokens(self):
+        return self._window_tokens(*self.window)
+
+    def window_rows(self):
+        # [(strike, ce_token, pe_token, is_atm), ...] for the current window, lowest strike first.
+        lo, hi = self.window
+        return [(self.strikes[i], self.tokens[i][0], self.tokens[i][1], i == self.atm_index) for i in range(lo, hi)]
+
+def read_option_chain_settings(sheet):
+    # OptionChain!B1 = underlying (blank disables the chain), D1 = expiry (blank = nearest), F1 = strikes each side.
+    values = sheet.range("A1:F1").value or []
+    values = list(values) + [None] * (6 - len(values))
+    underlying = values[1].strip().upper() if isinstance(values[1], str) and values[1].strip() else None
+    if not underlying:
+        return None
+    try:
+        strikes_each_side = int(values[5]) if values[5] not in (None, "") else OPTION_CHAIN_STRIKES_EACH_SIDE
+    except (TypeError, ValueError):
+        strikes_each_side = OPTION_CHAIN_STRIKES_EACH_SIDE
+    strikes_each_side = max(0, min(strikes_each_side, OPTION_CHAIN_MAX_STRIKES_EACH_SIDE))
+    return underlying, _expiry_date(values[3]), strikes_each_side
+
+def _leg_fields(q_data):
+    if not q_data:
+        return [""] * 5
+    depth = q_data.get("depth") or {}
+    bid = (depth.get("buy") or [{}])[0].get("price", "")
+    ask = (depth.get("sell") or [{}])[0].get("price", "")
+    return [q_data.get("oi", ""), q_data.get("volume", ""), bid, ask, q_data.get("last_price", "")]
+
+def update_option_chain_sheet(sheet, chain, quotes_by_token, spot, writer=sheet_writer):
+    # Calls on the left, puts on the right, strike in the middle; unused rows below the window are blanked.
+    max_rows = 2 * OPTION_CHAIN_MAX_STRIKES_EACH_SIDE + 1
+    writer.write_cells(sheet, {(1, 1): "Underlying", (1, 3): "Expiry", (1, 5): "Strikes +/-"})
+    rows = []
+    atm_strike = ""
+    if chain is not None:
+        for strike, ce_token, pe_token, is_atm in chain.window_rows():
+            ce = _leg_fields(quotes_by_token.get(ce_token)) if ce_token else [""] * 5
+            pe = _leg_fields(quotes_by_token.get(pe_token)) if pe_token else [""] * 5
+            rows.append(ce + [strike] + [pe[4], pe[2], pe[3], pe[1], pe[0]] + ["ATM" if is_atm else ""])
+            if is_atm:
+                atm_strike = strike
+    rows += [[""] * 12] * (max_rows - len(rows))
+    status = ["Spot", spot if spot not in (None, "") else "", "ATM", atm_strike,
+              "Expiry", chain.expiry if chain is not None and chain.expiry else "",
+              "Last Updated", datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")]
+    writer.write_block(sheet, 2, 1, [status])
+    writer.write_block(sheet, 3, 1, [OPTION_CHAIN_HEADER + [""]])
+    writer.write_block(sheet, OPTION_CHAIN_FIRST_ROW, 1, rows)
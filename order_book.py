@@ -0,0 +1,67 @@
+import threading
+
+TERMINAL_ORDER_STATUSES = ("COMPLETE", "CANCELLED", "REJECTED")
+
+class OrderBook:
+    # Local copy of the day's orders. Seeded from kite.orders(), kept current by the
+    # KiteTicker order-update stream and reconciled against REST at a low frequency.
+    def __init__(self):
+        self._orders = {}
+        self._lock = threading.Lock()
+        self.version = 0
+        self.fills = 0 # bumped whenever an order's filled_quantity grows, i.e. positions changed
+        self.stream_updates = 0
+        self.reconciles = 0
+
+    @staticmethod
+    def _is_newer(incoming, existing):
+        if existing is None:
+            return True
+        if existing.get("status") in TERMINAL_ORDER_STATUSES and incoming.get("status") not in TERMINAL_ORDER_STATUSES:
+            return False
+        return (incoming.get("filled_quantity") or 0) >= (existing.get("filled_quantity") or 0)
+
+    def _merge(self, order):
+        order_id = order.get("order_id")
+        if not order_id:
+            return False
+        order_id = str(order_id)
+        existing = self._orders.get(order_id)
+        if not self._is_newer(order, existing):
+            return False
+        merged = dict(existing) if existing else {}
+        merged.update(order)
+        if (merged.get("filled_quantity") or 0) > ((existing or {}).get("filled_quantity") or 0):
+            self.fills += 1
+        if merged != existing:
+            self._orders[order_id] = merged
+            return True
+        return False
+
+    def apply_update(self, order):
+        with self._lock:
+            self.stream_updates += 1
+            if self._merge(order):
+                self.version += 1
+
+    def reconcile(self, orders):
+        with self._lock:
+            self.reconciles += 1
+            changed = False
+            for order in orders or []:
+                changed = self._merge(order) or changed
+            if changed:
+                self.version += 1
+        return self.orders()
+
+    def get(self, order_id):
+        with self._lock:
+            order = self._orders.get(str(order_id))
+            return dict(order) if order else None
+
+    def orders(self):
+        with self._lock:
+            return sorted(self._orders.values(), key=lambda o: str(o.get("order_timestamp") or ""))
+
+    def __len__(self):
+        return len(self._orders)
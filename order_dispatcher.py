@@ -0,0 +1,261 @@
+import datetime
+import hashlib
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import requests
+from urllib3.exceptions import NewConnectionError
+from kiteconnect.exceptions import NetworkException
+from rest_scheduler import kite_rate_limiter
+from rest_transport import CircuitOpenError
+from metrics import metrics
+
+ORDER_DISPATCH_WORKERS = 5
+ORDER_SUBMIT_RETRIES = 2
+ORDER_TAG_PREFIX = "XL"
+ORDER_TAG_REUSE_SECONDS = 60 # A tag placed longer ago than this is a deliberate repeat of the row, not a resend of the same order
+ORDER_LOOKUP_SECONDS = 5 # After an ambiguous failure, how long the order book is polled for the tag before reporting it unconfirmed
+ORDER_LOOKUP_INTERVAL_SECONDS = 1
+ORDER_UNCONFIRMED_SECONDS = 120 # An unconfirmed tag still missing from a successful order book read this long after the failure is reported as not placed
+ORDER_RESOLVE_INTERVAL_SECONDS = 2 # resolve() reads the order book for unconfirmed tags at most this often
+
+def dt_now_str_fn():
+    return datetime.datetime.now().strftime("%H:%M:%S.%f")[:-3]
+
+def new_order_tag(row_idx, order_params):
+    # Kite tags are at most 20 alphanumeric characters. The tag is derived from the row, its order
+    # fields and the day, so the same row resent by a later cycle (e.g. after its status write
+    # failed) carries the same tag and is recognised as already placed.
+    fields = "|".join(f"{k}={order_params[k]}" for k in sorted(order_params))
+    digest = hashlib.sha1(f"{datetime.date.today()}|{row_idx}|{fields}".encode()).hexdigest()
+    return f"{ORDER_TAG_PREFIX}{row_idx:03d}{digest[:15]}"
+
+def _never_sent(exc):
+    # Failed before the request left this machine: placing again cannot duplicate it.
+    if isinstance(exc, (CircuitOpenError, requests.exceptions.ConnectTimeout)):
+        return True
+    if isinstance(exc, requests.exceptions.ConnectionError) and not isinstance(exc, requests.exceptions.ReadTimeout):
+        reason = exc.args[0] if exc.args else None
+        return isinstance(getattr(reason, "reason", reason), NewConnectionError)
+    return False
+
+def _maybe_sent(exc):
+    # Timed out or dropped after sending, or a gateway error: the exchange may have the order.
+    return isinstance(exc, (NetworkException, requests.exceptions.ConnectionError, requests.exceptions.Timeout)) and not _never_sent(exc)
+
+class OrderUnconfirmedError(Exception):
+    # The request may have reached the exchange but its tag is not in the order book (yet). It is
+    # never placed again automatically; resolve() or an order update settles the tag later.
+    pass
+
+class OrderInFlightError(Exception):
+    # The same tag is still being submitted by an earlier batch.
+    pass
+
+class OrderLookupError(Exception):
+    # The order book could not be read, so whether a tag was placed is unknown.
+    pass
+
+class OrderDispatcher:
+    # Submits a batch of validated orders concurrently through a bounded pool. Each order
+    # carries a tag stable for its row and fields, and is marked in flight before anything is
+    # sent, so a batch resent while the first is still running cannot place it again. Only
+    # failures where the request never went out are retried directly. After a timeout or
+    # dropped connection the order book is polled for the tag; if it does not show up the order
+    # is reported unconfirmed and is never placed again for that failure. resolve() reports what
+    # became of tags whose batch result the caller never saw or that were left unconfirmed.
+    def __init__(self, kite, max_workers=ORDER_DISPATCH_WORKERS, retries=ORDER_SUBMIT_RETRIES, rate_limiter=kite_rate_limiter,
+                 lookup_seconds=ORDER_LOOKUP_SECONDS, lookup_interval=ORDER_LOOKUP_INTERVAL_SECONDS,
+                 unconfirmed_seconds=ORDER_UNCONFIRMED_SECONDS, resolve_interval=ORDER_RESOLVE_INTERVAL_SECONDS):
+        self.kite = kite
+        self.retries = retries
+        self.rate_limiter = rate_limiter
+        self.lookup_seconds = lookup_seconds
+        self.lookup_interval = lookup_interval
+        self.unconfirmed_seconds = unconfirmed_seconds
+        self.resolve_interval = resolve_interval
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="order-dispatch")
+        self._lock = threading.Lock()
+        self.placed_by_tag = {} # tag -> (order_id, placed_at)
+        self.order_ids_by_tag = {} # tag -> every order id placed under it, so a lookup can tell a new order from an old one
+        self.in_flight = set() # tags accepted by submit_batch and not finished yet
+        self.failed_by_tag = {} # tag -> error text of its last definite failure
+        self.unresolved_tags = {} # tag -> monotonic time of the ambiguous failure, until its order is found or given up on
+        self.last_resolve_lookup = 0.0
+        self.latencies = []
+        self.max_latency_samples = 1000
+
+    def _find_orders_by_tags(self, tags):
+        # {tag: order_id} for tags with an order not already recorded under them. Raises
+        # OrderLookupError when the order book cannot be read: absent and unknown are not the same.
+        if self.rate_limiter is not None:
+            self.rate_limiter.acquire("order")
+        with self._lock:
+            known = {tag: set(self.order_ids_by_tag.get(tag, ())) for tag in tags}
+        try:
+            with metrics.timer("rest_call_seconds", endpoint="orders"):
+                orders = self.kite.orders()
+        except Exception as e:
+            metrics.error("rest_orders", e)
+            print(f"[{dt_now_str_fn()}] Order lookup for tags {sorted(tags)} failed: {e}")
+            raise OrderLookupError(str(e)) from e
+        found = {}
+        for order in orders or []:
+            for tag in [order.get("tag")] + list(order.get("tags") or []):
+                if tag in known and order.get("order_id") not in known[tag]:
+                    found.setdefault(tag, order.get("order_id"))
+        return found
+
+    def _await_order_by_tag(self, tag):
+        deadline = time.monotonic() + self.lookup_seconds
+        while True:
+            try:
+                order_id = self._find_orders_by_tags([tag]).get(tag)
+            except OrderLookupError:
+                order_id = None
+            if order_id or time.monotonic() >= deadline:
+                return order_id
+            time.sleep(self.lookup_interval)
+
+    def _record_placed(self, tag, order_id):
+        with self._lock:
+            self.unresolved_tags.pop(tag, None)
+            self.failed_by_tag.pop(tag, None)
+            self.placed_by_tag[tag] = (order_id, time.monotonic())
+            self.order_ids_by_tag.setdefault(tag, set()).add(order_id)
+
+    def _place(self, order_params, tag):
+        attempt = 0
+        while True:
+            if self.rate_limiter is not None:
+                self.rate_limiter.acquire("order")
+            try:
+                with metrics.timer("rest_call_seconds", endpoint="place_order"):
+                    return self.kite.place_order(tag=tag, **order_params)
+            except Exception as e:
+                metrics.error("rest_place_order", e)
+                if _maybe_sent(e):
+                    with self._lock:
+                        self.unresolved_tags[tag] = time.monotonic()
+                    order_id = self._await_order_by_tag(tag)
+                    if order_id:
+                        return order_id
+                    raise OrderUnconfirmedError(f"order {tag} may have been placed ({e}); not in the order book yet") from e
+                if not _never_sent(e) or attempt >= self.retries:
+                    raise
+                attempt += 1
+                print(f"[{dt_now_str_fn()}] Retrying order {tag} after: {e}")
+
+    def _submit(self, order_params, tag):
+        try:
+            with self._lock:
+                placed = self.placed_by_tag.get(tag)
+                if placed and time.monotonic() - placed[1] < ORDER_TAG_REUSE_SECONDS:
+                    return placed[0]
+                unresolved = tag in self.unresolved_tags
+            started = time.perf_counter()
+            order_id = None
+            if unresolved:
+                # Resubmitted while still unconfirmed: only a readable order book without it allows placing.
+                try:
+                    order_id = self._find_orders_by_tags([tag]).get(tag)
+                except OrderLookupError as e:
+                    raise OrderUnconfirmedError(f"order {tag} still unconfirmed; lookup failed: {e}") from e
+            if not order_id:
+                order_id = self._place(order_params, tag)
+            elapsed = time.perf_counter() - started
+            self._record_placed(tag, order_id)
+            with self._lock:
+                self.latencies.append(elapsed)
+                if len(self.latencies) > self.max_latency_samples:
+                    del self.latencies[:len(self.latencies) - self.max_latency_samples]
+            return order_id
+        except OrderUnconfirmedError:
+            raise
+        except Exception as e:
+            with self._lock:
+                self.failed_by_tag[tag] = str(e)
+            raise
+        finally:
+            with self._lock:
+                self.in_flight.discard(tag)
+
+    def submit_batch(self, orders):
+        # orders: [(key, order_params, tag), ...] -> {key: (order_id, None) or (None, exception)}
+        # Tags are marked in flight here, before any is sent; one still in flight from an earlier batch is refused.
+        futures, results = {}, {}
+        for key, params, tag in orders:
+            with self._lock:
+                busy = tag in self.in_flight
+                if not busy:
+                    self.in_flight.add(tag)
+                    self.failed_by_tag.pop(tag, None)
+            if busy:
+                results[key] = (None, OrderInFlightError(f"order {tag} is still being submitted"))
+            else:
+                futures[key] = self._pool.submit(self._submit, params, tag)
+        for key, future in futures.items():
+            try:
+                results[key] = (future.result(), None)
+            except Exception as e:
+                results[key] = (None, e)
+        return results
+
+    def on_order_update(self, order):
+        # Order-update stream hook: settles an unconfirmed tag as soon as its order shows up.
+        tag, order_id = order.get("tag"), order.get("order_id")
+        with self._lock:
+            settles = tag in self.unresolved_tags and order_id and order_id not in self.order_ids_by_tag.get(tag, ())
+        if settles:
+            self._record_placed(tag, order_id)
+
+    def resolve(self, tags):
+        # What became of tags whose submit_batch result was lost or unconfirmed:
+        # {tag: (order_id, None) placed, (None, error text) not placed}. Tags still in flight or
+        # unconfirmed are left out. Unconfirmed tags are looked up at most every resolve_interval.
+        now = time.monotonic()
+        with self._lock:
+            lookup = [tag for tag in tags if tag in self.unresolved_tags and tag not in self.in_flight]
+            if lookup and now - self.last_resolve_lookup >= self.resolve_interval:
+                self.last_resolve_lookup = now
+            else:
+                lookup = []
+        found, looked_up = {}, False
+        if lookup:
+            try:
+                found = self._find_orders_by_tags(lookup)
+                looked_up = True
+            except OrderLookupError:
+                pass
+        for tag, order_id in found.items():
+            self._record_placed(tag, order_id)
+        results = {}
+        with self._lock:
+            for tag in tags:
+                if tag in self.in_flight:
+                    continue
+                failed_at = self.unresolved_tags.get(tag)
+                if failed_at is not None:
+                    if looked_up and tag in lookup and now - failed_at >= self.unconfirmed_seconds:
+                        del self.unresolved_tags[tag]
+                        results[tag] = (None, f"order {tag} not in the order book {self.unconfirmed_seconds}s after an ambiguous failure; not placed")
+                    continue
+                if tag in self.placed_by_tag:
+                    results[tag] = (self.placed_by_tag[tag][0], None)
+                elif tag in self.failed_by_tag:
+                    results[tag] = (None, self.failed_by_tag[tag])
+                else:
+                    results[tag] = (None, f"order {tag} was never submitted")
+        return results
+
+    def latency_stats(self):
+        with self._lock:
+            samples = sorted(self.latencies)
+        if not samples:
+            return {"orders": 0}
+        def pct(p):
+            return samples[min(len(samples) - 1, int(p * len(samples)))]
+        return {"orders": len(samples), "p50_ms": pct(0.5) * 1000, "p95_ms": pct(0.95) * 1000, "max_ms": samples[-1] * 1000}
+
+    def shutdown(self):
+        self._pool.shutdown(wait=False)
@@ -0,0 +1,160 @@
+import time
+import numpy as np
+
+POSITION_FIELDS = ("pnl", "m2m", "unrealised", "realised") # Recomputed on every tick; the rest of the REST row is kept
+
+def _num(value, default=np.nan):
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        return default
+    return default if value != value else value
+
+class PnlLayout:
+    # Static inputs of one positions + holdings snapshot as arrays, built once per REST poll so each
+    # tick only gathers prices. Every row is anchored on the REST values it came with:
+    #   pnl(ltp) = pnl_rest + qty * (ltp - ltp_rest) * multiplier
+    # which is Kite's own (sell_value - buy_value) + qty * ltp * multiplier for positions and
+    # (ltp - average_price) * quantity for holdings, without depending on which value/M2M fields
+    # the API returned. Realised P&L is the part that does not move with the price.
+    def __init__(self, positions, holdings, instrument_index=None):
+        self.positions = list(positions or [])
+        self.holdings = list(holdings or [])
+        items = self.positions + self.holdings
+        n = len(items)
+        self.n_positions = len(self.positions)
+        self.tokens = [-1] * n
+        self.symbols = [None] * n
+        self.qty = np.zeros(n)
+        self.multiplier = np.ones(n)
+        self.average_price = np.full(n, np.nan)
+        self.rest_ltp = np.full(n, np.nan)
+        self.rest_pnl = np.zeros(n)
+        self.rest_m2m = np.zeros(n)
+        self.close_price = np.full(n, np.nan)
+        self.underlyings = []
+        underlying_codes = {}
+        self.underlying_idx = np.zeros(n, dtype=np.int64)
+        for i, item in enumerate(items):
+            is_position = i < self.n_positions
+            symbol_str = f"{item.get('exchange', '').upper()}:{item.get('tradingsymbol', '').upper()}"
+            self.symbols[i] = symbol_str
+            token = item.get("instrument_token")
+            if not token and instrument_index is not None:
+                token = instrument_index.token_for(symbol_str)
+            self.tokens[i] = token or -1
+            self.qty[i] = _num(item.get("quantity"), 0.0)
+            if is_position:
+                self.multiplier[i] = _num(item.get("multiplier"), 0.0) or 1.0
+            self.average_price[i] = _num(item.get("average_price"))
+            self.rest_ltp[i] = _num(item.get("last_price"))
+            self.close_price[i] = _num(item.get("close_price"))
+            pnl = _num(item.get("pnl"))
+            if np.isnan(pnl):
+                # No REST P&L: price it as unrealised only, from the average price.
+                self.rest_ltp[i] = self.average_price[i] if np.isnan(self.rest_ltp[i]) else self.rest_ltp[i]
+                pnl = self.qty[i] * (self.rest_ltp[i] - self.average_price[i]) * self.multiplier[i]
+            self.rest_pnl[i] = np.nan_to_num(pnl)
+            m2m = _num(item.get("m2m")) if is_position else np.nan
+            self.rest_m2m[i] = self.rest_pnl[i] if np.isnan(m2m) else m2m
+            underlying = item.get("tradingsymbol", "")
+            if instrument_index is not None:
+                inst = instrument_index.instrument(symbol_str)
+                if inst and inst.get("name"):
+                    underlying = inst["name"]
+            code = underlying_codes.get(underlying)
+            if code is None:
+                code = underlying_codes[underlying] = len(self.underlyings)
+                self.underlyings.append(underlying)
+            self.underlying_idx[i] = code
+        self.exposure = self.qty * self.multiplier
+        with np.errstate(invalid="ignore"):
+            self.realised = self.rest_pnl - self.exposure * (self.rest_ltp - self.average_price)
+        self.realised = np.nan_to_num(self.realised)
+        self.is_position = np.arange(n) < self.n_positions
+
+class PnlResult:
+    def __init__(self, layout, ltp, pnl, m2m, unrealised):
+        self.layout = layout
+        self.ltp = ltp
+        self.pnl = pnl
+        self.m2m = m2m
+        self.unrealised = unrealised
+
+    def _sum(self, values, mask):
+        layout = self.layout
+        return np.bincount(layout.underlying_idx[mask], weights=values[mask], minlength=len(layout.underlyings))
+
+    def by_underlying(self):
+        # {"NIFTY": {"pnl": ..., "m2m": ..., "unrealised": ..., "realised": ..., "holdings_pnl": ...}, ...}
+        layout = self.layout
+        pos, hold = layout.is_position, ~layout.is_position
+        sums = {"pnl": self._sum(self.pnl, pos), "m2m": self._sum(self.m2m, pos),
+                "unrealised": self._sum(self.unrealised, pos), "realised": self._sum(layout.realised, pos),
+                "holdings_pnl": self._sum(self.pnl, hold)}
+        return {underlying: {name: round(float(values[code]), 2) for name, values in sums.items()}
+                for code, underlying in enumerate(layout.underlyings)}
+
+    def totals(self):
+        layout = self.layout
+        pos, hold = layout.is_position, ~layout.is_position
+        return {"positions_pnl": round(float(self.pnl[pos].sum()), 2), "m2m": round(float(self.m2m[pos].sum()), 2),
+                "unrealised": round(float(self.unrealised[pos].sum()), 2), "realised": round(float(layout.realised[pos].sum()), 2),
+                "holdings_pnl": round(float(self.pnl[hold].sum()), 2),
+                "holdings_day_change": round(float(np.nansum((self.ltp[hold] - layout.close_price[hold]) * layout.qty[hold])), 2)}
+
+    def live_positions(self):
+        # The REST position rows with last_price and the P&L fields replaced by their live values.
+        layout = self.layout
+        out = []
+        for i, item in enumerate(layout.positions):
+            row = dict(item)
+            if not np.isnan(self.ltp[i]):
+                row["last_price"] = float(self.ltp[i])
+            row.update(zip(POSITION_FIELDS, (round(float(v), 2) for v in (self.pnl[i], self.m2m[i], self.unrealised[i], layout.realised[i]))))
+            out.append(row)
+        return out
+
+    def live_holdings(self):
+        layout = self.layout
+        out = []
+        for j, item in enumerate(layout.holdings):
+            i = layout.n_positions + j
+            row = dict(item)
+            ltp, close = self.ltp[i], layout.close_price[i]
+            if not np.isnan(ltp):
+                row["last_price"] = float(ltp)
+                row["pnl"] = round(float(self.pnl[i]), 2)
+                if close:
+                    row["day_change"] = round(float(ltp - close), 2)
+                    row["day_change_percentage"] = round(float((ltp / close - 1.0) * 100.0), 2)
+            out.append(row)
+        return out
+
+class PnlEngine:
+    # Live mark-to-market for positions and holdings. The layout is rebuilt only when the REST
+    # snapshot changes (layout_key); every call in between is one vectorized pass over the live LTPs.
+    def __init__(self, instrument_index=None):
+        self.instrument_index = instrument_index
+        self.layout = None
+        self.layout_key = None
+        self.last_compute_seconds = 0.0
+
+    def compute(self, positions, holdings, prices_for, layout_key=None):
+        # prices_for(tokens) -> float array (NaN where no tick yet; the REST last_price is used there).
+        started = time.perf_counter()
+        if self.layout is None or layout_key is None or layout_key != self.layout_key:
+            self.layout = PnlLayout(positions, holdings, self.instrument_index)
+            self.layout_key = layout_key
+        layout = self.layout
+        if layout.tokens:
+            ltp = np.frombuffer(prices_for(layout.tokens), dtype=np.float64)
+            ltp = np.where(np.isnan(ltp), layout.rest_ltp, ltp)
+        else:
+            ltp = np.zeros(0)
+        with np.errstate(invalid="ignore"):
+            move = np.nan_to_num(layout.exposure * (ltp - layout.rest_ltp))
+            unrealised = np.nan_to_num(layout.exposure * (ltp - layout.average_price))
+        result = PnlResult(layout, ltp, layout.rest_pnl + move, layout.rest_m2m + move, unrealised)
+        self.last_compute_seconds = time.perf_counter() - started
+        return result
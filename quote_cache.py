@@ -0,0 +1,152 @@
+import datetime
+import threading
+import time
+from collections import OrderedDict
+from rest_scheduler import kite_rate_limiter
+from metrics import metrics
+
+QUOTE_BATCH_LIMIT = 500 # Kite quote API accepts at most 500 instruments per call
+QUOTE_CACHE_TTL_SECONDS = 5
+QUOTE_CACHE_MAX_ENTRIES = 2000
+QUOTE_CACHE_MAX_STALE_SECONDS = 60 # Longest a quote is served past its fetch while refreshes keep failing
+
+def _dt_now_str():
+    return datetime.datetime.now().strftime("%H:%M:%S.%f")[:-3]
+
+class QuoteCache:
+    # REST fallback for symbols with no live tick. Misses are collected per cycle and
+    # resolved with chunked bulk kite.quote calls; results (including symbols the API
+    # did not return) are kept for ttl_seconds with LRU eviction beyond max_entries.
+    # When a refresh fails, quotes younger than max_stale_seconds are served for another ttl instead
+    # of blanks, as a copy carrying "stale_since" (wall time of the fetch) so the sheet can mark them.
+    # prefetch runs on the Excel loop, so it never waits for the quote rate limit: misses that
+    # find no token free are left in `deferred` for the renderer to retry on a later frame.
+    def __init__(self, ttl_seconds=QUOTE_CACHE_TTL_SECONDS, max_entries=QUOTE_CACHE_MAX_ENTRIES, batch_limit=QUOTE_BATCH_LIMIT, rate_limiter=kite_rate_limiter,
+                 max_stale_seconds=QUOTE_CACHE_MAX_STALE_SECONDS):
+        self.ttl_seconds = ttl_seconds
+        self.max_stale_seconds = max_stale_seconds
+        self.rate_limiter = rate_limiter
+        self.max_entries = max_entries
+        self.batch_limit = batch_limit
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.rest_calls = 0
+        self.stale_served = 0
+        self.deferred = set()
+
+    def _get_fresh(self, symbol_str, now):
+        entry = self._entries.get(symbol_str)
+        if entry is None:
+            return None
+        fetched_at, q_data, stale_until = entry[0], entry[1], entry[3]
+        if now - fetched_at > self.ttl_seconds and not (stale_until and now < stale_until):
+            return None
+        self._entries.move_to_end(symbol_str)
+        return q_data
+
+    def _store(self, symbol_str, q_data, now):
+        # [fetched_at, quote, served, served stale until, fetched at wall time]
+        self._entries[symbol_str] = [now, q_data, False, None, time.time()]
+        self._entries.move_to_end(symbol_str)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def prefetch(self, symbols, kite):
+        now = time.monotonic()
+        missing = []
+        seen = set()
+        with self._lock:
+            for symbol_str in symbols:
+                if symbol_str in seen:
+                    continue
+                seen.add(symbol_str)
+                if self._get_fresh(symbol_str, now) is None:
+                    missing.append(symbol_str)
+        if not missing or kite is None:
+            return
+        for start in range(0, len(missing), self.batch_limit):
+            chunk = missing[start:start + self.batch_limit]
+            if self.rate_limiter is not None and not self.rate_limiter.try_acquire("quote"):
+                with self._lock:
+                    self.deferred.update(missing[start:])
+                return
+            with self._lock:
+                self.deferred.difference_update(chunk)
+            try:
+                self.rest_calls += 1
+                with metrics.timer("rest_call_seconds", endpoint="quote"):
+                    rest_quotes = kite.quote(chunk) or {}
+            except Exception as e:
+                metrics.error("rest_quote", e)
+                print(f"[{_dt_now_str()}] Quote fallback failed for {len(chunk)} symbols: {e}")
+                failed_at = time.monotonic()
+                with self._lock:
+                    for symbol_str in chunk:
+                        entry = self._entries.get(symbol_str)
+                        if entry is not None and failed_at - entry[0] < self.max_stale_seconds:
+                            if entry[3] is None:
+                                entry[1] = dict(entry[1], stale_since=entry[4])
+                            entry[3] = min(failed_at + self.ttl_seconds, entry[0] + self.max_stale_seconds)
+                            self.stale_served += 1
+                continue
+            fetched_at = time.monotonic()
+            with self._lock:
+                for symbol_str in chunk:
+                    self._store(symbol_str, rest_quotes.get(symbol_str, {}), fetched_at)
+
+    def _serve(self, symbol_str, now):
+        # The first read of a freshly fetched entry is the miss that paid for the REST call.
+        q_data = self._get_fresh(symbol_str, now)
+        if q_data is None:
+            return None
+        entry = self._entries[symbol_str]
+        if entry[2]:
+            self.hits += 1
+        else:
+            entry[2] = True
+            self.misses += 1
+        return q_data
+
+    def get(self, symbol_str, kite=None):
+        with self._lock:
+            q_data = self._serve(symbol_str, time.monotonic())
+        if q_data is not None:
+            return q_data
+        self.prefetch([symbol_str], kite)
+        with self._lock:
+            q_data = self._serve(symbol_str, time.monotonic())
+            if q_data is None:
+                self.misses += 1
+        return q_data if q_data is not None else {}
+
+    def take_deferred(self):
+        # Symbols whose fallback is still owed; the caller redraws their rows, which prefetches them again.
+        with self._lock:
+            deferred, self.deferred = self.deferred, set()
+        return deferred
+
+    def invalidate(self, symbols=None):
+        with self._lock:
+            if symbols is None:
+                self._entries.clear()
+            else:
+                for symbol_str in symbols:
+                    self._entries.pop(symbol_str, None)
+
+    def stats(self):
+        with self._lock:
+            size = len(self._entries)
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": (self.hits / lookups) if lookups else 0.0,
+            "rest_calls": self.rest_calls,
+            "stale_served": self.stale_served,
+            "deferred": len(self.deferred),
+            "entries": size,
+        }
+
+rest_quote_cache = QuoteCache()
@@ -0,0 +1,234 @@
+import datetime
+import itertools
+import json
+import math
+import threading
+import time
+from metrics import metrics
+
+STREAM_POLL_INTERVAL_SECONDS = 0.05 # How often the hub collects changed ticks for subscribers
+STREAM_DEFAULT_MAX_RATE = 4 # Frames per second per client unless it asks for ?max_rate=
+STREAM_MAX_RATE = 20
+STREAM_MAX_CLIENTS = 32 # Each /stream client holds one waitress worker thread
+STREAM_MAX_SYMBOLS_PER_CLIENT = 500
+STREAM_KEEPALIVE_SECONDS = 15 # Comment frame sent on idle streams so proxies and clients keep the connection open
+STREAM_CHANNELS = ("quotes", "positions", "orders")
+
+def dt_now_str_fn():
+    return datetime.datetime.now().strftime("%H:%M:%S.%f")[:-3]
+
+def _num(value):
+    if value == "" or value is None or (isinstance(value, float) and math.isnan(value)):
+        return None
+    return value
+
+def compact_quote(row):
+    # Flat JSON-friendly quote from a TickStore row.
+    ohlc = row.get("ohlc") or {}
+    depth = row.get("depth") or {}
+    return {
+        "last_price": _num(row.get("last_price")),
+        "open": _num(ohlc.get("open")), "high": _num(ohlc.get("high")), "low": _num(ohlc.get("low")), "close": _num(ohlc.get("close")),
+        "volume": _num(row.get("volume")),
+        "average_price": _num(row.get("average_price")),
+        "oi": _num(row.get("oi")),
+        "bid": _num((depth.get("buy") or [{}])[0].get("price")),
+        "ask": _num((depth.get("sell") or [{}])[0].get("price")),
+        "exchange_timestamp": _num(row.get("exchange_timestamp")),
+        "received_at": _num(row.get("received_at")),
+    }
+
+def sse_frame(event, data):
+    return f"event: {event}\ndata: {json.dumps(data, default=str, separators=(',', ':'))}\n\n"
+
+class StreamClient:
+    # One subscriber. Quotes are conflated: a newer quote for a symbol replaces the pending one, so a
+    # slow reader gets the latest values instead of a backlog. Each frame carries only the fields that
+    # changed since this client's previous frame, and frames are spaced at least 1/max_rate apart.
+    def __init__(self, client_id, symbols_by_token, channels, max_rate):
+        self.client_id = client_id
+        self.symbols_by_token = symbols_by_token # token -> symbol, or None for every ticking instrument
+        self.channels = channels
+        self.min_interval = 1.0 / max_rate
+        self.pending = {} # symbol -> latest compact quote
+        self.pending_events = {} # channel -> latest payload
+        self.sent = {} # symbol -> quote as of the last frame
+        self.frames_sent = 0
+        self.quotes_conflated = 0
+        self.closed = False
+        self._cond = threading.Condition()
+
+    def offer(self, quotes):
+        with self._cond:
+            for symbol, quote in quotes.items():
+                if symbol in self.pending:
+                    self.quotes_conflated += 1
+                self.pending[symbol] = quote
+            self._cond.notify()
+
+    def offer_event(self, channel, payload):
+        if channel in self.channels:
+            with self._cond:
+                self.pending_events[channel] = payload
+                self._cond.notify()
+
+    def close(self):
+        with self._cond:
+            self.closed = True
+            self._cond.notify()
+
+    def _take(self):
+        pending, events = self.pending, self.pending_events
+        self.pending, self.pending_events = {}, {}
+        deltas = {}
+        for symbol, quote in pending.items():
+            previous = self.sent.get(symbol)
+            delta = quote if previous is None else {k: v for k, v in quote.items() if previous.get(k) != v}
+            if delta:
+                deltas[symbol] = delta
+            self.sent[symbol] = quote
+        return deltas, events
+
+    def frames(self, keepalive_seconds=STREAM_KEEPALIVE_SECONDS):
+        # Generator of SSE text frames; ends when the client is closed.
+        last_sent_at = 0.0
+        while True:
+            with self._cond:
+                if not self.pending and not self.pending_events and not self.closed:
+                    self._cond.wait(keepalive_seconds)
+                if self.closed:
+                    return
+                if not self.pending and not self.pending_events:
+                    yield ": keepalive\n\n"
+                    continue
+            wait = last_sent_at + self.min_interval - time.monotonic()
+            if wait > 0:
+                time.sleep(wait) # more updates conflate into pending meanwhile
+            with self._cond:
+                deltas, events = self._take()
+            out = "".join(sse_frame(channel, payload) for channel, payload in events.items())
+            if deltas:
+                out += sse_frame("quotes", deltas)
+            if out:
+                last_sent_at = time.monotonic()
+                self.frames_sent += 1
+                yield out
+
+class QuoteStreamHub:
+    # Fans the live tick store, positions and order book out to local /stream subscribers. One thread
+    # polls the store's version every STREAM_POLL_INTERVAL_SECONDS, snapshots only the changed
+    # tokens some client wants, and offers them to each client's conflation buffer; nothing here
+    # touches Kite, so extra desk tools cost no API calls or websocket capacity.
+    def __init__(self, tick_store, symbol_for, rest_snapshot=None, order_book=None,
+                 poll_interval=STREAM_POLL_INTERVAL_SECONDS, max_clients=STREAM_MAX_CLIENTS):
+        self.tick_store = tick_store
+        self.symbol_for = symbol_for
+        self.rest_snapshot = rest_snapshot
+        self.order_book = order_book
+        self.poll_interval = poll_interval
+        self.max_clients = max_clients
+        self.clients = {}
+        self._ids = itertools.count(1)
+        self._symbol_cache = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._tick_version = 0
+        self._positions_version = None
+        self._orders_version = None
+
+    def start(self):
+        if self._thread is None or not self._thread.is_alive():
+            # Clients get the current positions and orders on connect; only later changes are pushed.
+            if self.rest_snapshot is not None:
+                self._positions_version = self.rest_snapshot.version("positions")
+            if self.order_book is not None:
+                self._orders_version = self.order_book.version
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="quote-stream", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        with self._lock:
+            for client in self.clients.values():
+                client.close()
+
+    def connect(self, symbols_by_token, channels=STREAM_CHANNELS, max_rate=STREAM_DEFAULT_MAX_RATE):
+        # Returns the new client, or None when the hub is full. The first frame is a full snapshot.
+        max_rate = min(max(float(max_rate), 0.1), STREAM_MAX_RATE)
+        with self._lock:
+            if len(self.clients) >= self.max_clients:
+                return None
+            client = StreamClient(next(self._ids), symbols_by_token, tuple(channels), max_rate)
+            self.clients[client.client_id] = client
+        if "quotes" in client.channels and symbols_by_token:
+            rows = self.tick_store.snapshot(symbols_by_token)
+            client.offer({symbols_by_token[token]: compact_quote(row) for token, row in rows.items()})
+        if "positions" in client.channels and self.rest_snapshot is not None:
+            client.offer_event("positions", self.rest_snapshot.get("positions", []))
+        if "orders" in client.channels and self.order_book is not None:
+            client.offer_event("orders", self.order_book.orders())
+        metrics.inc("stream_connects")
+        return client
+
+    def disconnect(self, client):
+        client.close()
+        with self._lock:
+            self.clients.pop(client.client_id, None)
+
+    def _symbol(self, token):
+        symbol = self._symbol_cache.get(token)
+        if symbol is None:
+            symbol = self._symbol_cache[token] = self.symbol_for(token) or str(token)
+        return symbol
+
+    def publish_changes(self):
+        store = self.tick_store
+        with self._lock:
+            clients = list(self.clients.values())
+        tokens, self._tick_version = store.changed_since(self._tick_version)
+        if not clients:
+            return 0
+        quote_clients = [c for c in clients if "quotes" in c.channels]
+        if tokens and quote_clients:
+            if any(c.symbols_by_token is None for c in quote_clients):
+                wanted = tokens
+            else:
+                wanted = [t for t in tokens if any(t in c.symbols_by_token for c in quote_clients)]
+            quotes = {token: compact_quote(row) for token, row in store.snapshot(wanted).items()}
+            for client in quote_clients:
+                mapping = client.symbols_by_token
+                if mapping is None:
+                    offered = {self._symbol(token): quote for token, quote in quotes.items()}
+                else:
+                    offered = {mapping[token]: quote for token, quote in quotes.items() if token in mapping}
+                if offered:
+                    client.offer(offered)
+        if self.rest_snapshot is not None:
+            version = self.rest_snapshot.version("positions")
+            if version != self._positions_version:
+                self._positions_version = version
+                for client in clients:
+                    client.offer_event("positions", self.rest_snapshot.get("positions", []))
+        if self.order_book is not None and self.order_book.version != self._orders_version:
+            self._orders_version = self.order_book.version
+            orders = self.order_book.orders()
+            for client in clients:
+                client.offer_event("orders", orders)
+        return len(tokens)
+
+    def _run(self):
+        while not self._stop.wait(self.poll_interval):
+            try:
+                self.publish_changes()
+            except Exception as e_stream:
+                metrics.error("stream", e_stream)
+                print(f"[{dt_now_str_fn()}] Quote stream: publish failed: {e_stream}")
+
+    def stats(self):
+        with self._lock:
+            clients = list(self.clients.values())
+        return {"clients": len(clients), "frames_sent": sum(c.frames_sent for c in clients),
+                "quotes_conflated": sum(c.quotes_conflated for c in clients)}
@@ -0,0 +1,112 @@
+import threading
+import time
+from metrics import metrics
+
+RENDER_COM_BUDGET = 0.75 # Share of wall time the main loop may spend rendering; the rest is left to Excel for recalcs and user edits
+RENDER_COST_EWMA_ALPHA = 0.3 # Weight of the newest frame in each lane's measured cost
+RENDER_MIN_ROWS_PER_FRAME = 10 # Row budgets never drop below this, so a very slow Excel still makes progress
+
+class RenderLane:
+    def __init__(self, name, weight, min_interval, max_interval):
+        self.name = name
+        self.weight = weight
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.interval = min_interval
+        self.cost = None # EWMA seconds per frame
+        self.row_cost = None # EWMA seconds per row, for lanes that report rows
+        self.next_due = 0.0
+        self.frames = 0
+        self.frames_skipped = 0
+        self.pending_key = None # state waiting for the lane to come due, if any
+        self.pending_since = 0.0 # when pending_key was last counted as a frame of its own
+
+class RenderScheduler:
+    # Paces each sheet's redraws from its own measured frame time. A lane with weight w may spend
+    # about budget * w of wall time rendering, so after a frame that took d seconds the next one is
+    # due d / (budget * w) later, clamped to [min_interval, max_interval]: a fast Excel gets frames as
+    # often as min_interval allows, a slow or busy one gets fewer, bigger frames instead of a growing
+    # backlog, and recovers on the next fast frame. Frames are never queued: the next frame draws the
+    # latest state. A pending state replaced by a newer one counts as a skipped frame, at most once
+    # per min_interval: the frames a lane drawing at its full rate would have shown.
+    def __init__(self, budget=RENDER_COM_BUDGET, alpha=RENDER_COST_EWMA_ALPHA, clock=time.monotonic):
+        self.budget = budget
+        self.alpha = alpha
+        self.clock = clock
+        self.lanes = {}
+        self._lock = threading.Lock()
+
+    def add_lane(self, name, weight, min_interval, max_interval):
+        self.lanes[name] = RenderLane(name, weight, min_interval, max_interval)
+        return self
+
+    def due(self, name, now=None):
+        return (self.clock() if now is None else now) >= self.lanes[name].next_due
+
+    def skip(self, name):
+        lane = self.lanes[name]
+        lane.frames_skipped += 1
+        metrics.inc("render_frames_skipped", sheet=name)
+
+    def try_frame(self, name, key=None):
+        # True when the lane is due. Otherwise key (the state the caller wants drawn) is held as
+        # pending, and a skipped frame is recorded only when it supersedes a different pending state.
+        lane = self.lanes[name]
+        now = self.clock()
+        if now >= lane.next_due:
+            lane.pending_key = None
+            return True
+        if key is not None and key != lane.pending_key:
+            if lane.pending_key is None:
+                lane.pending_since = now
+            elif now - lane.pending_since >= lane.min_interval:
+                self.skip(name)
+                lane.pending_since = now
+            lane.pending_key = key
+        return False
+
+    def record(self, name, started, duration, rows=None):
+        lane = self.lanes[name]
+        with self._lock:
+            lane.cost = duration if lane.cost is None else lane.cost + self.alpha * (duration - lane.cost)
+            if rows:
+                per_row = duration / rows
+                lane.row_cost = per_row if lane.row_cost is None else lane.row_cost + self.alpha * (per_row - lane.row_cost)
+            lane.interval = min(max(duration / (self.budget * lane.weight), lane.min_interval), lane.max_interval)
+            lane.next_due = started + lane.interval
+            lane.pending_key = None
+            lane.frames += 1
+        metrics.observe("render_frame_seconds", duration, sheet=name)
+
+    def frame(self, name, rows=None):
+        # Context manager form of record(): with scheduler.frame("Orders"): render(...)
+        return _Frame(self, name, rows)
+
+    def row_budget(self, name, frame_budget_seconds):
+        # Rows that fit in one frame at the measured per-row cost; None (no limit) until a frame
+        # with rows was measured.
+        lane = self.lanes[name]
+        if not lane.row_cost:
+            return None
+        return max(RENDER_MIN_ROWS_PER_FRAME, int(frame_budget_seconds / lane.row_cost))
+
+    def seconds_until_next(self, now=None):
+        now = self.clock() if now is None else now
+        return max(min((lane.next_due for lane in self.lanes.values()), default=now) - now, 0.0)
+
+    def stats(self):
+        return {name: {"interval": round(lane.interval, 3), "cost": round(lane.cost, 4) if lane.cost is not None else None,
+                       "frames": lane.frames, "skipped": lane.frames_skipped}
+                for name, lane in self.lanes.items()}
+
+class _Frame:
+    def __init__(self, scheduler, name, rows):
+        self.scheduler, self.name, self.rows = scheduler, name, rows
+
+    def __enter__(self):
+        self.started = self.scheduler.clock()
+        return self
+
+    def __exit__(self, *exc):
+        self.scheduler.record(self.name, self.started, self.scheduler.clock() - self.started, self.rows)
+        return False
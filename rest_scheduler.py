@@ -0,0 +1,211 @@
+import datetime
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from metrics import metrics
+
+# Kite Connect published limits (requests per second)
+KITE_RATE_LIMITS = {
+    "quote": 1,
+    "historical": 3,
+    "order": 10,
+    "default": 10,
+}
+REST_SCHEDULER_WORKERS = 4 # Due endpoints are fetched in parallel so one slow call does not delay the rest
+
+def dt_now_str_fn():
+    return datetime.datetime.now().strftime("%H:%M:%S.%f")[:-3]
+
+class TokenBucket:
+    def __init__(self, rate_per_sec, capacity=None):
+        self.rate = float(rate_per_sec)
+        self.capacity = float(capacity if capacity is not None else rate_per_sec)
+        self._tokens = self.capacity
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        self._tokens = min(self.capacity, self._tokens + (now - self._last) * self.rate)
+        self._last = now
+
+    def try_acquire(self, tokens=1):
+        with self._lock:
+            self._refill(time.monotonic())
+            if self._tokens >= tokens:
+                self._tokens -= tokens
+                return True
+            return False
+
+    def acquire(self, tokens=1, timeout=None):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._refill(now)
+                if self._tokens >= tokens:
+                    self._tokens -= tokens
+                    return True
+                wait = (tokens - self._tokens) / self.rate
+            if deadline is not None:
+                if now + wait > deadline:
+                    return False
+            time.sleep(wait)
+
+class KiteRateLimiter:
+    def __init__(self, limits=None):
+        self.buckets = {name: TokenBucket(rate) for name, rate in (limits or KITE_RATE_LIMITS).items()}
+
+    def acquire(self, category="default", timeout=None):
+        bucket = self.buckets.get(category) or self.buckets["default"]
+        return bucket.acquire(timeout=timeout)
+
+    def try_acquire(self, category="default"):
+        bucket = self.buckets.get(category) or self.buckets["default"]
+        return bucket.try_acquire()
+
+class RestSnapshot:
+    # Latest REST results shared by every update_* function. Each publish bumps the
+    # endpoint's version so readers can tell whether anything changed since they last looked.
+    # A failed refresh leaves the data alone and records its error until the next publish.
+    def __init__(self):
+        self._data = {}
+        self._errors = {}
+        self._versions = {}
+        self._updated_at = {}
+        self._lock = threading.Lock()
+
+    def publish(self, name, data):
+        with self._lock:
+            self._data[name] = data
+            self._errors.pop(name, None)
+            self._versions[name] = self._versions.get(name, 0) + 1
+            self._updated_at[name] = time.time()
+
+    def get(self, name, default=None):
+        with self._lock:
+            return self._data.get(name, default)
+
+    def fail(self, name, error):
+        with self._lock:
+            self._errors[name] = str(error)
+
+    def error(self, name):
+        with self._lock:
+            return self._errors.get(name)
+
+    def version(self, name):
+        with self._lock:
+            return self._versions.get(name, 0)
+
+    def updated_at(self, name):
+        with self._lock:
+            return self._updated_at.get(name)
+
+class RestScheduler:
+    # Owns every periodic REST read. Each endpoint has its own interval, every call goes
+    # through the shared rate limiter, and failures keep the previous snapshot in place.
+    # Endpoints that fall due together are fetched concurrently on a small worker pool.
+    def __init__(self, kite, snapshot=None, rate_limiter=None, max_workers=REST_SCHEDULER_WORKERS):
+        self.kite = kite
+        self.snapshot = snapshot or RestSnapshot()
+        self.rate_limiter = rate_limiter or kite_rate_limiter
+        self._endpoints = {}
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="rest-fetch") if max_workers > 1 else None
+
+    def register(self, name, fetch_fn, interval_seconds, category="default"):
+        with self._lock:
+            self._endpoints[name] = {
+                "fetch": fetch_fn, "interval": interval_seconds, "category": category,
+                "next_due": 0.0, "calls": 0, "errors": 0, "last_error": None, "failed_at": None,
+            }
+
+    def set_interval(self, name, interval_seconds):
+        with self._lock:
+            endpoint = self._endpoints[name]
+            endpoint["next_due"] = min(endpoint["next_due"], time.monotonic() + interval_seconds)
+            endpoint["interval"] = interval_seconds
+
+    def request_refresh(self, *names):
+        with self._lock:
+            for name in names:
+                if name in self._endpoints:
+                    self._endpoints[name]["next_due"] = 0.0
+        self._wake.set()
+
+    def refresh_now(self, name):
+        with self._lock:
+            endpoint = self._endpoints[name]
+            endpoint["next_due"] = time.monotonic() + endpoint["interval"]
+        self._fetch(name, endpoint)
+
+    def _fetch(self, name, endpoint):
+        self.rate_limiter.acquire(endpoint["category"])
+        endpoint["calls"] += 1
+        started = time.perf_counter()
+        try:
+            data = endpoint["fetch"](self.kite)
+        except Exception as e:
+            metrics.error(f"rest_{name}", e)
+            endpoint["errors"] += 1
+            endpoint["last_error"] = str(e)
+            endpoint["failed_at"] = time.time()
+            self.snapshot.fail(name, e)
+            print(f"[{dt_now_str_fn()}] REST scheduler: {name} refresh failed: {e}")
+            return False
+        finally:
+            metrics.observe("rest_call_seconds", time.perf_counter() - started, endpoint=name)
+        self.snapshot.publish(name, data)
+        return True
+
+    def run_pending(self):
+        now = time.monotonic()
+        with self._lock:
+            due = [(name, ep) for name, ep in self._endpoints.items() if ep["next_due"] <= now]
+            for name, ep in due:
+                ep["next_due"] = now + ep["interval"]
+        if self._pool is not None and len(due) > 1:
+            for future in [self._pool.submit(self._fetch, name, ep) for name, ep in due]:
+                future.result()
+        else:
+            for name, ep in due:
+                self._fetch(name, ep)
+        with self._lock:
+            next_due = min((ep["next_due"] for ep in self._endpoints.values()), default=now + 1.0)
+        return max(next_due - time.monotonic(), 0.0)
+
+    def _run(self):
+        while not self._stop.is_set():
+            wait = self.run_pending()
+            self._wake.wait(timeout=min(wait, 1.0))
+            self._wake.clear()
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="rest-scheduler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+        if self._pool is not None:
+            self._pool.shutdown(wait=False)
+
+    def stats(self):
+        with self._lock:
+            endpoints = dict(self._endpoints)
+        now = time.time()
+        stats = {}
+        for name, ep in endpoints.items():
+            updated_at = self.snapshot.updated_at(name)
+            stats[name] = {"calls": ep["calls"], "errors": ep["errors"], "interval": ep["interval"],
+                           "snapshot_age": round(now - updated_at, 1) if updated_at else None,
+                           "serving_stale": bool(ep["failed_at"] and (not updated_at or ep["failed_at"] > updated_at))}
+        return stats
+
+kite_rate_limiter = KiteRateLimiter()
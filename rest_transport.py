@@ -0,0 +1,205 @@
+import datetime
+import random
+import re
+import threading
+import time
+import requests
+from requests.adapters import HTTPAdapter
+from metrics import metrics
+
+REST_POOL_CONNECTIONS = 4 # Kite has one API host; a few pools cover api/login redirects
+REST_POOL_MAXSIZE = 16 # Keep-alive sockets per host: order dispatch workers + scheduler workers + quote fallback
+REST_READ_RETRIES = 2 # Extra attempts for idempotent (GET) calls that failed fast; orders are never retried here, see OrderDispatcher
+REST_RETRY_BASE_SECONDS = 0.2 # Full-jitter backoff: uniform(0, base * 2**attempt)
+REST_RETRY_STATUSES = (429, 500, 502, 503, 504)
+REST_BREAKER_FAILURES = 5 # Consecutive failures that open an endpoint's breaker
+REST_BREAKER_COOLDOWN_SECONDS = 15 # Open breakers fail fast this long, then let one probe call through
+REST_TIMEOUTS = { # endpoint -> (connect, read) seconds; library default is 7s for everything
+    "quote": (2, 3),
+    "positions": (2, 4),
+    "holdings": (2, 4),
+    "orders": (2, 4),
+    "order_history": (2, 3),
+    "margins": (2, 4),
+    "place_order": (2, 5),
+    "modify_order": (2, 5),
+    "cancel_order": (2, 5),
+    "historical": (3, 10),
+    "instruments": (3, 30),
+    "default": (2, 5),
+}
+REST_ENDPOINTS = ( # (method or None for any, path regex, endpoint name); first match wins
+    (None, r"^/quote", "quote"),
+    (None, r"^/portfolio/positions", "positions"),
+    (None, r"^/portfolio/holdings", "holdings"),
+    ("GET", r"^/orders/[^/]+(/trades)?$", "order_history"),
+    ("GET", r"^/orders$", "orders"),
+    ("POST", r"^/orders/", "place_order"),
+    ("PUT", r"^/orders/", "modify_order"),
+    ("DELETE", r"^/orders/", "cancel_order"),
+    (None, r"^/(user/)?margins", "margins"),
+    (None, r"^/instruments/historical/", "historical"),
+    (None, r"^/instruments", "instruments"),
+)
+_ENDPOINT_PATTERNS = [(method, re.compile(pattern), name) for method, pattern, name in REST_ENDPOINTS]
+
+def dt_now_str_fn():
+    return datetime.datetime.now().strftime("%H:%M:%S.%f")[:-3]
+
+def endpoint_for(method, path):
+    path = path.split("?", 1)[0]
+    for pattern_method, pattern, name in _ENDPOINT_PATTERNS:
+        if (pattern_method is None or pattern_method == method) and pattern.match(path):
+            return name
+    return "default"
+
+class CircuitOpenError(requests.exceptions.ConnectionError):
+    # Raised instead of sending while an endpoint's breaker is open. It is a ConnectionError so every
+    # existing except path treats it like the network being down and keeps its last good data.
+    pass
+
+class CircuitBreaker:
+    # closed -> open after max_failures in a row -> one probe after cooldown -> closed on success.
+    def __init__(self, max_failures=REST_BREAKER_FAILURES, cooldown_seconds=REST_BREAKER_COOLDOWN_SECONDS, clock=time.monotonic):
+        self.max_failures = max_failures
+        self.cooldown_seconds = cooldown_seconds
+        self.clock = clock
+        self.failures = 0
+        self.opened_at = None
+        self.probing = False
+        self.opens = 0
+        self._lock = threading.Lock()
+
+    def allow(self):
+        with self._lock:
+            if self.opened_at is None:
+                return True
+            if self.probing or self.clock() - self.opened_at < self.cooldown_seconds:
+                return False
+            self.probing = True
+            return True
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self.probing = False
+
+    def record_failure(self):
+        # True when this failure opened the breaker.
+        with self._lock:
+            self.failures += 1
+            if self.probing or (self.opened_at is None and self.failures >= self.max_failures):
+                was_open = self.opened_at is not None
+                self.opened_at = self.clock()
+                self.probing = False
+                self.opens += 0 if was_open else 1
+                return not was_open
+            return False
+
+    @property
+    def state(self):
+        with self._lock:
+            return "closed" if self.opened_at is None else "half_open" if self.probing else "open"
+
+class PooledTransport(HTTPAdapter):
+    # Transport mounted under KiteConnect's requests session. Connections are kept alive in a sized
+    # pool; every request gets its endpoint's timeout instead of the client-wide one; GETs refused on
+    # connect or answered with a 429/5xx are retried with jittered backoff (a timeout has already used
+    # the call's whole budget, so it is not retried); and each endpoint has a
+    # circuit breaker so a dead endpoint fails in microseconds rather than holding a thread for the
+    # full timeout. Callers (RestScheduler, QuoteCache) keep serving their last good data on failure.
+    def __init__(self, timeouts=None, retries=REST_READ_RETRIES, retry_base_seconds=REST_RETRY_BASE_SECONDS,
+                 breaker_failures=REST_BREAKER_FAILURES, breaker_cooldown_seconds=REST_BREAKER_COOLDOWN_SECONDS,
+                 pool_connections=REST_POOL_CONNECTIONS, pool_maxsize=REST_POOL_MAXSIZE, sleep=time.sleep):
+        super().__init__(pool_connections=pool_connections, pool_maxsize=pool_maxsize, max_retries=0)
+        self.timeouts = dict(REST_TIMEOUTS, **(timeouts or {}))
+        self.retries = retries
+        self.retry_base_seconds = retry_base_seconds
+        self.breaker_failures = breaker_failures
+        self.breaker_cooldown_seconds = breaker_cooldown_seconds
+        self.sleep = sleep
+        self.breakers = {}
+        self.calls = {}
+        self.failures = {}
+        self._lock = threading.Lock()
+
+    def breaker(self, endpoint):
+        breaker = self.breakers.get(endpoint)
+        if breaker is None:
+            with self._lock:
+                breaker = self.breakers.setdefault(endpoint, CircuitBreaker(self.breaker_failures, self.breaker_cooldown_seconds))
+        return breaker
+
+    def _count(self, counts, endpoint):
+        with self._lock:
+            counts[endpoint] = counts.get(endpoint, 0) + 1
+
+    def _failed(self, endpoint, reason, breaker):
+        self._count(self.failures, endpoint)
+        metrics.inc("rest_http_failures", endpoint=endpoint, reason=reason)
+        if breaker.record_failure():
+            metrics.inc("rest_circuit_opened", endpoint=endpoint)
+            print(f"[{dt_now_str_fn()}] REST transport: {endpoint} circuit open for {breaker.cooldown_seconds}s after {breaker.failures} failures")
+
+    def send(self, request, stream=False, timeout=None, verify=True, cert=None, proxies=None):
+        endpoint = endpoint_for(request.method, request.path_url)
+        timeout = self.timeouts.get(endpoint, self.timeouts["default"])
+        breaker = self.breaker(endpoint)
+        retries = self.retries if request.method == "GET" else 0
+        attempt = 0
+        while True:
+            if not breaker.allow():
+                metrics.inc("rest_http_failures", endpoint=endpoint, reason="circuit_open")
+                raise CircuitOpenError(f"{endpoint} circuit open", request=request)
+            self._count(self.calls, endpoint)
+            started = time.perf_counter()
+            try:
+                response = super().send(request, stream=stream, timeout=timeout, verify=verify, cert=cert, proxies=proxies)
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e_transport:
+                metrics.observe("rest_http_seconds", time.perf_counter() - started, endpoint=endpoint)
+                self._failed(endpoint, "timeout" if isinstance(e_transport, requests.exceptions.Timeout) else "connection", breaker)
+                if attempt >= retries or isinstance(e_transport, requests.exceptions.Timeout):
+                    raise
+            except Exception:
+                # Anything else (ChunkedEncodingError, ContentDecodingError, ...) still settles the
+                # call, or a half-open probe would stay in flight and keep the endpoint shut.
+                metrics.observe("rest_http_seconds", time.perf_counter() - started, endpoint=endpoint)
+                self._failed(endpoint, "error", breaker)
+                raise
+            else:
+                metrics.observe("rest_http_seconds", time.perf_counter() - started, endpoint=endpoint)
+                if response.status_code not in REST_RETRY_STATUSES:
+                    # 4xx other than 429 is the request's fault (bad order, expired token), not the endpoint's.
+                    breaker.record_success()
+                    return response
+                self._failed(endpoint, f"http_{response.status_code}", breaker)
+                if attempt >= retries:
+                    return response
+                response.close()
+            attempt += 1
+            metrics.inc("rest_http_retries", endpoint=endpoint)
+            self.sleep(random.uniform(0, self.retry_base_seconds * 2 ** attempt))
+
+    def stats(self):
+        with self._lock:
+            endpoints = set(self.calls) | set(self.breakers)
+            return {endpoint: {"calls": self.calls.get(endpoint, 0), "failures": self.failures.get(endpoint, 0),
+                               "circuit": self.breakers[endpoint].state if endpoint in self.breakers else "closed",
+                               "timeout": self.timeouts.get(endpoint, self.timeouts["default"])}
+                    for endpoint in sorted(endpoints)}
+
+def install_transport(kite, **kwargs):
+    # Mounts a PooledTransport on the KiteConnect client's session; returns it for stats().
+    transport = PooledTransport(**kwargs)
+    kite.reqsession.mount("https://", transport)
+    kite.reqsession.mount("http://", transport)
+    return transport
+
+def transport_stats(kite):
+    # Per-endpoint stats of the transport under a KiteConnect client, or None when it has none (fake or remote clients).
+    session = getattr(kite, "reqsession", None)
+    if session is None:
+        return None
+    adapter = session.adapters.get("https://")
+    return adapter.stats() if isinstance(adapter, PooledTransport) else None
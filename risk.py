@@ -0,0 +1,200 @@
+import datetime
+import threading
+import time
+from metrics import metrics
+
+RISK_MAX_LOTS_PER_ORDER = 36 # Around the exchange freeze quantity for index options; larger orders must be sliced. Lot-size-1 instruments are bounded by notional only
+RISK_MAX_POSITION_LOTS = 200 # Net lots per symbol after the order, only checked when the order adds to the position
+RISK_MAX_ORDER_NOTIONAL = 5_000_000 # Rupees, quantity x price
+RISK_PRICE_BAND = 0.20 # Limit prices of LIMIT/SL orders further than this fraction from LTP are treated as fat-finger
+RISK_TRIGGER_BAND = 0.90 # Stop-loss triggers sit well away from LTP on options (LTP 10, trigger 6), so only a misplaced decimal is caught
+RISK_DUPLICATE_WINDOW_SECONDS = 10 # The same symbol/side/qty/price/type again within this window is a duplicate
+RISK_REFRESH_INTERVAL_SECONDS = 1 # How often cached margins and net positions are re-read from the REST snapshot
+CASH_INSTRUMENT_TYPES = ("CE", "PE") # Option buys cost the full premium in any product, like CNC equity buys, so both are checked against cash
+QUANTITY_IN_LOTS_EXCHANGES = ("MCX",) # Kite takes order and position quantity in lots here; everywhere else it is in units
+LIMIT_PRICE_ORDER_TYPES = ("LIMIT", "SL")
+
+def dt_now_str_fn():
+    return datetime.datetime.now().strftime("%H:%M:%S.%f")[:-3]
+
+class RiskLimits:
+    def __init__(self, max_lots_per_order=RISK_MAX_LOTS_PER_ORDER, max_position_lots=RISK_MAX_POSITION_LOTS,
+                 max_order_notional=RISK_MAX_ORDER_NOTIONAL, price_band=RISK_PRICE_BAND, trigger_band=RISK_TRIGGER_BAND,
+                 duplicate_window_seconds=RISK_DUPLICATE_WINDOW_SECONDS):
+        self.max_lots_per_order = max_lots_per_order
+        self.max_position_lots = max_position_lots
+        self.max_order_notional = max_order_notional
+        self.price_band = price_band
+        self.trigger_band = trigger_band
+        self.duplicate_window_seconds = duplicate_window_seconds
+
+    def as_dict(self):
+        return dict(vars(self))
+
+class RiskEngine:
+    # Local pre-trade checks run before an order reaches the dispatcher. Everything a check needs is
+    # cached: available cash and net quantity per symbol are re-read from the REST snapshot by a
+    # background thread, lot size and instrument type are looked up once per symbol, and LTP comes
+    # from the live tick store. check() therefore never makes a network call.
+    def __init__(self, ltp_for, instrument_for=None, lot_size_for=None, rest_snapshot=None, limits=None,
+                 refresh_interval=RISK_REFRESH_INTERVAL_SECONDS, clock=time.monotonic):
+        self.ltp_for = ltp_for # symbol -> float or None
+        self.instrument_for = instrument_for # symbol -> instrument dict or None
+        self.lot_size_for = lot_size_for # symbol -> lot size when the instrument has none
+        self.rest_snapshot = rest_snapshot
+        self.limits = limits or RiskLimits()
+        self.refresh_interval = refresh_interval
+        self.clock = clock
+        self.available_cash = None
+        self.net_quantity = {}
+        self.multipliers = {} # symbol -> units per lot from positions, for exchanges quoting quantity in lots
+        self._symbols = {} # symbol -> (lot size, instrument type)
+        self._recent = {} # duplicate key -> placed at
+        self._versions = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self.checked = 0
+        self.rejected = 0
+
+    def refresh(self):
+        snapshot = self.rest_snapshot
+        if snapshot is None:
+            return
+        versions = (snapshot.version("margins"), snapshot.version("positions"))
+        if versions == self._versions:
+            return
+        margins = snapshot.get("margins") or {}
+        available = (margins.get("equity") or {}).get("available") or {}
+        cash = available.get("live_balance", available.get("cash"))
+        net_quantity, multipliers = {}, dict(self.multipliers)
+        for pos in snapshot.get("positions", []) or []:
+            symbol_str = f"{pos.get('exchange', '').upper()}:{pos.get('tradingsymbol', '').upper()}"
+            net_quantity[symbol_str] = net_quantity.get(symbol_str, 0) + (pos.get("quantity") or 0)
+            if pos.get("multiplier"):
+                multipliers[symbol_str] = float(pos["multiplier"])
+        with self._lock:
+            self.available_cash = float(cash) if cash not in (None, "") else None
+            self.net_quantity = net_quantity
+            self.multipliers = multipliers
+            self._versions = versions
+
+    def _run(self):
+        while not self._stop.wait(self.refresh_interval):
+            try:
+                self.refresh()
+            except Exception as e_risk_refresh:
+                metrics.error("risk_refresh", e_risk_refresh)
+                print(f"[{dt_now_str_fn()}] Risk: could not refresh limits: {e_risk_refresh}")
+
+    def start(self):
+        self.refresh()
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="risk-refresh", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+
+    def _symbol_info(self, symbol_str):
+        info = self._symbols.get(symbol_str)
+        if info is None:
+            inst = self.instrument_for(symbol_str) if self.instrument_for else None
+            lot_size = (inst or {}).get("lot_size") or (self.lot_size_for(symbol_str) if self.lot_size_for else 1) or 1
+            instrument_type = (inst or {}).get("instrument_type")
+            if not instrument_type:
+                instrument_type = symbol_str[-2:] if symbol_str[-2:] in ("CE", "PE") else "FUT" if symbol_str.endswith("FUT") else "EQ"
+            info = self._symbols[symbol_str] = (int(lot_size), instrument_type)
+        return info
+
+    def _duplicate_key(self, order_params):
+        return (f"{order_params['exchange']}:{order_params['tradingsymbol']}", order_params["transaction_type"], order_params["quantity"],
+                order_params.get("price"), order_params.get("trigger_price"), order_params["order_type"])
+
+    def check(self, order_params, now=None):
+        # None when the order passes, otherwise (check name, reason). An order with neither a limit
+        # price nor a cached LTP cannot be sized, so it fails closed.
+        now = self.clock() if now is None else now
+        symbol_str = f"{order_params['exchange']}:{order_params['tradingsymbol']}"
+        qty = order_params["quantity"]
+        is_buy = order_params["transaction_type"] == "BUY"
+        limits = self.limits
+        lot_size, instrument_type = self._symbol_info(symbol_str)
+        # Quantity in lots (MCX) is always a whole number of lots, and each one is worth the
+        # position multiplier in units; elsewhere quantity is in units and must fill whole lots.
+        in_lots = order_params["exchange"] in QUANTITY_IN_LOTS_EXCHANGES
+        lot_units = 1 if in_lots else lot_size
+        units_per_qty = (self.multipliers.get(symbol_str) or lot_size) if in_lots else 1
+        lot_bounded = in_lots or lot_size > 1
+        if qty <= 0:
+            return "quantity", f"quantity {qty} must be positive"
+        if qty % lot_units:
+            return "lot_size", f"quantity {qty} is not a multiple of lot size {lot_size}"
+        if lot_bounded and qty > limits.max_lots_per_order * lot_units:
+            return "max_lots", f"{qty // lot_units} lots exceeds {limits.max_lots_per_order} per order"
+        ltp = self.ltp_for(symbol_str)
+        price = order_params.get("price") or order_params.get("trigger_price")
+        if ltp:
+            # An SL order's limit price applies once it triggers, so it is banded against its trigger.
+            trigger = order_params.get("trigger_price")
+            limit_basis = ("trigger", trigger) if order_params["order_type"] == "SL" and trigger else ("LTP", ltp)
+            bands = (("price", limits.price_band if order_params["order_type"] in LIMIT_PRICE_ORDER_TYPES else None, limit_basis),
+                     ("trigger_price", limits.trigger_band, ("LTP", ltp)))
+            for name, band, (basis, reference) in bands:
+                value = order_params.get(name)
+                if value and band is not None and abs(value - reference) > band * reference:
+                    return "price_band", f"{name} {value} is {abs(value / reference - 1) * 100:.0f}% from {basis} {reference}"
+        reference_price = price or ltp
+        if not reference_price:
+            return "no_price", f"no LTP for {symbol_str} to size a {order_params['order_type']} order"
+        notional = qty * units_per_qty * reference_price
+        if notional > limits.max_order_notional:
+            return "max_notional", f"notional {notional:,.0f} exceeds {limits.max_order_notional:,.0f}"
+        pays_full = instrument_type in CASH_INSTRUMENT_TYPES or order_params.get("product") == "CNC"
+        if is_buy and pays_full and self.available_cash is not None and notional > self.available_cash:
+            return "margin", f"notional {notional:,.0f} exceeds available cash {self.available_cash:,.0f}"
+        net = self.net_quantity.get(symbol_str, 0)
+        after = net + qty if is_buy else net - qty
+        if lot_bounded and abs(after) > abs(net) and abs(after) > limits.max_position_lots * lot_units:
+            return "max_position", f"position would be {after // lot_units} lots, limit {limits.max_position_lots}"
+        with self._lock:
+            sent_at = self._recent.get(self._duplicate_key(order_params))
+        if sent_at is not None and now - sent_at < limits.duplicate_window_seconds:
+            return "duplicate", f"same order sent {now - sent_at:.1f}s ago"
+        return None
+
+    def record_sent(self, order_params, now=None):
+        # Called once an order was actually placed; only placed orders make a later one a duplicate.
+        now = self.clock() if now is None else now
+        with self._lock:
+            self._recent[self._duplicate_key(order_params)] = now
+            if len(self._recent) > 1000:
+                self._recent = {k: t for k, t in self._recent.items() if now - t < self.limits.duplicate_window_seconds}
+
+    def check_batch(self, orders):
+        # orders: [(row, order_params, tag)] -> (accepted orders, {row: reason}) with metrics per check.
+        started = time.perf_counter()
+        accepted, rejected = [], {}
+        batch_keys = set()
+        for order in orders:
+            verdict = self.check(order[1])
+            if verdict is None:
+                key = self._duplicate_key(order[1])
+                if key in batch_keys:
+                    verdict = ("duplicate", "same order on an earlier row of this batch")
+                batch_keys.add(key)
+            self.checked += 1
+            if verdict is None:
+                accepted.append(order)
+            else:
+                self.rejected += 1
+                rejected[order[0]] = verdict[1]
+                metrics.inc("risk_rejected", check=verdict[0])
+        metrics.observe("stage_seconds", time.perf_counter() - started, stage="risk_check")
+        return accepted, rejected
+
+    def stats(self):
+        return {"checked": self.checked, "rejected": self.rejected, "available_cash": self.available_cash,
+                "limits": self.limits.as_dict()}
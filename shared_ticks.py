@@ -0,0 +1,167 @@
+import math
+import mmap
+import os
+import struct
+import tempfile
+import threading
+from tick_store import TickStore, TICK_FIELDS
+
+SHARED_TICK_CAPACITY = 16384 # Fixed slot count; the table cannot grow once both processes have mapped it
+SHARED_TICK_MAGIC = b"KTTBL001"
+_HEADER_BYTES = 64 # magic, then int64 capacity/n_slots/version/seq/ticks_applied/writer_pid, then float64 last_update_at
+_CAPACITY, _N_SLOTS, _VERSION, _SEQ, _TICKS_APPLIED, _WRITER_PID = range(6)
+_SNAPSHOT_RETRIES = 5
+
+def tick_table_size(capacity):
+    return _HEADER_BYTES + capacity * 8 * (2 + len(TICK_FIELDS))
+
+def create_tick_table(path=None, capacity=SHARED_TICK_CAPACITY):
+    # Creates the zeroed, NaN-filled backing file and returns its path. The renderer owns it.
+    if path is None:
+        fd, path = tempfile.mkstemp(prefix="kite_ticks_", suffix=".tbl")
+        os.close(fd)
+    with open(path, "wb") as f:
+        f.write(SHARED_TICK_MAGIC + struct.pack("<6q", capacity, 0, 0, 0, 0, 0) + struct.pack("<d", 0.0))
+        f.write(b"\0" * (capacity * 16))
+        f.write(struct.pack("<d", math.nan) * (capacity * len(TICK_FIELDS)))
+    return path
+
+class _SharedTable:
+    # Maps the table file and exposes its regions as typed memoryviews in the same shapes
+    # TickStore keeps in arrays: slot_tokens, slot_versions and one float column per field.
+    def _map(self, path):
+        self._file = open(path, "r+b")
+        self._mm = mmap.mmap(self._file.fileno(), 0)
+        if self._mm[:8] != SHARED_TICK_MAGIC:
+            raise ValueError(f"{path} is not a shared tick table")
+        self._header = memoryview(self._mm)[8:56].cast("q")
+        self._header_f = memoryview(self._mm)[56:64].cast("d")
+        capacity = self._header[_CAPACITY]
+        offset = _HEADER_BYTES
+        def region(typecode):
+            nonlocal offset
+            view = memoryview(self._mm)[offset:offset + capacity * 8].cast(typecode)
+            offset += capacity * 8
+            return view
+        self.path = path
+        self.capacity = capacity
+        self.slot_tokens = region("q")
+        self.slot_versions = region("Q")
+        self.columns = {field: region("d") for field in TICK_FIELDS}
+        self.token_to_slot = {}
+        self._recent_slots = {}
+        self._lock = threading.Lock()
+
+    def _grow(self):
+        raise MemoryError(f"Shared tick table full ({self.capacity} instruments); raise SHARED_TICK_CAPACITY")
+
+    @property
+    def version(self):
+        return self._header[_VERSION]
+
+    @property
+    def ticks_applied(self):
+        return self._header[_TICKS_APPLIED]
+
+    @property
+    def last_update_at(self):
+        return self._header_f[0]
+
+    def close(self):
+        views = [self._header, self._header_f, self.slot_tokens, self.slot_versions] + list(self.columns.values())
+        self.columns = {}
+        for view in views:
+            view.release()
+        self._mm.close()
+        self._file.close()
+
+class SharedTickStore(_SharedTable, TickStore):
+    # Engine side: the normal TickStore update path, writing into the shared file. A sequence
+    # counter is odd while a batch is being applied so readers can retry a torn snapshot; writers
+    # (the ticker and the reconnect gap fill) take turns so the counter stays consistent.
+    def __init__(self, path):
+        self._map(path)
+        self._header[_WRITER_PID] = os.getpid()
+        self._write_lock = threading.Lock()
+
+    @_SharedTable.version.setter
+    def version(self, value):
+        self._header[_VERSION] = value
+
+    @_SharedTable.ticks_applied.setter
+    def ticks_applied(self, value):
+        self._header[_TICKS_APPLIED] = value
+
+    @_SharedTable.last_update_at.setter
+    def last_update_at(self, value):
+        self._header_f[0] = value
+
+    def _slot_for(self, token):
+        slot = TickStore._slot_for(self, token)
+        if slot >= self._header[_N_SLOTS]:
+            self._header[_N_SLOTS] = slot + 1 # published only after slot_tokens[slot] is written
+        return slot
+
+    def update(self, ticks, received_at=None):
+        with self._write_lock:
+            self._header[_SEQ] += 1
+            try:
+                TickStore.update(self, ticks, received_at)
+            finally:
+                self._header[_SEQ] += 1
+
+class _SlotIndex(dict):
+    # token -> slot for the reader; a miss re-reads any slots the writer has added since.
+    def __init__(self, table):
+        super().__init__()
+        self.table = table
+        self.known_slots = 0
+
+    def sync(self):
+        n_slots = self.table._header[_N_SLOTS]
+        tokens = self.table.slot_tokens
+        for slot in range(self.known_slots, n_slots):
+            self[tokens[slot]] = slot
+        self.known_slots = n_slots
+
+    def get(self, token, default=None):
+        slot = dict.get(self, token)
+        if slot is None and self.table._header[_N_SLOTS] != self.known_slots:
+            self.sync()
+            slot = dict.get(self, token)
+        return default if slot is None else slot
+
+    def __contains__(self, token):
+        return self.get(token) is not None
+
+    def __len__(self):
+        self.sync()
+        return dict.__len__(self)
+
+class SharedTickView(_SharedTable, TickStore):
+    # Renderer side: read-only TickStore over the engine's table, so the update functions,
+    # symbol views and Greeks read live ticks without any IPC.
+    def __init__(self, path):
+        self._map(path)
+        self.token_to_slot = _SlotIndex(self)
+
+    def update(self, ticks, received_at=None):
+        raise TypeError("SharedTickView is read-only; ticks are written by the engine process")
+
+    def changed_since(self, version):
+        current = self.version
+        if version >= current:
+            return [], current
+        n_slots = self._header[_N_SLOTS]
+        versions, tokens = self.slot_versions, self.slot_tokens
+        return [tokens[slot] for slot in range(n_slots) if versions[slot] > version], current
+
+    def snapshot(self, tokens):
+        # Retries while the engine is mid-batch so every row comes from whole ticks.
+        for _ in range(_SNAPSHOT_RETRIES):
+            seq = self._header[_SEQ]
+            if seq % 2 == 0:
+                rows = TickStore.snapshot(self, tokens)
+                if self._header[_SEQ] == seq:
+                    return rows
+        return TickStore.snapshot(self, tokens)
@@ -0,0 +1,206 @@
+import re
+import threading
+import time
+
+# The sheet interface the rest of the project relies on is the small xlwings subset below:
+#   book.sheets (iterable of sheets with .name, indexable by name, .add(name)), book.save(), book.close()
+#   sheet.name, sheet.range("A1") / sheet.range("A1:C3") / sheet.range((r1, c1), (r2, c2))
+#   rng.value (get/set), rng.options(ndim=...).value, rng.font.bold = ...
+#   sheet.range("A2,A7,A9").font.bold = ... (multi-area union addresses, formatting only)
+# MemoryBook implements it in memory so the update functions can run without Excel.
+
+_ADDRESS_RE = re.compile(r"^\$?([A-Za-z]+)\$?(\d+)(?::\$?([A-Za-z]+)\$?(\d+))?$")
+
+def _col_to_index(letters):
+    col = 0
+    for ch in letters.upper():
+        col = col * 26 + (ord(ch) - ord("A") + 1)
+    return col
+
+def parse_address(address):
+    match = _ADDRESS_RE.match(address.strip())
+    if not match:
+        raise ValueError(f"Unsupported range address: {address}")
+    r1, c1 = int(match.group(2)), _col_to_index(match.group(1))
+    if match.group(3):
+        r2, c2 = int(match.group(4)), _col_to_index(match.group(3))
+    else:
+        r2, c2 = r1, c1
+    return min(r1, r2), min(c1, c2), max(r1, r2), max(c1, c2)
+
+class ComStats:
+    def __init__(self):
+        self.range_reads = 0
+        self.range_writes = 0
+        self.cells_read = 0
+        self.cells_written = 0
+        self.format_calls = 0
+        self._lock = threading.Lock()
+
+    def as_dict(self):
+        return {"range_reads": self.range_reads, "range_writes": self.range_writes, "cells_read": self.cells_read,
+                "cells_written": self.cells_written, "format_calls": self.format_calls}
+
+class _Font:
+    def __init__(self, rng):
+        self._rng = rng
+
+    @property
+    def bold(self):
+        sheet = self._rng.sheet
+        return all(sheet.bold.get(cell, False) for cell in self._rng.cells())
+
+    @bold.setter
+    def bold(self, value):
+        sheet = self._rng.sheet
+        sheet.book._com_call("format", 0)
+        for cell in self._rng.cells():
+            sheet.bold[cell] = bool(value)
+
+class MemoryRange:
+    def __init__(self, sheet, r1, c1, r2, c2, ndim=None):
+        self.sheet = sheet
+        self.r1, self.c1, self.r2, self.c2 = r1, c1, r2, c2
+        self.ndim = ndim
+        self.font = _Font(self)
+
+    def cells(self):
+        return [(r, c) for r in range(self.r1, self.r2 + 1) for c in range(self.c1, self.c2 + 1)]
+
+    def options(self, ndim=None, **kwargs):
+        return MemoryRange(self.sheet, self.r1, self.c1, self.r2, self.c2, ndim=ndim)
+
+    @property
+    def shape(self):
+        return (self.r2 - self.r1 + 1, self.c2 - self.c1 + 1)
+
+    @property
+    def value(self):
+        rows, cols = self.shape
+        self.sheet.book._com_call("read", rows * cols)
+        data = self.sheet.cells
+        grid = [[data.get((r, c)) for c in range(self.c1, self.c2 + 1)] for r in range(self.r1, self.r2 + 1)]
+        if self.ndim == 2:
+            return grid
+        if self.ndim == 1:
+            return grid[0] if rows == 1 else [row[0] for row in grid] if cols == 1 else grid
+        if rows == 1 and cols == 1:
+            return grid[0][0]
+        if rows == 1:
+            return grid[0]
+        if cols == 1:
+            return [row[0] for row in grid]
+        return grid
+
+    @value.setter
+    def value(self, values):
+        # Same expansion rules as xlwings: nested lists expand from the top-left cell, a flat
+        # list fills a row, and a scalar fills the whole range.
+        data = self.sheet.cells
+        written = 0
+        if isinstance(values, (list, tuple)):
+            rows = values if values and isinstance(values[0], (list, tuple)) else [values]
+            for r_off, row in enumerate(rows):
+                for c_off, v in enumerate(row):
+                    data[(self.r1 + r_off, self.c1 + c_off)] = None if v == "" else v
+                    written += 1
+        else:
+            for cell in self.cells():
+                data[cell] = None if values == "" else values
+                written += 1
+        self.sheet.book._com_call("write", written)
+        self.sheet.book._notify_write(self.sheet, self.r1, self.c1, values)
+
+    def clear_contents(self):
+        self.value = ""
+
+class MemoryUnionRange:
+    # Comma-joined multi-area address; only formatting is supported, like the project uses it.
+    def __init__(self, sheet, areas):
+        self.sheet = sheet
+        self.areas = areas
+        self.font = _Font(self)
+
+    def cells(self):
+        return [cell for area in self.areas for cell in area.cells()]
+
+class MemorySheet:
+    def __init__(self, name, book):
+        self.name = name
+        self.book = book
+        self.cells = {}
+        self.bold = {}
+
+    def range(self, first, second=None):
+        if second is None:
+            if isinstance(first, tuple):
+                r1, c1 = first
+                return MemoryRange(self, r1, c1, r1, c1)
+            if "," in first:
+                return MemoryUnionRange(self, [MemoryRange(self, *parse_address(a)) for a in first.split(",")])
+            return MemoryRange(self, *parse_address(first))
+        r1, c1 = first if isinstance(first, tuple) else parse_address(first)[:2]
+        r2, c2 = second if isinstance(second, tuple) else parse_address(second)[:2]
+        return MemoryRange(self, min(r1, r2), min(c1, c2), max(r1, r2), max(c1, c2))
+
+class _SheetCollection:
+    def __init__(self, book):
+        self._book = book
+        self._sheets = {}
+
+    def __iter__(self):
+        return iter(list(self._sheets.values()))
+
+    def __len__(self):
+        return len(self._sheets)
+
+    def __getitem__(self, key):
+        if isinstance(key, int):
+            return list(self._sheets.values())[key]
+        return self._sheets[key]
+
+    def add(self, name):
+        sheet = MemorySheet(name, self._book)
+        self._sheets[name] = sheet
+        return sheet
+
+class MemoryBook:
+    # In-memory workbook that counts every range read/write and can add a fixed delay per
+    # call to mimic the cost of an xlwings COM round-trip. com_busy spends that delay spinning
+    # in Python instead of sleeping, like xlwings converting values while it holds the GIL.
+    def __init__(self, sheet_names=(), com_latency_seconds=0.0, on_write=None, com_busy=False):
+        self.com_latency_seconds = com_latency_seconds
+        self.com_busy = com_busy
+        self.on_write = on_write
+        self.stats = ComStats()
+        self.sheets = _SheetCollection(self)
+        self.saves = 0
+        for name in sheet_names:
+            self.sheets.add(name)
+
+    def _com_call(self, kind, cells):
+        with self.stats._lock:
+            if kind == "read":
+                self.stats.range_reads += 1
+                self.stats.cells_read += cells
+            elif kind == "write":
+                self.stats.range_writes += 1
+                self.stats.cells_written += cells
+            else:
+                self.stats.format_calls += 1
+        if self.com_latency_seconds and self.com_busy:
+            deadline = time.perf_counter() + self.com_latency_seconds
+            while time.perf_counter() < deadline:
+                pass
+        elif self.com_latency_seconds:
+            time.sleep(self.com_latency_seconds)
+
+    def _notify_write(self, sheet, row, col, values):
+        if self.on_write is not None:
+            self.on_write(sheet, row, col, values, time.time())
+
+    def save(self):
+        self.saves += 1
+
+    def close(self):
+        pass
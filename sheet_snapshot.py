@@ -0,0 +1,53 @@
+import time
+
+class SheetSnapshot:
+    # Values of one rectangular sheet block, read with a single COM call at the start of a
+    # cycle. Processors share it instead of each re-reading, or probing cell by cell, the same
+    # cells. It is never modified in place: a processor that writes to the sheet returns
+    # with_values(...) so the processors after it see the sheet as it now is.
+    def __init__(self, name, top_row, left_col, rows, read_at=None):
+        self.name = name
+        self.top_row = top_row
+        self.left_col = left_col
+        self._rows = tuple(tuple(row) for row in rows)
+        self.width = max((len(row) for row in self._rows), default=0)
+        self.read_at = read_at if read_at is not None else time.time()
+
+    @classmethod
+    def read(cls, sheet, top_row, left_col, bottom_row, right_col):
+        values = sheet.range((top_row, left_col), (bottom_row, right_col)).options(ndim=2).value or []
+        return cls(sheet.name, top_row, left_col, values)
+
+    @property
+    def bottom_row(self):
+        return self.top_row + len(self._rows) - 1
+
+    def value(self, row, col):
+        r, c = row - self.top_row, col - self.left_col
+        if 0 <= r < len(self._rows) and 0 <= c < len(self._rows[r]):
+            return self._rows[r][c]
+        return None
+
+    def column(self, col, first_row=None, last_row=None):
+        first_row = self.top_row if first_row is None else first_row
+        last_row = self.bottom_row if last_row is None else last_row
+        return [self.value(row, col) for row in range(first_row, last_row + 1)]
+
+    def rows(self, first_row=None, last_row=None, first_col=None, last_col=None):
+        # Lists padded with None out to last_col, like an xlwings 2-D read of the same block.
+        first_row = self.top_row if first_row is None else first_row
+        last_row = self.bottom_row if last_row is None else last_row
+        first_col = self.left_col if first_col is None else first_col
+        last_col = self.left_col + self.width - 1 if last_col is None else last_col
+        return [[self.value(row, col) for col in range(first_col, last_col + 1)] for row in range(first_row, last_row + 1)]
+
+    def with_values(self, cells):
+        # New snapshot with {(row, col): value} applied; cells outside the block are ignored.
+        if not cells:
+            return self
+        rows = [list(row) + [None] * (self.width - len(row)) for row in self._rows]
+        for (row, col), value in cells.items():
+            r, c = row - self.top_row, col - self.left_col
+            if 0 <= r < len(rows) and 0 <= c < self.width:
+                rows[r][c] = None if value == "" else value
+        return SheetSnapshot(self.name, self.top_row, self.left_col, rows, self.read_at)
@@ -0,0 +1,140 @@
+import re
+import threading
+import time
+from metrics import metrics
+
+SHADOW_RESYNC_SECONDS = 30 # Drop the shadow grid periodically so edits made directly in Excel get overwritten again
+MERGE_GAP_COLUMNS = 2 # Clean cells inside a block may be rewritten to join two dirty runs into one range
+
+_CELL_RE = re.compile(r"^\$?([A-Za-z]+)\$?(\d+)$")
+
+def cell_to_row_col(cell_str):
+    match = _CELL_RE.match(cell_str.strip())
+    if not match:
+        raise ValueError(f"Unsupported cell address: {cell_str}")
+    col = 0
+    for ch in match.group(1).upper():
+        col = col * 26 + (ord(ch) - ord("A") + 1)
+    return int(match.group(2)), col
+
+def _row_runs(cols, allowed_cols, merge_gap):
+    runs = []
+    for col in cols:
+        if runs:
+            last_start, last_end = runs[-1]
+            gap = col - last_end - 1
+            if gap == 0 or (gap <= merge_gap and all(c in allowed_cols for c in range(last_end + 1, col))):
+                runs[-1] = (last_start, col)
+                continue
+        runs.append((col, col))
+    return runs
+
+def merge_dirty_cells(dirty_cells, known_cells=None, merge_gap=MERGE_GAP_COLUMNS):
+    # Greedy merge: contiguous dirty columns per row become runs, and identical runs on
+    # consecutive rows are stacked into one rectangle. Returns (row1, col1, row2, col2) tuples.
+    rows = {}
+    for row, col in dirty_cells:
+        rows.setdefault(row, []).append(col)
+    known_by_row = {}
+    if known_cells is not None and merge_gap:
+        for row, col in known_cells:
+            known_by_row.setdefault(row, set()).add(col)
+    open_rects = {}
+    rects = []
+    for row in sorted(rows):
+        still_open = {}
+        for run in _row_runs(sorted(rows[row]), known_by_row.get(row, ()), merge_gap):
+            rect = open_rects.get(run)
+            if rect is not None and rect[2] == row - 1:
+                rect[2] = row
+            else:
+                rect = [row, run[0], row, run[1]]
+                rects.append(rect)
+            still_open[run] = rect
+        open_rects = still_open
+    return [tuple(r) for r in rects]
+
+class SheetWriter:
+    # Keeps a shadow copy of every cell written per sheet and only pushes the cells whose
+    # value changed, merged into as few rectangular ranges (COM calls) as possible.
+    def __init__(self, resync_seconds=SHADOW_RESYNC_SECONDS, merge_gap=MERGE_GAP_COLUMNS):
+        self.resync_seconds = resync_seconds
+        self.merge_gap = merge_gap
+        self._shadow = {}
+        self._shadow_born = {}
+        self._lock = threading.RLock()
+        self.cells_written = 0
+        self.cells_skipped = 0
+        self.ranges_written = 0
+
+    def _sheet_shadow(self, sheet):
+        key = sheet.name
+        now = time.monotonic()
+        born = self._shadow_born.get(key)
+        if born is None or (self.resync_seconds and now - born > self.resync_seconds):
+            self._shadow[key] = {}
+            self._shadow_born[key] = now
+        return self._shadow[key]
+
+    def write_block(self, sheet, top_row, left_col, rows, force=False):
+        cells = {}
+        for r_off, row_values in enumerate(rows):
+            for c_off, value in enumerate(row_values):
+                cells[(top_row + r_off, left_col + c_off)] = value
+        return self.write_cells(sheet, cells, force=force)
+
+    def write_cells(self, sheet, cells, force=False):
+        with self._lock:
+            shadow = self._sheet_shadow(sheet)
+            if force:
+                dirty = set(cells)
+            else:
+                dirty = {cell for cell, value in cells.items() if cell not in shadow or shadow[cell] != value}
+            if not dirty:
+                self.cells_skipped += len(cells)
+                return 0
+            written = 0
+            for row1, col1, row2, col2 in merge_dirty_cells(dirty, cells, self.merge_gap):
+                block = [[cells[(r, c)] for c in range(col1, col2 + 1)] for r in range(row1, row2 + 1)]
+                started = time.perf_counter()
+                try:
+                    sheet.range((row1, col1), (row2, col2)).value = block
+                except Exception as e:
+                    metrics.error("sheet_write", e)
+                    for r in range(row1, row2 + 1):
+                        for c in range(col1, col2 + 1):
+                            shadow.pop((r, c), None)
+                    raise
+                metrics.observe("sheet_write_seconds", time.perf_counter() - started, sheet=sheet.name)
+                for r in range(row1, row2 + 1):
+                    for c in range(col1, col2 + 1):
+                        shadow[(r, c)] = cells[(r, c)]
+                written += (row2 - row1 + 1) * (col2 - col1 + 1)
+                self.ranges_written += 1
+            self.cells_written += written
+            self.cells_skipped += max(len(cells) - written, 0)
+            return written
+
+    def write_range(self, sheet, start_cell_str, rows, force=False):
+        top_row, left_col = cell_to_row_col(start_cell_str)
+        return self.write_block(sheet, top_row, left_col, rows, force=force)
+
+    def invalidate(self, sheet=None):
+        with self._lock:
+            if sheet is None:
+                self._shadow.clear()
+                self._shadow_born.clear()
+            else:
+                self._shadow.pop(sheet.name, None)
+                self._shadow_born.pop(sheet.name, None)
+
+    def stats(self):
+        total = self.cells_written + self.cells_skipped
+        return {
+            "cells_written": self.cells_written,
+            "cells_skipped": self.cells_skipped,
+            "ranges_written": self.ranges_written,
+            "skip_ratio": (self.cells_skipped / total) if total else 0.0,
+        }
+
+sheet_writer = SheetWriter()
@@ -0,0 +1,139 @@
+import datetime
+import threading
+from metrics import metrics
+
+MODE_LTP, MODE_QUOTE, MODE_FULL = "ltp", "quote", "full" # Same strings as KiteTicker.MODE_*
+MODES_CHEAPEST_FIRST = (MODE_LTP, MODE_QUOTE, MODE_FULL)
+_MODE_RANK = {mode: rank for rank, mode in enumerate(MODES_CHEAPEST_FIRST)}
+
+def dt_now_str_fn():
+    return datetime.datetime.now().strftime("%H:%M:%S.%f")[:-3]
+
+class SubscriptionManager:
+    # Reference-counted websocket subscriptions. Each consumer (an INPUT row, Portfolio, Holdings,
+    # the option chain, ...) owns a token set and the mode it needs; a token stays subscribed while
+    # any consumer holds it, in the richest mode any holder asked for. Consumers only edit their
+    # sets, flush() sends the net difference once per cycle (one unsubscribe, one subscribe, one
+    # set_mode per mode) and resubscribe() replays everything after a reconnect.
+    def __init__(self):
+        self.holders = {} # consumer -> (frozenset of tokens, mode)
+        self.refcounts = {} # token -> [holders wanting LTP, QUOTE, FULL]
+        self.sent = {} # token -> mode the websocket was last told about
+        self.frames_sent = 0
+        self.resubscribes = 0
+        self.dirty = False # a holder changed since the last successful flush
+        self._lock = threading.RLock()
+
+    def set_tokens(self, consumer, tokens, mode=MODE_FULL):
+        # Replaces the consumer's token set; an empty set releases the consumer.
+        new = frozenset(t for t in tokens if t)
+        rank = _MODE_RANK[mode]
+        with self._lock:
+            old, old_mode = self.holders.get(consumer, (frozenset(), mode))
+            if new == old and old_mode == mode:
+                return False
+            old_rank = _MODE_RANK[old_mode]
+            for token in old:
+                counts = self.refcounts[token]
+                counts[old_rank] -= 1
+                if not any(counts):
+                    del self.refcounts[token]
+            for token in new:
+                self.refcounts.setdefault(token, [0, 0, 0])[rank] += 1
+            if new:
+                self.holders[consumer] = (new, mode)
+            else:
+                self.holders.pop(consumer, None)
+            self.dirty = True
+            return True
+
+    def release(self, consumer):
+        return self.set_tokens(consumer, ())
+
+    def tokens_for(self, consumer):
+        return self.holders.get(consumer, (frozenset(), None))[0]
+
+    def tokens(self):
+        with self._lock:
+            return list(self.refcounts)
+
+    def refcount(self, token):
+        return sum(self.refcounts.get(token, ()))
+
+    def mode_for(self, token):
+        counts = self.refcounts.get(token)
+        if not counts:
+            return None
+        return MODES_CHEAPEST_FIRST[max(rank for rank, n in enumerate(counts) if n)]
+
+    def mode_counts(self):
+        counts = dict.fromkeys(MODES_CHEAPEST_FIRST, 0)
+        with self._lock:
+            for token in self.refcounts:
+                counts[self.mode_for(token)] += 1
+        return counts
+
+    def __contains__(self, token):
+        return token in self.refcounts
+
+    def __len__(self):
+        return len(self.refcounts)
+
+    def pending(self):
+        # (new tokens, tokens whose mode changed, tokens to drop); the first two as {mode: [tokens]}.
+        with self._lock:
+            to_subscribe, to_change = {}, {}
+            for token in self.refcounts:
+                mode = self.mode_for(token)
+                sent_mode = self.sent.get(token)
+                if sent_mode is None:
+                    to_subscribe.setdefault(mode, []).append(token)
+                elif sent_mode != mode:
+                    to_change.setdefault(mode, []).append(token)
+            to_unsubscribe = sorted(t for t in self.sent if t not in self.refcounts)
+            return to_subscribe, to_change, to_unsubscribe
+
+    def flush(self, ticker):
+        # Returns (subscribed, unsubscribed). Nothing is sent while the ticker is down; the diff stays
+        # pending and the reconnect's resubscribe() covers it.
+        if ticker is None or not ticker.is_connected():
+            return [], []
+        with self._lock:
+            if not self.dirty:
+                return [], []
+            to_subscribe, to_change, to_unsubscribe = self.pending()
+            if not to_subscribe and not to_change and not to_unsubscribe:
+                self.dirty = False
+                return [], []
+            subscribed = []
+            try:
+                if to_unsubscribe:
+                    ticker.unsubscribe(to_unsubscribe)
+                    self.frames_sent += 1
+                    for token in to_unsubscribe:
+                        del self.sent[token]
+                new_tokens = sorted(t for tokens in to_subscribe.values() for t in tokens)
+                if new_tokens:
+                    ticker.subscribe(new_tokens)
+                    self.frames_sent += 1
+                    subscribed = new_tokens
+                for mode in MODES_CHEAPEST_FIRST:
+                    tokens = sorted(to_subscribe.get(mode, []) + to_change.get(mode, []))
+                    if tokens:
+                        ticker.set_mode(mode, tokens)
+                        self.frames_sent += 1
+                        self.sent.update(dict.fromkeys(tokens, mode))
+            except Exception as e_subscribe:
+                metrics.error("subscribe", e_subscribe)
+                print(f"[{dt_now_str_fn()}] Subscriptions: websocket update failed, will retry next cycle: {e_subscribe}")
+                return [], []
+            self.dirty = False
+            return subscribed, to_unsubscribe
+
+    def resubscribe(self, ticker):
+        # A new websocket session starts empty, so forget what was sent and replay the full set.
+        with self._lock:
+            self.sent.clear()
+            self.dirty = True
+            self.resubscribes += 1
+            return self.flush(ticker)
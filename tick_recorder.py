@@ -0,0 +1,355 @@
+import datetime
+import glob
+import mmap
+import os
+import struct
+import threading
+import time
+from array import array
+from collections import deque
+
+TICK_DATA_DIR = "tick_data" # One <YYYY-MM-DD>.ticks file per trading day
+TICK_FILE_SUFFIX = ".ticks"
+RECORDER_FLUSH_SECONDS = 1.0 # Pending ticks are written as one columnar block at least this often
+RECORDER_BLOCK_MAX_ROWS = 50000
+RECORDER_MAX_PENDING_BATCHES = 20000 # Beyond this the websocket thread drops batches instead of waiting on the disk
+DEPTH_LEVELS = 5
+MODES = ("ltp", "quote", "full")
+_NAN = float("nan")
+
+# File layout: a sequence of blocks. Each block is BLOCK_HEADER followed by three column
+# groups back to back (each column padded to 8 bytes): BASE_COLUMNS for every tick,
+# QUOTE_COLUMNS for quote and full ticks, FULL_COLUMNS for full ticks only. A reader
+# casts slices of the mmap straight into typed arrays, and LTP-mode ticks cost 21 bytes.
+BLOCK_MAGIC = b"TKB2"
+BLOCK_HEADER = struct.Struct("<4sIIII") # magic, rows, quote rows, full rows, payload bytes
+BASE_COLUMNS = [("received_at", "d"), ("instrument_token", "I"), ("mode", "B"), ("last_price", "d")]
+QUOTE_COLUMNS = [
+    ("last_traded_quantity", "q"), ("average_traded_price", "d"), ("volume_traded", "q"),
+    ("total_buy_quantity", "q"), ("total_sell_quantity", "q"),
+    ("open", "d"), ("high", "d"), ("low", "d"), ("close", "d"), ("change", "d"),
+]
+FULL_COLUMNS = [
+    ("last_trade_time", "d"), ("exchange_timestamp", "d"), ("oi", "q"), ("oi_day_high", "q"), ("oi_day_low", "q"),
+] + [(f"{side}_{field}_{level}", code) for side in ("buy", "sell") for level in range(DEPTH_LEVELS)
+     for field, code in (("price", "d"), ("quantity", "I"), ("orders", "H"))]
+COLUMN_GROUPS = (BASE_COLUMNS, QUOTE_COLUMNS, FULL_COLUMNS)
+_QUOTE_INT_FIELDS = ("last_traded_quantity", "volume_traded", "total_buy_quantity", "total_sell_quantity")
+_OHLC_FIELDS = ("open", "high", "low", "close")
+_FULL_INT_FIELDS = ("oi", "oi_day_high", "oi_day_low")
+
+def dt_now_str_fn():
+    return datetime.datetime.now().strftime("%H:%M:%S.%f")[:-3]
+
+def tick_file_path(data_dir, day):
+    return os.path.join(data_dir, f"{day.isoformat()}{TICK_FILE_SUFFIX}")
+
+def _epoch(value):
+    if value is None or value == "":
+        return _NAN
+    if isinstance(value, (int, float)):
+        return float(value)
+    try:
+        return value.timestamp()
+    except Exception:
+        return _NAN
+
+def _padded(nbytes):
+    return (nbytes + 7) & ~7
+
+class _ColumnBuffer:
+    def __init__(self):
+        self.columns = {name: array(code) for group in COLUMN_GROUPS for name, code in group}
+        self.rows = self.quote_rows = self.full_rows = 0
+
+    def append(self, tick, received_at):
+        cols = self.columns
+        mode = MODES.index(tick.get("mode")) if tick.get("mode") in MODES else 0
+        cols["received_at"].append(received_at)
+        cols["instrument_token"].append(tick.get("instrument_token", 0) & 0xFFFFFFFF)
+        cols["mode"].append(mode)
+        cols["last_price"].append(tick.get("last_price", _NAN))
+        self.rows += 1
+        if mode == 0:
+            return
+        for field in _QUOTE_INT_FIELDS:
+            cols[field].append(int(tick.get(field) or 0))
+        cols["average_traded_price"].append(tick.get("average_traded_price", _NAN))
+        ohlc = tick.get("ohlc") or {}
+        for field in _OHLC_FIELDS:
+            cols[field].append(ohlc.get(field, _NAN))
+        cols["change"].append(tick.get("change", _NAN))
+        self.quote_rows += 1
+        if mode == 1:
+            return
+        cols["last_trade_time"].append(_epoch(tick.get("last_trade_time")))
+        cols["exchange_timestamp"].append(_epoch(tick.get("exchange_timestamp")))
+        for field in _FULL_INT_FIELDS:
+            cols[field].append(int(tick.get(field) or 0))
+        depth = tick.get("depth") or {}
+        for side in ("buy", "sell"):
+            levels = depth.get(side) or []
+            for level in range(DEPTH_LEVELS):
+                entry = levels[level] if level < len(levels) else {}
+                cols[f"{side}_price_{level}"].append(entry.get("price", _NAN))
+                cols[f"{side}_quantity_{level}"].append(min(int(entry.get("quantity") or 0), 0xFFFFFFFF))
+                cols[f"{side}_orders_{level}"].append(min(int(entry.get("orders") or 0), 0xFFFF))
+        self.full_rows += 1
+
+    def to_block(self):
+        parts = []
+        for group in COLUMN_GROUPS:
+            for name, _ in group:
+                raw = self.columns[name].tobytes()
+                parts.append(raw + b"\0" * (_padded(len(raw)) - len(raw)))
+        payload = b"".join(parts)
+        return BLOCK_HEADER.pack(BLOCK_MAGIC, self.rows, self.quote_rows, self.full_rows, len(payload)) + payload
+
+class TickRecorder:
+    # record() only appends a reference to the batch to a deque (no lock, no copy), so the
+    # websocket thread never waits on disk. A writer thread converts batches to columns and appends one block per flush to
+    # the day's file.
+    def __init__(self, data_dir=TICK_DATA_DIR, flush_seconds=RECORDER_FLUSH_SECONDS, max_pending=RECORDER_MAX_PENDING_BATCHES):
+        self.data_dir = data_dir
+        self.flush_seconds = flush_seconds
+        self.max_pending = max_pending
+        self._pending = deque()
+        self._stop = threading.Event()
+        self._thread = None
+        self.ticks_recorded = 0
+        self.batches_dropped = 0
+        self.blocks_written = 0
+
+    def record(self, ticks, received_at=None):
+        if len(self._pending) >= self.max_pending:
+            self.batches_dropped += 1
+            return
+        self._pending.append((received_at if received_at is not None else time.time(), ticks))
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return self
+        os.makedirs(self.data_dir, exist_ok=True)
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="tick-recorder", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self, timeout=5.0):
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout)
+
+    def _write_block(self, day, buffer):
+        if not buffer.rows:
+            return
+        try:
+            with open(tick_file_path(self.data_dir, day), "ab") as f:
+                f.write(buffer.to_block())
+            self.blocks_written += 1
+            self.ticks_recorded += buffer.rows
+        except OSError as e:
+            print(f"[{dt_now_str_fn()}] Tick recorder: write failed, {buffer.rows} ticks lost: {e}")
+
+    def _run(self):
+        buffer, day = _ColumnBuffer(), None
+        last_flush = time.monotonic()
+        while True:
+            try:
+                received_at, ticks = self._pending.popleft()
+            except IndexError:
+                received_at, ticks = None, None
+                self._stop.wait(min(self.flush_seconds, 0.05))
+            if ticks:
+                tick_day = datetime.date.fromtimestamp(received_at)
+                if day is not None and tick_day != day:
+                    self._write_block(day, buffer)
+                    buffer = _ColumnBuffer()
+                day = tick_day
+                for tick in ticks:
+                    buffer.append(tick, received_at)
+            stopping = self._stop.is_set() and not self._pending
+            if buffer.rows and (stopping or buffer.rows >= RECORDER_BLOCK_MAX_ROWS or time.monotonic() - last_flush >= self.flush_seconds):
+                self._write_block(day, buffer)
+                buffer = _ColumnBuffer()
+                last_flush = time.monotonic()
+            if stopping:
+                return
+
+class TickFile:
+    # Read-only, memory-mapped view of one recorded day. Columns of each block are typed
+    # memoryviews over the mapping; nothing is copied until a tick dict is built.
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, "rb")
+        size = os.fstat(self._file.fileno()).st_size
+        self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) if size else None
+        self.blocks = self._index_blocks(size)
+
+    def _index_blocks(self, size):
+        blocks, offset = [], 0
+        while self._mmap is not None and offset + BLOCK_HEADER.size <= size:
+            magic, rows, quote_rows, full_rows, payload_bytes = BLOCK_HEADER.unpack_from(self._mmap, offset)
+            start = offset + BLOCK_HEADER.size
+            if magic != BLOCK_MAGIC or start + payload_bytes > size:
+                break # torn trailing block from a crash; everything before it is intact
+            blocks.append((start, (rows, quote_rows, full_rows)))
+            offset = start + payload_bytes
+        return blocks
+
+    def __len__(self):
+        return sum(counts[0] for _, counts in self.blocks)
+
+    def columns(self, block_index):
+        start, counts = self.blocks[block_index]
+        view = memoryview(self._mmap)
+        cols, offset = {}, start
+        for group, rows in zip(COLUMN_GROUPS, counts):
+            for name, code in group:
+                nbytes = rows * array(code).itemsize
+                cols[name] = view[offset:offset + nbytes].cast(code)
+                offset += _padded(nbytes)
+        return cols, counts[0]
+
+    def batches(self):
+        # Yields (received_at, [tick, ...]) in recorded order; one batch per original on_ticks call.
+        for block_index in range(len(self.blocks)):
+            cols, rows = self.columns(block_index)
+            received, modes = cols["received_at"], cols["mode"]
+            batch, batch_ts = [], None
+            quote_row = full_row = 0
+            for i in range(rows):
+                if batch and received[i] != batch_ts:
+                    yield batch_ts, batch
+                    batch = []
+                batch_ts = received[i]
+                batch.append(_tick_from_columns(cols, i, modes[i], quote_row, full_row))
+                quote_row += modes[i] >= 1
+                full_row += modes[i] == 2
+            if batch:
+                yield batch_ts, batch
+            del cols, received, modes
+
+    def close(self):
+        if self._mmap is not None:
+            try:
+                self._mmap.close()
+            except BufferError:
+                pass
+        self._file.close()
+
+def _value(v):
+    return None if v != v else v
+
+def _tick_from_columns(cols, i, mode_code, q, f):
+    mode = MODES[mode_code] if mode_code < len(MODES) else "ltp"
+    tick = {"tradable": True, "mode": mode, "instrument_token": cols["instrument_token"][i], "last_price": cols["last_price"][i]}
+    if mode == "ltp":
+        return tick
+    for field in _QUOTE_INT_FIELDS:
+        tick[field] = cols[field][q]
+    tick["average_traded_price"] = _value(cols["average_traded_price"][q])
+    tick["ohlc"] = {field: _value(cols[field][q]) for field in _OHLC_FIELDS}
+    tick["change"] = _value(cols["change"][q])
+    if mode == "full":
+        for field in ("last_trade_time", "exchange_timestamp"):
+            ts = cols[field][f]
+            tick[field] = datetime.datetime.fromtimestamp(ts) if ts == ts else None
+        for field in _FULL_INT_FIELDS:
+            tick[field] = cols[field][f]
+        tick["depth"] = {side: [{"price": cols[f"{side}_price_{level}"][f], "quantity": cols[f"{side}_quantity_{level}"][f],
+                                 "orders": cols[f"{side}_orders_{level}"][f]} for level in range(DEPTH_LEVELS)]
+                         for side in ("buy", "sell")}
+    return tick
+
+def recorded_days(data_dir=TICK_DATA_DIR):
+    return sorted(glob.glob(os.path.join(data_dir, f"*{TICK_FILE_SUFFIX}")))
+
+class TickReplayer:
+    # Stands in for KiteTicker: same callbacks and subscribe/set_mode surface, but ticks come
+    # from recorded files. speed=1 keeps the original pacing, 10 is ten times faster and
+    # None (or 0) replays as fast as the callbacks allow.
+    MODE_LTP, MODE_QUOTE, MODE_FULL = "ltp", "quote", "full"
+
+    def __init__(self, paths, speed=1.0, only_subscribed=False):
+        self.paths = [paths] if isinstance(paths, str) else list(paths)
+        self.speed = speed or None
+        self.only_subscribed = only_subscribed
+        self.on_ticks = self.on_connect = self.on_close = self.on_error = self.on_order_update = None
+        self.subscribed_tokens = {}
+        self.ticks_replayed = 0
+        self.finished = threading.Event()
+        self._connected = False
+        self._stop = threading.Event()
+        self._thread = None
+
+    def subscribe(self, instrument_tokens):
+        for token in instrument_tokens:
+            self.subscribed_tokens.setdefault(token, self.MODE_QUOTE)
+        return True
+
+    def unsubscribe(self, instrument_tokens):
+        for token in instrument_tokens:
+            self.subscribed_tokens.pop(token, None)
+        return True
+
+    def set_mode(self, mode, instrument_tokens):
+        for token in instrument_tokens:
+            self.subscribed_tokens[token] = mode
+        return True
+
+    def is_connected(self):
+        return self._connected
+
+    def _run(self):
+        first_recorded, started = None, time.monotonic()
+        try:
+            for path in self.paths:
+                tick_file = TickFile(path)
+                try:
+                    for received_at, ticks in tick_file.batches():
+                        if self._stop.is_set():
+                            return
+                        if self.speed:
+                            first_recorded = received_at if first_recorded is None else first_recorded
+                            delay = (received_at - first_recorded) / self.speed - (time.monotonic() - started)
+                            if delay > 0 and self._stop.wait(delay):
+                                return
+                        if self.only_subscribed:
+                            ticks = [t for t in ticks if t["instrument_token"] in self.subscribed_tokens]
+                        if ticks and self.on_ticks:
+                            self.on_ticks(self, ticks)
+                            self.ticks_replayed += len(ticks)
+                finally:
+                    tick_file.close()
+        except Exception as e:
+            if self.on_error:
+                self.on_error(self, 0, str(e))
+        finally:
+            self.finished.set()
+            self._connected = False
+            if self.on_close and not self._stop.is_set():
+                self.on_close(self, 1000, "replay finished")
+
+    def connect(self, threaded=False, disable_ssl_verification=False, proxy=None):
+        self._stop.clear()
+        self.finished.clear()
+        self._connected = True
+        if self.on_connect:
+            self.on_connect(self, {})
+        self._thread = threading.Thread(target=self._run, name="tick-replayer", daemon=True)
+        self._thread.start()
+        if not threaded:
+            self._thread.join()
+
+    def stop_retry(self):
+        pass
+
+    def close(self, code=None, reason=None):
+        self._stop.set()
+        self._connected = False
+        if self.on_close:
+            self.on_close(self, code, reason)
+
+    def stop(self):
+        self.close()
@@ -0,0 +1,193 @@
+import math
+import threading
+import time
+from array import array
+
+TICK_STORE_INITIAL_CAPACITY = 4096
+TICK_FIELDS = (
+    "last_price", "open", "high", "low", "close", "volume", "average_price",
+    "buy_price", "sell_price", "oi", "exchange_timestamp", "received_at",
+)
+_NAN = float("nan")
+
+def _epoch(value):
+    if value is None or value == "":
+        return _NAN
+    if isinstance(value, (int, float)):
+        return float(value)
+    try:
+        return value.timestamp()
+    except Exception:
+        return _NAN
+
+class TickStore:
+    # One preallocated float column per field, indexed by a slot per instrument token.
+    # Every update bumps a global version and stamps it on the slot, so consumers can ask
+    # for "tokens changed since version N" and copy only the rows they render.
+    def __init__(self, capacity=TICK_STORE_INITIAL_CAPACITY):
+        self.capacity = capacity
+        self.columns = {field: array("d", [_NAN]) * capacity for field in TICK_FIELDS}
+        self.slot_versions = array("Q", [0]) * capacity
+        self.slot_tokens = array("q", [0]) * capacity
+        self.token_to_slot = {}
+        self._recent_slots = {} # slot -> version, kept in update order so changed_since stops early
+        self.version = 0
+        self.ticks_applied = 0
+        self.last_update_at = 0.0
+        self._lock = threading.Lock()
+
+    def _grow(self):
+        extra = self.capacity
+        for field in TICK_FIELDS:
+            self.columns[field].extend(array("d", [_NAN]) * extra)
+        self.slot_versions.extend(array("Q", [0]) * extra)
+        self.slot_tokens.extend(array("q", [0]) * extra)
+        self.capacity += extra
+
+    def _slot_for(self, token):
+        slot = self.token_to_slot.get(token)
+        if slot is None:
+            slot = len(self.token_to_slot)
+            if slot >= self.capacity:
+                self._grow()
+            self.token_to_slot[token] = slot
+            self.slot_tokens[slot] = token
+        return slot
+
+    def update(self, ticks, received_at=None):
+        received_at = received_at if received_at is not None else time.time()
+        cols = self.columns
+        ltp, opn, high, low, close = cols["last_price"], cols["open"], cols["high"], cols["low"], cols["close"]
+        with self._lock:
+            for t in ticks:
+                slot = self._slot_for(t["instrument_token"])
+                if "last_price" in t: ltp[slot] = t["last_price"]
+                ohlc = t.get("ohlc")
+                if ohlc:
+                    opn[slot] = ohlc.get("open", _NAN); high[slot] = ohlc.get("high", _NAN)
+                    low[slot] = ohlc.get("low", _NAN); close[slot] = ohlc.get("close", _NAN)
+                if "volume_traded" in t: cols["volume"][slot] = t["volume_traded"]
+                if "average_traded_price" in t: cols["average_price"][slot] = t["average_traded_price"]
+                if "oi" in t: cols["oi"][slot] = t["oi"]
+                depth = t.get("depth")
+                if depth:
+                    buy, sell = depth.get("buy"), depth.get("sell")
+                    cols["buy_price"][slot] = buy[0].get("price", _NAN) if buy else _NAN
+                    cols["sell_price"][slot] = sell[0].get("price", _NAN) if sell else _NAN
+                if "exchange_timestamp" in t: cols["exchange_timestamp"][slot] = _epoch(t["exchange_timestamp"])
+                cols["received_at"][slot] = received_at
+                self.version += 1
+                self.slot_versions[slot] = self.version
+                recent = self._recent_slots
+                recent.pop(slot, None)
+                recent[slot] = self.version
+            self.ticks_applied += len(ticks)
+            self.last_update_at = received_at
+
+    def __len__(self):
+        return len(self.token_to_slot)
+
+    def changed_since(self, version):
+        with self._lock:
+            current = self.version
+            if version >= current:
+                return [], current
+            tokens = self.slot_tokens
+            changed = []
+            for slot in reversed(self._recent_slots):
+                if self._recent_slots[slot] <= version:
+                    break
+                changed.append(tokens[slot])
+        return changed, current
+
+    def _row(self, slot):
+        cols = self.columns
+        def val(field):
+            v = cols[field][slot]
+            return "" if math.isnan(v) else v
+        quote = {
+            "instrument_token": self.slot_tokens[slot],
+            "last_price": val("last_price"),
+            "ohlc": {"open": val("open"), "high": val("high"), "low": val("low"), "close": val("close")},
+            "volume": val("volume"),
+            "average_price": val("average_price"),
+            "oi": val("oi"),
+            "exchange_timestamp": val("exchange_timestamp"),
+            "received_at": val("received_at"),
+            "version": self.slot_versions[slot],
+        }
+        buy_price, sell_price = val("buy_price"), val("sell_price")
+        if buy_price != "" or sell_price != "":
+            quote["depth"] = {"buy": [{"price": buy_price}], "sell": [{"price": sell_price}]}
+        return quote
+
+    def get(self, token):
+        with self._lock:
+            slot = self.token_to_slot.get(token)
+            return self._row(slot) if slot is not None else None
+
+    def token_version(self, token):
+        # Store version of the token's latest tick, 0 if it never ticked.
+        slot = self.token_to_slot.get(token)
+        return self.slot_versions[slot] if slot is not None else 0
+
+    def get_field(self, token, field):
+        slot = self.token_to_slot.get(token)
+        if slot is None:
+            return None
+        v = self.columns[field][slot]
+        return None if math.isnan(v) else v
+
+    def field_values(self, tokens, field="last_price"):
+        # One field for many tokens as a flat float array (NaN where unknown), for vectorized consumers.
+        col = self.columns[field]
+        slots = self.token_to_slot
+        with self._lock:
+            return array("d", [col[slots[t]] if t in slots else _NAN for t in tokens])
+
+    def snapshot(self, tokens):
+        # Consistent copy of just the requested tokens, taken under a single short lock.
+        with self._lock:
+            out = {}
+            for token in tokens:
+                slot = self.token_to_slot.get(token)
+                if slot is not None:
+                    out[token] = self._row(slot)
+            return out
+
+    def snapshot_symbols(self, symbols, symbol_to_token):
+        tokens_by_symbol = {}
+        for symbol_str in symbols:
+            token = symbol_to_token(symbol_str)
+            if token is not None:
+                tokens_by_symbol[symbol_str] = token
+        rows = self.snapshot(tokens_by_symbol.values())
+        return {symbol_str: rows[token] for symbol_str, token in tokens_by_symbol.items() if token in rows}
+
+    def symbol_view(self, symbol_to_token):
+        return TickStoreView(self, symbol_to_token)
+
+class TickStoreView:
+    # Read-only, dict-like view keyed by "EXCH:SYMBOL" so the update_* functions can keep
+    # using quotes.get(symbol) without the whole store being copied each cycle.
+    def __init__(self, store, symbol_to_token):
+        self.store = store
+        self.symbol_to_token = symbol_to_token
+
+    def get(self, symbol_str, default=None):
+        token = self.symbol_to_token(symbol_str)
+        row = self.store.get(token) if token is not None else None
+        return row if row is not None else default
+
+    def __contains__(self, symbol_str):
+        token = self.symbol_to_token(symbol_str)
+        return token is not None and token in self.store.token_to_slot
+
+    def __getitem__(self, symbol_str):
+        row = self.get(symbol_str)
+        if row is None:
+            raise KeyError(symbol_str)
+        return row
+
+    def __bool__(self):
+        return len(self.store) > 0
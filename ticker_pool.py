@@ -0,0 +1,165 @@
+import datetime
+import threading
+import time
+from metrics import metrics
+
+TICKER_MAX_CONNECTIONS = 3 # Kite allows three websocket connections per API key
+TICKER_MAX_TOKENS_PER_CONNECTION = 3000 # Kite's instrument limit per websocket connection
+MODE_LOAD_WEIGHTS = {"ltp": 8, "quote": 44, "full": 184} # Packet bytes per tick in each mode, used to balance connections
+TICK_RATE_WINDOW_SECONDS = 5
+
+def dt_now_str_fn():
+    return datetime.datetime.now().strftime("%H:%M:%S.%f")[:-3]
+
+class TickerPool:
+    # Spreads tokens over several KiteTicker connections behind the single-ticker interface
+    # (subscribe/unsubscribe/set_mode/connect/close and the on_* callbacks), so the rest of the
+    # code does not know it is sharded. A token stays on the connection it was first given; new
+    # tokens go to the connection with the least mode-weighted load. Each connection remembers
+    # its own tokens and modes and replays them when it reconnects, and calls for tokens that
+    # are already in the requested state are dropped instead of sent.
+    MODE_LTP, MODE_QUOTE, MODE_FULL = "ltp", "quote", "full"
+
+    def __init__(self, ticker_factory, connections=TICKER_MAX_CONNECTIONS, max_tokens_per_connection=TICKER_MAX_TOKENS_PER_CONNECTION):
+        self.tickers = [ticker_factory(i) for i in range(connections)]
+        self.max_tokens_per_connection = max_tokens_per_connection
+        self.assignments = {} # token -> connection index
+        self.modes = [{} for _ in self.tickers] # per connection: token -> mode
+        self.loads = [0] * len(self.tickers)
+        self.tick_counts = [0] * len(self.tickers)
+        self._rate_marks = [(time.monotonic(), 0, 0.0) for _ in self.tickers] # (time, tick count, ticks/s)
+        self.on_ticks = self.on_connect = self.on_close = self.on_error = self.on_order_update = None
+        self._closed = threading.Event()
+        self._lock = threading.RLock()
+        for i, ticker in enumerate(self.tickers):
+            ticker.on_ticks = lambda ws, ticks, i=i: self._on_ticks(i, ticks)
+            ticker.on_connect = lambda ws, response, i=i: self._on_connect(i, response)
+            ticker.on_close = lambda ws, code, reason, i=i: self._forward(self.on_close, code, f"connection {i}: {reason}")
+            ticker.on_error = lambda ws, code, reason, i=i: self._forward(self.on_error, code, f"connection {i}: {reason}")
+            # Order updates arrive on every connection; only the first one forwards them.
+            ticker.on_order_update = (lambda ws, data: self._forward(self.on_order_update, data)) if i == 0 else None
+
+    def _forward(self, callback, *args):
+        if callback:
+            callback(self, *args)
+
+    def _on_ticks(self, i, ticks):
+        self.tick_counts[i] += len(ticks)
+        metrics.inc("ticks", len(ticks), connection=str(i))
+        if self.on_ticks:
+            self.on_ticks(self, ticks)
+
+    def _on_connect(self, i, response):
+        # A fresh socket has no subscriptions; replay this connection's share before telling the app.
+        ticker = self.tickers[i]
+        with self._lock:
+            by_mode = {}
+            for token, mode in self.modes[i].items():
+                by_mode.setdefault(mode, []).append(token)
+            try:
+                if by_mode:
+                    ticker.subscribe(sorted(self.modes[i]))
+                    for mode, tokens in by_mode.items():
+                        ticker.set_mode(mode, sorted(tokens))
+            except Exception as e_replay:
+                metrics.error("ticker_replay", e_replay)
+                print(f"[{dt_now_str_fn()}] Ticker connection {i}: could not replay {len(self.modes[i])} tokens: {e_replay}")
+        print(f"[{dt_now_str_fn()}] Ticker connection {i} up with {len(self.modes[i])} tokens")
+        self._forward(self.on_connect, response)
+
+    def _pick_connection(self):
+        candidates = [i for i in range(len(self.tickers)) if len(self.modes[i]) < self.max_tokens_per_connection]
+        return min(candidates, key=lambda i: (self.loads[i], len(self.modes[i]))) if candidates else None
+
+    def _send(self, per_connection, method, *args):
+        for i, tokens in per_connection.items():
+            ticker = self.tickers[i]
+            if tokens and ticker.is_connected():
+                getattr(ticker, method)(*args, sorted(tokens))
+
+    def subscribe(self, instrument_tokens):
+        # New tokens start in QUOTE like KiteTicker.subscribe; set_mode moves them and their load.
+        per_connection = {}
+        with self._lock:
+            for token in instrument_tokens:
+                if token in self.assignments:
+                    continue
+                i = self._pick_connection()
+                if i is None:
+                    metrics.error("ticker_capacity")
+                    print(f"[{dt_now_str_fn()}] Ticker pool full ({len(self.assignments)} tokens); {token} not subscribed")
+                    continue
+                self.assignments[token] = i
+                self.modes[i][token] = self.MODE_QUOTE
+                self.loads[i] += MODE_LOAD_WEIGHTS[self.MODE_QUOTE]
+                per_connection.setdefault(i, []).append(token)
+            self._send(per_connection, "subscribe")
+        return True
+
+    def unsubscribe(self, instrument_tokens):
+        per_connection = {}
+        with self._lock:
+            for token in instrument_tokens:
+                i = self.assignments.pop(token, None)
+                if i is None:
+                    continue
+                self.loads[i] -= MODE_LOAD_WEIGHTS[self.modes[i].pop(token)]
+                per_connection.setdefault(i, []).append(token)
+            self._send(per_connection, "unsubscribe")
+        return True
+
+    def set_mode(self, mode, instrument_tokens):
+        per_connection = {}
+        with self._lock:
+            for token in instrument_tokens:
+                i = self.assignments.get(token)
+                if i is None or self.modes[i][token] == mode:
+                    continue
+                self.loads[i] += MODE_LOAD_WEIGHTS[mode] - MODE_LOAD_WEIGHTS[self.modes[i][token]]
+                self.modes[i][token] = mode
+                per_connection.setdefault(i, []).append(token)
+            self._send(per_connection, "set_mode", mode)
+        return True
+
+    def tokens(self):
+        # Every token currently subscribed on some connection.
+        with self._lock:
+            return list(self.assignments)
+
+    def is_connected(self):
+        return any(ticker.is_connected() for ticker in self.tickers)
+
+    def connect(self, threaded=False, disable_ssl_verification=False, proxy=None):
+        self._closed.clear()
+        for ticker in self.tickers:
+            ticker.connect(threaded=True, disable_ssl_verification=disable_ssl_verification, proxy=proxy)
+        if not threaded:
+            self._closed.wait()
+
+    def connection_stats(self):
+        # Per-connection token counts, mode-weighted load and tick rate over the last few seconds.
+        now = time.monotonic()
+        stats = []
+        for i, ticker in enumerate(self.tickers):
+            marked_at, marked_count, rate = self._rate_marks[i]
+            if now - marked_at >= TICK_RATE_WINDOW_SECONDS:
+                rate = (self.tick_counts[i] - marked_count) / (now - marked_at)
+                self._rate_marks[i] = (now, self.tick_counts[i], rate)
+            stats.append({"connection": i, "connected": ticker.is_connected(), "tokens": len(self.modes[i]),
+                          "load": self.loads[i], "ticks": self.tick_counts[i], "ticks_per_second": round(rate, 1)})
+        return stats
+
+    def stop_retry(self):
+        for ticker in self.tickers:
+            ticker.stop_retry()
+
+    def close(self, code=None, reason=None):
+        self._closed.set()
+        for ticker in self.tickers:
+            if ticker.is_connected():
+                ticker.close(code, reason)
+
+    def stop(self):
+        # KiteTicker.stop() stops the shared Twisted reactor, so one call covers every connection.
+        self.close()
+        self.tickers[0].stop()
@@ -1,303 +1,920 @@
+import argparse
+import functools
+import math
+import os
 import threading
 import queue
 import datetime
 import time
 import traceback
 import xlwings as xw
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify
 from kiteconnect import KiteConnect, KiteTicker
 from kiteconnect.exceptions import KiteException 
+from waitress import serve
 
 # Import your functions from the functions module
 # Ensure you have a functions.py file with the required functions defined
 from functions import (
     update_input_sheet, update_portfolio_sheet, update_holdings_sheet,
     update_orders_sheet, process_order_modifications, update_settings_sheet,
-    fetch_holdings, autofill_input_sheet_with_portfolio_holdings, process_input_sheet_orders,
-    set_input_sheet_defaults, should_clear_today
+    autofill_input_sheet_with_portfolio_holdings, process_input_sheet_orders,
+    set_input_sheet_defaults, should_clear_today, get_default_lot_size, render_input_order_statuses, prefetch_quote_fallbacks, get_price_fields_with_fallback,
+    read_input_snapshot, MAX_INPUT_ROWS
 )
+from quote_cache import rest_quote_cache
+from sheet_writer import sheet_writer
+from instruments import InstrumentIndex, INSTRUMENT_CACHE_DIR
+from rest_scheduler import RestSnapshot
+from tick_store import TickStore
+from order_dispatcher import OrderDispatcher
+from order_book import OrderBook
+from metrics import metrics
+from option_chain import OptionChain, OPTION_CHAIN_SHEET, read_option_chain_settings, update_option_chain_sheet
+from greeks import GreeksEngine, update_input_greeks, update_net_greeks
+from pnl import PnlEngine
+from risk import RiskEngine
+from gap_fill import GapFiller
+from tick_recorder import TickRecorder, TickReplayer, TICK_DATA_DIR
+from subscriptions import SubscriptionManager, MODE_LTP, MODE_QUOTE, MODES_CHEAPEST_FIRST
+from ticker_pool import TickerPool
+from render_scheduler import RenderScheduler
+from candles import CandleStore, CANDLES_SHEET, read_candle_settings, update_candles_sheet
+from shared_ticks import create_tick_table, SharedTickView
+from rest_transport import install_transport, transport_stats
+from engine import start_engine_process, build_rest_scheduler, kite_clients, RemoteProxy, RemoteTicker
+from quote_stream import QuoteStreamHub, compact_quote, sse_frame, STREAM_CHANNELS, STREAM_DEFAULT_MAX_RATE, STREAM_MAX_CLIENTS, STREAM_MAX_SYMBOLS_PER_CLIENT
 
 API_KEY = "xxxxx" # Replace with your actual API key 
 ACCESS_TOKEN_FILE = "access_token.txt" # Replace with your actual access token file path
 EXCEL_FILE = "options_live.xlsm" # Replace with your actual Excel file path
 PREFETCH_EXCHANGES = ["NSE", "NFO", "BSE", "BFO", "MCX"] # Exchanges to prefetch instruments from
-GENERAL_UPDATE_INTERVAL_SECONDS = 2 # Interval for general updates to sheets
+GENERAL_UPDATE_INTERVAL_SECONDS = 2 # Shortest interval for general updates to sheets; stretched up to GENERAL_MAX_UPDATE_INTERVAL_SECONDS when Excel is slow
+GENERAL_MAX_UPDATE_INTERVAL_SECONDS = 5 # Also bounds how long an order typed on INPUT waits to be sent
+REFRESH_BATCH_MAX_ROWS = 500 # Max /refresh_symbol requests merged into one batch per loop iteration
+TICKER_CONNECTIONS = 3 # KiteTicker websocket connections; tokens are spread across them by mode-weighted load
+ENGINE_PROCESS = True # Run ticker, REST scheduler and order submission in a separate engine process so Excel stalls cannot delay them
+RECORD_TICKS = True # Append every raw tick to tick_data/<date>.ticks (about 170 bytes per FULL tick) for offline replay
+GREEKS_UPDATE_INTERVAL_SECONDS = 0.5 # IV/Greeks recompute cadence for INPUT columns Z:AD
+CANDLE_RENDER_INTERVAL_SECONDS = 1 # Candles sheet redraw cadence; bars themselves update on every tick
+INPUT_MIN_RENDER_INTERVAL_SECONDS = 0.05 # INPUT redraws at most 20 times a second, fewer when frames are slow
+INPUT_FRAME_BUDGET_SECONDS = 1.0 # An INPUT frame that would take longer draws only the most recently ticked rows
+INPUT_MAX_ROW_LAG_SECONDS = 3 # A row left stale this long is drawn ahead of fresher ones
+INPUT_STALE_TICK_SECONDS = 30 # A row whose last tick (or gap-fill quote) is older than this shows STALE in column R
+INPUT_STALE_SWEEP_SECONDS = 1 # How often INPUT rows are checked for crossing the stale threshold
+MAIN_LOOP_MIN_IDLE_SECONDS = 0.005 # Shortest sleep between loop passes, so an idle loop does not spin
+MAIN_LOOP_MAX_IDLE_SECONDS = 0.05 # Longest the loop sleeps waiting for the next due frame or a /refresh_symbol
+WEBHOOK_HOST, WEBHOOK_PORT = "127.0.0.1", 5000
+WEBHOOK_THREADS = 8 # Waitress worker threads; the routes only enqueue, so a few are plenty
+REFRESH_QUEUE_MAX_ITEMS = 5000 # /refresh_symbol(s) answer 503 "busy" once this many row refreshes are waiting
+BUSY_RETRY_AFTER_SECONDS = 1
+HEALTH_MAX_LOOP_AGE_SECONDS = 10 # /health reports "degraded" when the main loop has not finished an iteration for this long
+REST_POLL_INTERVALS_SECONDS = {"positions": 30, "orders": 30, "holdings": 60, "margins": 60} # Per-endpoint REST refresh intervals; orders is only a reconcile for the websocket order stream, and P&L moves with ticks between positions/holdings polls (fills and placed orders trigger an immediate positions/margins refresh)
 config_file = "last_clear_date.txt" # Replace with your actual config file path
 app = Flask(__name__)
-refresh_queue = queue.Queue() 
+refresh_queue = queue.Queue(maxsize=REFRESH_QUEUE_MAX_ITEMS)
+refresh_queued = threading.Event() # wakes the main loop early when VBA sends a refresh
+last_loop_iteration_at = 0.0
 order_id_map = {}
+pending_orders = {} # INPUT rows dispatched whose outcome is not known yet, see process_input_sheet_orders
 
-kite, wb, inp, port, hold, ords, sett, kws = (None,) * 8
-live_ticks, all_instruments_cache, symbol_to_token_map, token_to_symbol_map = {}, {}, {}, {}
-subscribed_tokens, previous_symbol_in_row = set(), {}
-live_ticks_lock = threading.Lock()
+kite, wb, inp, port, hold, ords, sett, chain_sheet, candles_sheet, kws = (None,) * 10
+symbol_to_token_map, token_to_symbol_map = {}, {}
+tick_store = TickStore()
+instrument_index = InstrumentIndex(INSTRUMENT_CACHE_DIR)
+rest_snapshot = RestSnapshot()
+rest_scheduler = None
+order_dispatcher = None
+order_book = OrderBook()
+option_chain = None
+greeks_engine = None
+pnl_engine = None
+pnl_cache = None # (key, PnlResult) for the tick/positions/holdings versions it was computed at
+pnl_lock = threading.Lock()
+gap_filler = None # REST snapshots after a reconnect; the engine process runs its own
+tick_recorder = None
+candle_store = CandleStore()
+engine_channel = None
+subscriptions = SubscriptionManager()
+previous_symbol_in_row = {}
 
 def dt_now_str(): 
     return datetime.datetime.now().strftime("%H:%M:%S.%f")[:-3]
 
+def live_token_for(symbol_str):
+    # INPUT symbols resolve through the row cache; Portfolio/Holdings symbols through the instrument index.
+    return symbol_to_token_map.get(symbol_str) or instrument_index.token_for(symbol_str)
+
+live_ticks = tick_store.symbol_view(live_token_for)
+
+def live_ltp(symbol_str):
+    token = live_token_for(symbol_str)
+    return tick_store.get_field(token, "last_price") if token is not None else None
+
+def risk_ltp(symbol_str):
+    # Live tick, else a REST fallback quote already in the cache; never a network call.
+    return live_ltp(symbol_str) or (rest_quote_cache.get(symbol_str) or {}).get("last_price")
+
+risk_engine = RiskEngine(risk_ltp, lambda symbol_str: instrument_index.instrument(symbol_str), get_default_lot_size, rest_snapshot)
+quote_hub = QuoteStreamHub(tick_store, lambda token: token_to_symbol_map.get(token) or instrument_index.symbol_for(token), rest_snapshot, order_book)
+
+def attach_tick_store(store):
+    # Swaps the store every reader uses, e.g. for the engine process's shared tick table.
+    global tick_store, live_ticks
+    tick_store = store
+    live_ticks = tick_store.symbol_view(live_token_for)
+    quote_hub.tick_store = store
+
 def get_instrument_token_from_cache(symbol_str):
-    global symbol_to_token_map, token_to_symbol_map, all_instruments_cache
+    global symbol_to_token_map, token_to_symbol_map, instrument_index
     if not symbol_str or ":" not in symbol_str: return None
     if symbol_str in symbol_to_token_map: return symbol_to_token_map[symbol_str]
     try:
-        exch, sym_only = symbol_str.split(":", 1)
-        if exch in all_instruments_cache:
-            for inst in all_instruments_cache[exch]:
-                if inst["tradingsymbol"] == sym_only:
-                    token = inst["instrument_token"]
-                    symbol_to_token_map[symbol_str] = token 
-                    token_to_symbol_map[token] = symbol_str   
-                    return token
+        token = instrument_index.token_for(symbol_str)
+        if token is not None:
+            symbol_to_token_map[symbol_str] = token 
+            token_to_symbol_map[token] = symbol_str   
+            return token
     except Exception as e:
-        pass
+        print(f"[{dt_now_str()}] Instrument lookup failed for {symbol_str}: {e}")
     return None
 
+def busy_response(**extra):
+    # The main loop is behind; VBA should back off and resend instead of the queue growing without bound.
+    metrics.inc("webhook_busy")
+    response = jsonify(status="busy", queue_depth=refresh_queue.qsize(), **extra)
+    response.headers["Retry-After"] = str(BUSY_RETRY_AFTER_SECONDS)
+    return response, 503
+
 @app.route("/refresh_symbol", methods=["POST"])
 def refresh_symbol_route(): 
-    data = request.json or {}; sym_vba = data.get("symbol", "").strip().upper(); row = data.get("row", 0)
-    if row < 2: return jsonify(status="err", msg="Bad row from VBA"), 400
-    refresh_queue.put((row, sym_vba)) 
-    print(f"[{dt_now_str()}] Flask: Queued row {row} (VBA: '{sym_vba}')")
+    data = request.get_json(silent=True) or {}; sym_vba = str(data.get("symbol") or "").strip().upper(); row = data.get("row", 0)
+    if not isinstance(row, int) or row < 2: return jsonify(status="err", msg="Bad row from VBA"), 400
+    try:
+        refresh_queue.put_nowait((row, sym_vba, time.monotonic()))
+    except queue.Full:
+        return busy_response()
+    refresh_queued.set()
     return jsonify(status="ok"), 200
 
+@app.route("/refresh_symbols", methods=["POST"])
+def refresh_symbols_route():
+    data = request.get_json(silent=True) or {}
+    rows = data.get("rows")
+    if rows is None:
+        start_row, end_row = data.get("start_row", 0), data.get("end_row", 0)
+        if not isinstance(start_row, int) or not isinstance(end_row, int) or start_row < 2 or end_row < start_row:
+            return jsonify(status="err", msg="Bad row range from VBA"), 400
+        rows = range(start_row, min(end_row, MAX_INPUT_ROWS + 1) + 1)
+    elif not isinstance(rows, list):
+        return jsonify(status="err", msg="rows must be a list"), 400
+    queued = 0
+    enqueued_at = time.monotonic()
+    for row in rows:
+        if isinstance(row, int) and 2 <= row <= MAX_INPUT_ROWS + 1:
+            try:
+                refresh_queue.put_nowait((row, "", enqueued_at))
+            except queue.Full:
+                print(f"[{dt_now_str()}] Webhook: refresh queue full after {queued} rows")
+                return busy_response(queued=queued)
+            queued += 1
+    refresh_queued.set()
+    print(f"[{dt_now_str()}] Flask: Queued {queued} rows for refresh")
+    return jsonify(status="ok", queued=queued), 200
+
+def requested_symbols(default=()):
+    raw = request.args.get("symbols")
+    if not raw:
+        return list(default)
+    return list(dict.fromkeys(s.strip().upper() for s in raw.split(",") if ":" in s))
+
+@app.route("/quotes", methods=["GET"])
+def quotes_route():
+    # Latest ticks from memory; defaults to every symbol on INPUT. Symbols nobody subscribes come back null.
+    # list() copies the row map in one step; the main loop may be changing it on its own thread.
+    symbols = requested_symbols(s for s in dict.fromkeys(list(previous_symbol_in_row.values())) if s)
+    rows = tick_store.snapshot_symbols(symbols, live_token_for)
+    quotes = {symbol_str: compact_quote(rows[symbol_str]) if symbol_str in rows else None for symbol_str in symbols}
+    return jsonify(quotes=quotes, version=tick_store.version, as_of=time.time()), 200
+
+@app.route("/positions", methods=["GET"])
+def positions_route():
+    return jsonify(positions=rest_snapshot.get("positions", []), updated_at=rest_snapshot.updated_at("positions")), 200
+
+@app.route("/pnl", methods=["GET"])
+def pnl_route():
+    result = live_pnl()
+    return jsonify(totals=result.totals(), by_underlying=result.by_underlying(),
+                   positions_updated_at=rest_snapshot.updated_at("positions"), tick_version=tick_store.version), 200
+
+@app.route("/orders", methods=["GET"])
+def orders_route():
+    return jsonify(orders=order_book.orders(), version=order_book.version), 200
+
+@app.route("/stream", methods=["GET"])
+def stream_route():
+    # Server-sent events: "quotes" frames carry per-symbol changed fields since the client's previous
+    # frame, conflated to at most max_rate frames/s; "positions"/"orders" frames carry the full list.
+    # Requested symbols are subscribed on the websocket for as long as the client stays connected.
+    symbols = requested_symbols()
+    if len(symbols) > STREAM_MAX_SYMBOLS_PER_CLIENT:
+        return jsonify(status="err", msg=f"At most {STREAM_MAX_SYMBOLS_PER_CLIENT} symbols per stream"), 400
+    channels = [c for c in request.args.get("channels", ",".join(STREAM_CHANNELS)).split(",") if c in STREAM_CHANNELS]
+    mode = request.args.get("mode", MODE_QUOTE)
+    if mode not in MODES_CHEAPEST_FIRST:
+        return jsonify(status="err", msg=f"mode must be one of {', '.join(MODES_CHEAPEST_FIRST)}"), 400
+    try:
+        max_rate = float(request.args.get("max_rate", STREAM_DEFAULT_MAX_RATE))
+    except ValueError:
+        max_rate = math.nan
+    if not math.isfinite(max_rate):
+        return jsonify(status="err", msg="max_rate must be a number"), 400
+    symbols_by_token = None
+    if symbols:
+        symbols_by_token = {}
+        for symbol_str in symbols:
+            token = live_token_for(symbol_str)
+            if token is not None:
+                symbols_by_token[token] = symbol_str
+    client = quote_hub.connect(symbols_by_token, channels, max_rate)
+    if client is None:
+        metrics.inc("stream_rejected")
+        response = jsonify(status="busy", msg=f"Stream is at its limit of {STREAM_MAX_CLIENTS} clients")
+        response.headers["Retry-After"] = str(BUSY_RETRY_AFTER_SECONDS)
+        return response, 503
+    if symbols_by_token:
+        subscriptions.set_tokens(("Stream", client.client_id), symbols_by_token, mode)
+    def events():
+        try:
+            unknown = [s for s in symbols if s not in (symbols_by_token or {}).values()]
+            if unknown:
+                yield sse_frame("unknown_symbols", unknown)
+            yield from client.frames()
+        finally:
+            quote_hub.disconnect(client)
+            subscriptions.release(("Stream", client.client_id))
+    return Response(events(), mimetype="text/event-stream", headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@app.route("/metrics", methods=["GET"])
+def metrics_route():
+    text = metrics.render_prometheus()
+    if engine_channel and not engine_channel.closed:
+        try:
+            text += engine_channel.call("engine", "metrics_text", timeout=2)
+        except Exception as e_engine_metrics:
+            metrics.error("engine_metrics", e_engine_metrics)
+    return Response(text, mimetype="text/plain; version=0.0.4")
+
+def rest_health():
+    # Snapshot ages and per-endpoint transport stats; in engine mode both live in the engine process.
+    try:
+        if engine_channel:
+            return {"snapshots": engine_channel.call("rest_scheduler", "stats", timeout=2),
+                    "transport": engine_channel.call("engine", "transport_stats", timeout=2)}
+        return {"snapshots": rest_scheduler.stats() if rest_scheduler else None, "transport": transport_stats(kite)}
+    except Exception as e_rest_health:
+        metrics.error("rest_health", e_rest_health)
+        return {"error": str(e_rest_health)}
+
+@app.route("/health", methods=["GET"])
+def health_route():
+    now = time.time()
+    loop_age = now - last_loop_iteration_at if last_loop_iteration_at else None
+    healthy = loop_age is not None and loop_age < HEALTH_MAX_LOOP_AGE_SECONDS
+    body = {
+        "status": "ok" if healthy else "degraded",
+        "loop_age_seconds": round(loop_age, 3) if loop_age is not None else None,
+        "ticker_connected": bool(kws and kws.is_connected()),
+        "last_tick_age_seconds": round(now - tick_store.last_update_at, 3) if tick_store.last_update_at else None,
+        "refresh_queue_depth": refresh_queue.qsize(),
+        "refresh_queue_capacity": REFRESH_QUEUE_MAX_ITEMS,
+        "subscriptions": subscriptions.mode_counts(),
+        "stream": quote_hub.stats(),
+        "render": render_scheduler.stats(),
+        "risk": risk_engine.stats(),
+        "gap_fill": gap_filler.stats() if gap_filler else None,
+        "rest": rest_health(),
+    }
+    if hasattr(kws, "connection_stats"):
+        body["ticker_connections"] = kws.connection_stats()
+    if engine_channel:
+        body["engine_process_alive"] = not engine_channel.closed
+    return jsonify(body), 200 if healthy else 503
+
+def start_webhook_server():
+    # Waitress is a multi-threaded WSGI server with a bounded connection backlog, unlike Flask's dev server.
+    # Every /stream client holds a worker thread, so the pool is sized for them on top of the request threads.
+    quote_hub.start()
+    serve(app, host=WEBHOOK_HOST, port=WEBHOOK_PORT, threads=WEBHOOK_THREADS + STREAM_MAX_CLIENTS, connection_limit=200, backlog=256, ident=None)
+
+def start_rest_scheduler(kite_client):
+    return build_rest_scheduler(kite_client, rest_snapshot, order_book, REST_POLL_INTERVALS_SECONDS)
+
+def start_engine(build_clients, prefetch_exchanges=(), record_ticks=True, tick_table_path=None):
+    # Moves the Kite side into its own process. This process keeps rendering: it reads ticks from
+    # the shared table and gets REST results and orders pushed into rest_snapshot/order_book, while
+    # kite, rest_scheduler, order_dispatcher and candle_store become proxies that call the engine.
+    global engine_channel, kite, rest_scheduler, order_dispatcher, candle_store
+    tick_table_path = create_tick_table(tick_table_path)
+    attach_tick_store(SharedTickView(tick_table_path))
+    engine_channel = start_engine_process(tick_table_path, build_clients, REST_POLL_INTERVALS_SECONDS, rest_snapshot, order_book,
+                                          prefetch_exchanges=prefetch_exchanges, record_ticks=record_ticks)
+    engine_channel.wait_ready()
+    kite = RemoteProxy(engine_channel, "kite")
+    rest_scheduler = RemoteProxy(engine_channel, "rest_scheduler")
+    order_dispatcher = RemoteProxy(engine_channel, "order_dispatcher")
+    candle_store = RemoteProxy(engine_channel, "candle_store")
+    return engine_channel
+
+def stop_engine():
+    global engine_channel
+    if engine_channel is None:
+        return
+    engine_channel.shutdown()
+    tick_store.close()
+    try:
+        os.remove(tick_store.path)
+    except OSError as e_remove_tick_table:
+        print(f"[{dt_now_str()}] Could not remove tick table {tick_store.path}: {e_remove_tick_table}")
+    engine_channel = None
+
 def on_ticks_background(ws, ticks):
-    global live_ticks, token_to_symbol_map, live_ticks_lock 
-    with live_ticks_lock: 
-        for t in ticks:
-            sym = token_to_symbol_map.get(t["instrument_token"]) 
-            if sym: 
-                live_ticks[sym] = t 
+    started = time.perf_counter()
+    received_at = time.time()
+    try:
+        tick_store.update(ticks, received_at)
+        candle_store.update(ticks, received_at)
+        if tick_recorder is not None:
+            tick_recorder.record(ticks, received_at)
+    except Exception as e_tick_ingest:
+        metrics.error("tick_ingest", e_tick_ingest)
+    metrics.observe("stage_seconds", time.perf_counter() - started, stage="tick_ingest")
+
+def on_order_update_background(ws, data):
+    try:
+        order_book.apply_update(data)
+        if order_dispatcher:
+            order_dispatcher.on_order_update(data)
+    except Exception as e_order_update:
+        metrics.error("order_update", e_order_update)
 
 def on_connect_background(ws, response):
     print(f"[{dt_now_str()}] WS Connected (background thread).")
+    try:
+        tokens_sent, _ = subscriptions.resubscribe(ws)
+        if tokens_sent:
+            print(f"[{dt_now_str()}] Subscribed {len(tokens_sent)} tokens on connect")
+    except Exception as e_resubscribe:
+        metrics.error("resubscribe", e_resubscribe)
+    if gap_filler:
+        gap_filler.on_connect()
 
 def on_close_background(ws, code, reason):
     print(f"[{dt_now_str()}] WS Closed (background thread): {code} - {reason}")
+    if gap_filler:
+        gap_filler.on_close()
 
 def on_error_background(ws, code, reason):
+    metrics.error("websocket")
     print(f"[{dt_now_str()}] WS Error (background thread): {code} - {reason}")
 
-def process_single_row_refresh_in_main_thread(row_req, sym_vba_sent_debug, current_positions_for_refresh):
-    global live_ticks, token_to_symbol_map, inp, kite, subscribed_tokens, kws, previous_symbol_in_row, symbol_to_token_map, live_ticks_lock
-    try:
-        actual_current_sym_excel = ""
+def drain_refresh_queue(max_items=None):
+    # Last request per row wins; VBA fires one event per changed cell so pastes produce many duplicates.
+    max_items = max_items or REFRESH_BATCH_MAX_ROWS
+    latest_by_row = {}
+    waits = []
+    now = time.monotonic()
+    for _ in range(max_items):
         try:
-            val = inp.range(f"A{row_req}").value 
-            if isinstance(val, str): actual_current_sym_excel = val.strip().upper()
-        except Exception as e_xl_read_main_refresh:
-            pass
-        
-        sym_to_process = actual_current_sym_excel 
-        prev_sym_in_row = previous_symbol_in_row.get(row_req)
-        
-        should_clear_row = False
-        if not sym_to_process: 
-            should_clear_row = True
-        elif ":" not in sym_to_process: 
-            should_clear_row = True
-        
-        token_for_processing = None
-        if not should_clear_row:
-            token_for_processing = get_instrument_token_from_cache(sym_to_process)
-            if not token_for_processing: 
-                should_clear_row = True
-        if should_clear_row:
-            inp.range(f"B{row_req}").value = "" 
-            inp.range(f"C{row_req}:K{row_req}").value = [[""]*9] 
-            inp.range(f"R{row_req}").value = ""
-            if prev_sym_in_row: 
-                old_tok = symbol_to_token_map.pop(prev_sym_in_row, None) 
-                if old_tok: 
-                    token_to_symbol_map.pop(old_tok, None) 
-                    if old_tok in subscribed_tokens: 
-                        if kws and kws.is_connected(): kws.unsubscribe([old_tok]) 
-                        subscribed_tokens.remove(old_tok) 
-            previous_symbol_in_row[row_req] = None 
-            return
+            row_req, sym_vba, enqueued_at = refresh_queue.get_nowait()
+        except queue.Empty:
+            break
+        latest_by_row[row_req] = sym_vba
+        waits.append(now - enqueued_at)
+    if waits:
+        metrics.observe_many("stage_seconds", waits, stage="refresh_queue_wait")
+    return latest_by_row
 
+def subscribe_option_chain():
+    # Legs need FULL for bid/ask; the underlying only feeds the ATM strike, so LTP is enough.
+    subscriptions.set_tokens("OptionChain", option_chain.window_tokens() if option_chain else ())
+    subscriptions.set_tokens("OptionChainSpot", [option_chain.spot_token] if option_chain else (), MODE_LTP)
+
+def release_row_symbol(row, prev_sym_in_row):
+    # The websocket token is reference-counted by SubscriptionManager; the symbol maps only
+    # forget the symbol once no other INPUT row still shows it.
+    subscriptions.release(("INPUT", row))
+    previous_symbol_in_row[row] = None
+    if prev_sym_in_row and prev_sym_in_row not in previous_symbol_in_row.values():
+        old_tok = symbol_to_token_map.pop(prev_sym_in_row, None)
+        if old_tok:
+            token_to_symbol_map.pop(old_tok, None)
+
+def flush_subscriptions():
+    tokens_subscribed, tokens_unsubscribed = subscriptions.flush(kws)
+    if tokens_subscribed or tokens_unsubscribed:
+        metrics.inc("subscription_changes", len(tokens_subscribed), action="subscribe")
+        metrics.inc("subscription_changes", len(tokens_unsubscribed), action="unsubscribe")
+
+def process_row_refresh_batch(rows_to_refresh, current_positions_for_refresh):
+    global token_to_symbol_map, inp, kite, kws, previous_symbol_in_row, symbol_to_token_map
+    if not rows_to_refresh:
+        return
+    first_row, last_row = min(rows_to_refresh), max(rows_to_refresh)
+    try:
+        column_a_values = inp.range((first_row, 1), (last_row, 1)).options(ndim=1).value or []
+    except Exception as e_xl_read_batch_refresh:
+        metrics.error("refresh_read", e_xl_read_batch_refresh)
+        print(f"[{dt_now_str()}] Refresh batch: could not read A{first_row}:A{last_row}: {e_xl_read_batch_refresh}")
+        return
+
+    rows_with_symbol = {}
+    cells_to_write = {}
+    for row_req in sorted(rows_to_refresh):
+        val = column_a_values[row_req - first_row] if row_req - first_row < len(column_a_values) else None
+        sym_to_process = val.strip().upper() if isinstance(val, str) else ""
+        prev_sym_in_row = previous_symbol_in_row.get(row_req)
+        token_for_processing = get_instrument_token_from_cache(sym_to_process) if ":" in sym_to_process else None
+        if not token_for_processing:
+            for col in list(range(2, 12)) + [18]:
+                cells_to_write[(row_req, col)] = ""
+            release_row_symbol(row_req, prev_sym_in_row)
+            continue
         if prev_sym_in_row and prev_sym_in_row != sym_to_process:
-            old_tok = symbol_to_token_map.pop(prev_sym_in_row, None)
-            if old_tok: 
-                token_to_symbol_map.pop(old_tok, None)
-                if old_tok in subscribed_tokens:
-                    if kws and kws.is_connected(): kws.unsubscribe([old_tok])
-                    subscribed_tokens.remove(old_tok)
-        
-        if token_for_processing and token_for_processing not in subscribed_tokens:
-            if kws and kws.is_connected():
-                kws.subscribe([token_for_processing])
-                kws.set_mode(kws.MODE_FULL, [token_for_processing])
-            subscribed_tokens.add(token_for_processing)
+            release_row_symbol(row_req, prev_sym_in_row)
+        subscriptions.set_tokens(("INPUT", row_req), [token_for_processing])
         previous_symbol_in_row[row_req] = sym_to_process
-        
-        quote_data_for_this_row = None
-        with live_ticks_lock: 
-            quote_data_for_this_row = live_ticks.get(sym_to_process) 
-        
-        if not quote_data_for_this_row:
-            try:
-                api_resp = kite.quote([sym_to_process]) 
-                specific_quote = api_resp.get(sym_to_process, {})
-                quote_data_for_this_row = { 
-                    "ohlc": specific_quote.get("ohlc",{}), "last_price": specific_quote.get("last_price",""),
-                    "volume": specific_quote.get("volume",""), "average_price": specific_quote.get("average_price",""),
-                    "depth": specific_quote.get("depth",{})
-                }
-            except Exception as e_q_main_refresh: 
-                quote_data_for_this_row = {} 
-        ohlc = quote_data_for_this_row.get("ohlc", {}); depth = quote_data_for_this_row.get("depth", {})
-        prices = [
-            ohlc.get("open",""), ohlc.get("high",""), ohlc.get("low",""),
-            quote_data_for_this_row.get("last_price",""), 
-            quote_data_for_this_row.get("volume",""), 
-            quote_data_for_this_row.get("average_price",""), 
-            depth.get("buy",[{}])[0].get("price","") if depth.get("buy") else "",
-            depth.get("sell",[{}])[0].get("price","") if depth.get("sell") else "",
-            ohlc.get("close","") 
-        ]
-        pos_map = {f"{p['exchange']}:{p['tradingsymbol']}":p["quantity"] for p in current_positions_for_refresh} 
-        port_qty = pos_map.get(sym_to_process, "") 
-        timestamp = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        inp.range(f"B{row_req}").value = port_qty 
-        inp.range(f"C{row_req}:K{row_req}").value = [prices]
-        inp.range(f"R{row_req}").value = timestamp
-
-    except Exception as e_process_item_main_thread:
-        pass
+        rows_with_symbol[row_req] = sym_to_process
+    flush_subscriptions()
+
+    batch_quotes = tick_store.snapshot_symbols(rows_with_symbol.values(), symbol_to_token_map.get)
+    prefetch_quote_fallbacks(rows_with_symbol.values(), batch_quotes, kite)
+    pos_map = {f"{p['exchange']}:{p['tradingsymbol']}": p["quantity"] for p in current_positions_for_refresh}
+    timestamp = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    for row_req, sym_to_process in rows_with_symbol.items():
+        row_values = [pos_map.get(sym_to_process, "")] + get_price_fields_with_fallback(sym_to_process, batch_quotes, kite)
+        for offset, value in enumerate(row_values):
+            cells_to_write[(row_req, 2 + offset)] = value
+        cells_to_write[(row_req, 18)] = timestamp
+    try:
+        sheet_writer.write_cells(inp, cells_to_write)
+    except Exception as e_xl_write_batch_refresh:
+        metrics.error("refresh_write", e_xl_write_batch_refresh)
+        print(f"[{dt_now_str()}] Refresh batch: sheet write failed: {e_xl_write_batch_refresh}")
+
+def sync_option_chain_settings():
+    # Rebuilds the chain when OptionChain!B1/D1/F1 change; a blank underlying releases every chain token.
+    global option_chain
+    settings = read_option_chain_settings(chain_sheet)
+    if option_chain is not None and settings is not None:
+        underlying, expiry, strikes_each_side = settings
+        if (underlying, expiry or option_chain.expiry, strikes_each_side) == option_chain.settings_key():
+            return
+    option_chain = OptionChain(instrument_index, *settings) if settings else None
+    subscribe_option_chain()
+    if option_chain is not None:
+        print(f"[{dt_now_str()}] Option chain: {option_chain.underlying} {option_chain.expiry} with {len(option_chain)} strikes")
+
+def sync_candle_settings(state):
+    # Candles!J2:J21 lists the symbols to aggregate; symbols added there are subscribed, removed ones released.
+    interval, n_bars, symbols = read_candle_settings(candles_sheet)
+    symbol_tokens = [(s, instrument_index.token_for(s)) for s in symbols]
+    subscriptions.set_tokens("Candles", [t for _, t in symbol_tokens], MODE_QUOTE)
+    state["candle_settings"] = (interval, n_bars, symbol_tokens)
+
+def render_candles(state):
+    if state["candle_settings"] is None or not render_scheduler.due(CANDLES_SHEET):
+        return
+    interval, n_bars, symbol_tokens = state["candle_settings"]
+    with render_scheduler.frame(CANDLES_SHEET):
+        state["candle_rows"] = timed_update(update_candles_sheet, candles_sheet, candle_store, symbol_tokens, interval, n_bars, state["candle_rows"])
+
+def spot_price(spot_symbol):
+    # Live index/stock tick when subscribed, otherwise the REST quote cache.
+    if not spot_symbol:
+        return None
+    token = instrument_index.token_for(spot_symbol)
+    spot = tick_store.get_field(token, "last_price") if token is not None else None
+    if spot is None:
+        rest_quote_cache.prefetch([spot_symbol], kite)
+        spot = (rest_quote_cache.get(spot_symbol, kite) or {}).get("last_price")
+    return spot
+
+def option_chain_spot(chain):
+    return spot_price(chain.spot_symbol)
+
+def live_pnl():
+    # Positions and holdings marked to the latest ticks, recomputed at most once per tick version.
+    global pnl_engine, pnl_cache
+    with pnl_lock:
+        if pnl_engine is None or pnl_engine.instrument_index is not instrument_index:
+            pnl_engine, pnl_cache = PnlEngine(instrument_index), None
+        layout_key = (id(rest_snapshot), rest_snapshot.version("positions"), rest_snapshot.version("holdings"))
+        key = layout_key + (tick_store.version,)
+        if pnl_cache is None or pnl_cache[0] != key:
+            result = pnl_engine.compute(rest_snapshot.get("positions", []), rest_snapshot.get("holdings", []), tick_store.field_values, layout_key=layout_key)
+            metrics.observe("stage_seconds", pnl_engine.last_compute_seconds, stage="pnl_compute")
+            pnl_cache = (key, result)
+        return pnl_cache[1]
+
+def update_greeks(state):
+    greeks_key = (tick_store.version, rest_snapshot.version("positions"))
+    if greeks_key == state["last_greeks_key"] or not render_scheduler.try_frame("Greeks", greeks_key):
+        return
+    state["last_greeks_key"] = greeks_key
+    with render_scheduler.frame("Greeks"):
+        compute_and_render_greeks()
+
+def compute_and_render_greeks():
+    global greeks_engine
+    if greeks_engine is None or greeks_engine.instrument_index is not instrument_index:
+        greeks_engine = GreeksEngine(instrument_index)
+    symbols = inp.range(f"A2:A{MAX_INPUT_ROWS + 1}").options(ndim=1).value or []
+    symbols = [s.strip().upper() if isinstance(s, str) else None for s in symbols]
+    result = greeks_engine.compute(symbols, tick_store.field_values, spot_price)
+    metrics.observe("stage_seconds", greeks_engine.last_compute_seconds, stage="greeks_compute")
+    net = greeks_engine.net_greeks(rest_snapshot.get("positions", []), tick_store.field_values, spot_price)
+    subscriptions.set_tokens("Greeks", [instrument_index.token_for(s) for s in result.layout.spot_symbols], MODE_LTP)
+    timed_update(update_input_greeks, inp, result)
+    timed_update(update_net_greeks, inp, net)
+
+def recenter_and_render_option_chain(state):
+    chain = option_chain
+    if chain is None:
+        return
+    spot = option_chain_spot(chain)
+    tokens_added, tokens_removed = chain.recenter(spot)
+    if tokens_added or tokens_removed:
+        subscribe_option_chain()
+    render_key = (id(chain), chain.window, tick_store.version)
+    if render_key != state["last_option_chain_render_key"] and render_scheduler.try_frame(OPTION_CHAIN_SHEET, render_key):
+        state["last_option_chain_render_key"] = render_key
+        with render_scheduler.frame(OPTION_CHAIN_SHEET):
+            timed_update(update_option_chain_sheet, chain_sheet, chain, tick_store.snapshot(chain.window_tokens()), spot)
+
+def process_single_row_refresh_in_main_thread(row_req, sym_vba_sent_debug, current_positions_for_refresh):
+    process_row_refresh_batch({row_req: sym_vba_sent_debug}, current_positions_for_refresh)
+
+def attach_workbook(book):
+    global wb, inp, port, hold, ords, sett, chain_sheet, candles_sheet
+    wb = book
+    sheet_names_list_main = ["INPUT", "Portfolio", "Holdings", "Orders", "Funds", OPTION_CHAIN_SHEET, CANDLES_SHEET]
+    for sheet_name_str_main in sheet_names_list_main: 
+        if sheet_name_str_main not in [s.name for s in wb.sheets]: 
+            wb.sheets.add(sheet_name_str_main)
+    inp, port, hold, ords, sett, chain_sheet, candles_sheet = ( wb.sheets[s_n_main] for s_n_main in sheet_names_list_main ) 
+
+def attach_ticker(ticker):
+    global kws
+    kws = ticker
+    kws.on_ticks = on_ticks_background    
+    kws.on_connect = on_connect_background 
+    kws.on_close = on_close_background
+    kws.on_error = on_error_background
+    kws.on_order_update = on_order_update_background
+
+def subscribe_initial_input_symbols():
+    # Registers every INPUT row with the subscription manager; the websocket gets them in one
+    # frame now if it is connected, otherwise from on_connect_background.
+    initial_excel_symbols_main  = inp.range("A2:A201").value or []
+    for i_main, symbol_text_main_init in enumerate(initial_excel_symbols_main):
+        excel_row_num_main_init = i_main + 2 
+        current_excel_sym_main_init = None
+        if isinstance(symbol_text_main_init, str) and ":" in symbol_text_main_init:
+            current_excel_sym_main_init = symbol_text_main_init.strip().upper()
+        previous_symbol_in_row[excel_row_num_main_init] = current_excel_sym_main_init 
+        if current_excel_sym_main_init:
+            token_main_init_val = get_instrument_token_from_cache(current_excel_sym_main_init)
+            subscriptions.set_tokens(("INPUT", excel_row_num_main_init), [token_main_init_val])
+    flush_subscriptions()
+
+def position_tokens(items):
+    return [item.get("instrument_token") or instrument_index.token_for(f"{item.get('exchange', '')}:{item.get('tradingsymbol', '')}")
+            for item in items if item.get("quantity")]
+
+def new_render_scheduler():
+    # A lane's weight is the share of the render budget that sheet may use while it is busy. The
+    # other sheets are small and mostly idle, so INPUT may use all of it.
+    return (RenderScheduler()
+            .add_lane("INPUT", 1.0, INPUT_MIN_RENDER_INTERVAL_SECONDS, 2)
+            .add_lane("Greeks", 0.05, GREEKS_UPDATE_INTERVAL_SECONDS, 5)
+            .add_lane(OPTION_CHAIN_SHEET, 0.05, 0.25, 5)
+            .add_lane(CANDLES_SHEET, 0.03, CANDLE_RENDER_INTERVAL_SECONDS, 10)
+            .add_lane("Orders", 0.02, 0.1, 2)
+            .add_lane("General", 0.05, GENERAL_UPDATE_INTERVAL_SECONDS, GENERAL_MAX_UPDATE_INTERVAL_SECONDS))
+
+render_scheduler = new_render_scheduler()
+
+def new_main_loop_state():
+    return {"last_input_render_key": None, "last_order_book_render_version": -1, "order_book_fills": order_book.fills,
+            "input_positions_key": None, "input_row_versions": {}, "input_row_stale_since": {},
+            "input_rows_marked_stale": set(), "input_stale_swept_at": 0.0,
+            "tick_to_cell_version": None, "last_option_chain_render_key": None, "last_greeks_key": None,
+            "candle_settings": None, "candle_rows": 0, "iterations": 0}
+
+def select_input_rows(state, max_rows, stale_before=None, retry_symbols=()):
+    # Rows whose instrument ticked since the row was last drawn. When more are pending than fit in
+    # max_rows, rows stale for INPUT_MAX_ROW_LAG_SECONDS go first, then the most recently ticked.
+    # With stale_before (wall time), rows whose last tick crossed it since they were drawn are
+    # pending too, so the STALE marker appears without waiting for a tick that may never come.
+    # Rows showing a symbol in retry_symbols (a deferred REST fallback) are pending as well.
+    # Returns (rows to draw or None for a full pass, number of changed rows drawn, rows left over).
+    # A full pass is preferred whenever it fits: adjacent changed rows then go out as one range.
+    drawn, stale_since, marked_stale = state["input_row_versions"], state["input_row_stale_since"], state["input_rows_marked_stale"]
+    now = time.monotonic()
+    pending, stale_rows = [], set()
+    for row, symbol_str in previous_symbol_in_row.items():
+        token = live_token_for(symbol_str) if symbol_str else None
+        version = tick_store.token_version(token) if token is not None else 0
+        if version > drawn.get(row, 0):
+            overdue = now - stale_since.setdefault(row, now) > INPUT_MAX_ROW_LAG_SECONDS
+            pending.append((overdue, version, row))
+        elif symbol_str in retry_symbols:
+            pending.append((True, version, row))
+        elif stale_before is not None and version:
+            if tick_store.get_field(token, "received_at") < stale_before:
+                stale_rows.add(row)
+            if (row in stale_rows) != (row in marked_stale):
+                pending.append((True, version, row))
+    chosen = pending if max_rows is None or len(pending) <= max_rows else sorted(pending, reverse=True)[:max_rows]
+    for _, version, row in chosen:
+        drawn[row] = version
+        stale_since.pop(row, None)
+        if row in stale_rows:
+            marked_stale.add(row)
+        else:
+            marked_stale.discard(row)
+    if len(chosen) == len(pending):
+        return None, len(chosen), 0
+    return {row for _, _, row in chosen}, len(chosen), len(pending) - len(chosen)
+
+def render_input(state):
+    # Re-render INPUT only when a tick or the positions/holdings snapshot moved. Positions and
+    # holdings changes redraw every row; ticks alone redraw the rows that fit the frame budget.
+    # Once a second rows are also checked for ticks that went stale, e.g. during a feed outage.
+    # Rows whose REST fallback was deferred by the quote rate limit are retried on the next frame.
+    positions_key = (rest_snapshot.version("positions"), rest_snapshot.version("holdings"))
+    input_render_key = (tick_store.version,) + positions_key
+    unchanged = input_render_key == state["last_input_render_key"]
+    sweep_due = time.monotonic() - state["input_stale_swept_at"] >= INPUT_STALE_SWEEP_SECONDS
+    if not tick_store.version or (unchanged and not sweep_due and not rest_quote_cache.deferred) or not render_scheduler.try_frame("INPUT", input_render_key):
+        return
+    stale_before = None
+    if sweep_due:
+        state["input_stale_swept_at"] = time.monotonic()
+        stale_before = time.time() - INPUT_STALE_TICK_SECONDS
+    max_rows = render_scheduler.row_budget("INPUT", INPUT_FRAME_BUDGET_SECONDS) if positions_key == state["input_positions_key"] else None
+    rows, rows_drawn, rows_left = select_input_rows(state, max_rows, stale_before, rest_quote_cache.take_deferred())
+    if unchanged and not rows_drawn:
+        return
+    state["input_positions_key"] = positions_key
+    if not rows_left:
+        state["last_input_render_key"] = input_render_key
+    pnl = live_pnl()
+    # Per-row cost is frame time over rows written: the drawn subset, or every symbol row for a full pass.
+    with render_scheduler.frame("INPUT", rows=rows_drawn if rows is not None else len(previous_symbol_in_row)):
+        timed_update(update_input_sheet, inp, kite, pnl.live_holdings(), live_ticks, pnl.live_positions(), rows=rows,
+                     stale_after_seconds=INPUT_STALE_TICK_SECONDS)
+    observe_tick_to_cell(state)
+
+def observe_tick_to_cell(state):
+    # Age of every INPUT tick rendered since the last call, measured from its exchange timestamp.
+    # Only FULL-mode ticks carry exchange_timestamp, and it has one-second resolution.
+    tokens, current_version = tick_store.changed_since(state["tick_to_cell_version"] or 0)
+    first_call = state["tick_to_cell_version"] is None
+    state["tick_to_cell_version"] = current_version
+    if first_call:
+        return
+    now = time.time()
+    lags = []
+    for token in tokens:
+        if token in token_to_symbol_map:
+            exchange_ts = tick_store.get_field(token, "exchange_timestamp")
+            if exchange_ts:
+                lags.append(max(now - exchange_ts, 0.0))
+    if lags:
+        metrics.observe_many("tick_to_cell_seconds", lags)
+
+def timed_update(function, *args, **kwargs):
+    with metrics.timer("sheet_update_seconds", function=function.__name__):
+        return function(*args, **kwargs)
+
+def run_main_loop_iteration(state):
+    global last_loop_iteration_at
+    iteration_started = time.perf_counter()
+    try:
+        rows_to_refresh = drain_refresh_queue()
+        if rows_to_refresh:
+            with metrics.timer("stage_seconds", stage="refresh_batch"):
+                process_row_refresh_batch(rows_to_refresh, rest_snapshot.get("positions", []))
+    except Exception as e_main_q_batch_processing_loop:
+        metrics.error("refresh_batch", e_main_q_batch_processing_loop)
+        print(f"[{dt_now_str()}] Error processing refresh batch: {e_main_q_batch_processing_loop}")
+    try:
+        render_input(state)
+    except Exception as e_realtime_update: 
+        metrics.error("input_render", e_realtime_update)
+
+    try:
+        update_greeks(state)
+    except Exception as e_greeks_update:
+        metrics.error("greeks", e_greeks_update)
+
+    try:
+        recenter_and_render_option_chain(state)
+    except Exception as e_option_chain_render:
+        metrics.error("option_chain_render", e_option_chain_render)
+
+    try:
+        render_candles(state)
+    except Exception as e_candles_render:
+        metrics.error("candles_render", e_candles_render)
+
+    if order_book.fills != state["order_book_fills"]:
+        # A fill changes quantities and realised P&L, which only the positions API knows.
+        state["order_book_fills"] = order_book.fills
+        if rest_scheduler:
+            rest_scheduler.request_refresh("positions", "margins")
+
+    if order_book.version != state["last_order_book_render_version"] and render_scheduler.try_frame("Orders", order_book.version):
+        state["last_order_book_render_version"] = order_book.version
+        try:
+            with render_scheduler.frame("Orders"):
+                timed_update(update_orders_sheet, ords, order_book.orders(), clear_all=False)
+                timed_update(render_input_order_statuses, inp, order_book, order_id_map)
+        except Exception as e_order_book_render:
+            metrics.error("order_book_render", e_order_book_render)
+            print(f"[{dt_now_str()}] Error rendering order updates: {e_order_book_render}")
+
+    if render_scheduler.due("General"):
+        general_started = time.monotonic()
+        general_update_main_loop_positions = rest_snapshot.get("positions", [])
+        general_update_main_loop_holdings = rest_snapshot.get("holdings", [])
+        input_snapshot = None # one read of INPUT!A1:Y201 shared by autofill, defaults and order entry
+        try:
+            input_snapshot = timed_update(read_input_snapshot, inp)
+            clear_today = should_clear_today(config_file)
+            input_snapshot = timed_update(autofill_input_sheet_with_portfolio_holdings, inp, general_update_main_loop_positions, general_update_main_loop_holdings, max_rows=200, clear_all=clear_today, snapshot=input_snapshot)
+            input_snapshot = timed_update(set_input_sheet_defaults, inp, max_rows=200, snapshot=input_snapshot)
+            # Each sheet subscribes in the cheapest mode it renders: Portfolio shows LTP and P&L, Holdings only LTP.
+            subscriptions.set_tokens("Portfolio", position_tokens(general_update_main_loop_positions), MODE_QUOTE)
+            subscriptions.set_tokens("Holdings", position_tokens(general_update_main_loop_holdings), MODE_LTP)
+            pnl = live_pnl()
+            timed_update(update_portfolio_sheet, port, pnl.live_positions(), live_ticks)
+            timed_update(update_holdings_sheet, hold, pnl.live_holdings(), live_ticks)
+            timed_update(update_orders_sheet, ords, order_book.orders(), clear_all=clear_today)
+            if clear_today: wb.save()
+            timed_update(process_order_modifications, ords, kite)
+            try: sync_option_chain_settings()
+            except Exception as e_option_chain_settings:
+                metrics.error("option_chain_settings", e_option_chain_settings)
+                print(f"[{dt_now_str()}] Option chain: could not apply settings: {e_option_chain_settings}")
+            try: sync_candle_settings(state)
+            except Exception as e_candle_settings:
+                metrics.error("candle_settings", e_candle_settings)
+                print(f"[{dt_now_str()}] Candles: could not apply settings: {e_candle_settings}")
+            try: timed_update(update_settings_sheet, sett, rest_snapshot.get("margins"), error=rest_snapshot.error("margins"))
+            except Exception as e_gen_update_margin_main_loop_iter:
+                metrics.error("settings_update", e_gen_update_margin_main_loop_iter)
+        except Exception as e_general_sheet_update_main_loop_iter:
+            metrics.error("general_update", e_general_sheet_update_main_loop_iter)
+            print(f"[{dt_now_str()}] Error in general sheet update: {e_general_sheet_update_main_loop_iter}")
+        try:
+            orders_placed_before = len(order_id_map)
+            timed_update(process_input_sheet_orders, inp, order_dispatcher, order_id_map, snapshot=input_snapshot, risk=risk_engine, pending_orders=pending_orders)
+            if len(order_id_map) != orders_placed_before and rest_scheduler:
+                rest_scheduler.request_refresh("positions", "margins")
+        except Exception as e_input_orders:
+            metrics.error("input_orders", e_input_orders)
+            print(f"[{dt_now_str()}] Error processing INPUT orders: {e_input_orders}")
+        render_scheduler.record("General", general_started, time.monotonic() - general_started)
+    try:
+        flush_subscriptions()
+    except Exception as e_flush_subscriptions:
+        metrics.error("subscribe", e_flush_subscriptions)
+    last_loop_iteration_at = time.time()
+    state["iterations"] += 1
+    metrics.observe("stage_seconds", time.perf_counter() - iteration_started, stage="loop_iteration")
+
+def run_main_loop(should_stop=None, state=None):
+    state = state or new_main_loop_state()
+    while not (should_stop and should_stop()):
+        run_main_loop_iteration(state)
+        # Sleep until the next sheet is due; a /refresh_symbol(s) request wakes the loop at once.
+        idle = min(max(render_scheduler.seconds_until_next(), MAIN_LOOP_MIN_IDLE_SECONDS), MAIN_LOOP_MAX_IDLE_SECONDS)
+        if refresh_queued.wait(idle):
+            refresh_queued.clear()
+    return state
+
+def print_engine_stats():
+    try:
+        engine_stats = engine_channel.call("engine", "stats", timeout=5)
+    except Exception as e_engine_stats:
+        print(f"[{dt_now_str()}] Engine stats unavailable: {e_engine_stats}")
+        return
+    print(f"[{dt_now_str()}] Engine: {engine_stats['ticks_applied']} ticks applied to {engine_stats['instruments']} instruments, "
+          f"{engine_stats['calls_served']} calls served, {engine_stats['ticks_recorded']} ticks recorded")
+    for name, (count, p50, p99) in sorted(engine_stats["summary"].items()):
+        print(f"[{dt_now_str()}] engine {name}: n={count} p50<={p50}s p99<={p99}s")
+
+def print_shutdown_stats():
+    if engine_channel and not engine_channel.closed:
+        print_engine_stats()
+    if order_dispatcher:
+        print(f"[{dt_now_str()}] Order submit latency: {order_dispatcher.latency_stats()}")
+    if rest_scheduler:
+        print(f"[{dt_now_str()}] REST scheduler stats: {rest_scheduler.stats()}")
+    print(f"[{dt_now_str()}] Quote fallback cache stats: {rest_quote_cache.stats()}")
+    print(f"[{dt_now_str()}] Sheet writer stats: {sheet_writer.stats()}")
+    if hasattr(kws, "connection_stats"):
+        print(f"[{dt_now_str()}] Ticker connections: {kws.connection_stats()}")
+    if tick_recorder:
+        print(f"[{dt_now_str()}] Tick recorder: {tick_recorder.ticks_recorded} ticks recorded, {tick_recorder.batches_dropped} batches dropped")
+    for name, (count, p50, p99) in sorted(metrics.summary().items()):
+        print(f"[{dt_now_str()}] {name}: n={count} p50<={p50}s p99<={p99}s")
 
 if __name__=="__main__":
+    parser = argparse.ArgumentParser(description="Kite Connect to Excel bridge")
+    parser.add_argument("--replay", nargs="+", metavar="TICK_FILE", help="Feed recorded tick files instead of connecting KiteTicker")
+    parser.add_argument("--speed", type=float, default=1.0, help="Replay speed multiplier; 0 replays as fast as possible")
+    parser.add_argument("--no-record", action="store_true", help="Do not record live ticks to disk")
+    parser.add_argument("--single-process", action="store_true", help="Run the ticker, REST scheduler and orders in this process")
+    args = parser.parse_args()
+    record_ticks = RECORD_TICKS and not args.replay and not args.no_record
     try:
         print("Initializing Kite Connect and Excel...")
-        kite = KiteConnect(api_key=API_KEY)
-        kite.set_access_token(open(ACCESS_TOKEN_FILE).read().strip())
-        print(f"Pre-fetching instruments for: {PREFETCH_EXCHANGES}...")
-        for exch in PREFETCH_EXCHANGES:
-            try:
-                fetched_inst_list_main = kite.instruments(exchange=exch) 
-                all_instruments_cache[exch] = fetched_inst_list_main 
-                for inst_detail_main in fetched_inst_list_main: 
-                    full_sym_str_main = f"{exch}:{inst_detail_main['tradingsymbol']}"
-                    token_val_main = inst_detail_main['instrument_token']
-                    symbol_to_token_map[full_sym_str_main] = token_val_main
-                    token_to_symbol_map[token_val_main] = full_sym_str_main
-            except Exception as e_instr_fetch_main: pass
-        wb = xw.Book(EXCEL_FILE) 
-        sheet_names_list_main = ["INPUT", "Portfolio", "Holdings", "Orders", "Funds"]
-        for sheet_name_str_main in sheet_names_list_main: 
-            if sheet_name_str_main not in [s.name for s in wb.sheets]: 
-                wb.sheets.add(sheet_name_str_main)
-        inp, port, hold, ords, sett = ( wb.sheets[s_n_main] for s_n_main in sheet_names_list_main ) 
+        if ENGINE_PROCESS and not args.replay and not args.single_process:
+            print("Starting engine process (ticker, REST scheduler, orders)...")
+            start_engine(functools.partial(kite_clients, API_KEY, ACCESS_TOKEN_FILE, TICKER_CONNECTIONS),
+                         prefetch_exchanges=PREFETCH_EXCHANGES, record_ticks=record_ticks)
+        else:
+            kite = KiteConnect(api_key=API_KEY)
+            kite.set_access_token(open(ACCESS_TOKEN_FILE).read().strip())
+            install_transport(kite)
+        print(f"Checking instrument cache for: {PREFETCH_EXCHANGES}...")
+        instrument_index.kite = kite
+        instrument_index.ensure_fresh(PREFETCH_EXCHANGES, kite)
+        if not engine_channel:
+            print("Starting REST scheduler...")
+            rest_scheduler = start_rest_scheduler(kite)
+            order_dispatcher = OrderDispatcher(kite)
+        attach_workbook(xw.Book(EXCEL_FILE))
+        risk_engine.start()
     except Exception as e_main_startup_init_block: 
         print(f"CRITICAL ERROR during Kite/Excel initialization: {e_main_startup_init_block}")
         import traceback; traceback.print_exc(); exit()
     try: 
-        print("Starting Flask server...")
-        threading.Thread(target=lambda: app.run(port=5000, debug=False, use_reloader=False), daemon=True).start()
+        print(f"Starting webhook server on http://{WEBHOOK_HOST}:{WEBHOOK_PORT} ...")
+        threading.Thread(target=start_webhook_server, daemon=True).start()
     except Exception as e_main_startup_flask_block: 
         print(f"CRITICAL ERROR starting Flask: {e_main_startup_flask_block}")
         import traceback; traceback.print_exc(); exit()
+    if record_ticks and not engine_channel:
+        tick_recorder = TickRecorder(TICK_DATA_DIR).start()
     try:
-        print("Initializing KiteTicker for background operation...")
-        kws = KiteTicker(API_KEY, kite.access_token, reconnect=True, reconnect_max_tries=50, reconnect_max_delay=60)
-        kws.on_ticks = on_ticks_background    
-        kws.on_connect = on_connect_background 
-        kws.on_close = on_close_background
-        kws.on_error = on_error_background
+        if args.replay:
+            print(f"Replaying {len(args.replay)} tick file(s) at {'max' if not args.speed else f'{args.speed:g}x'} speed...")
+            attach_ticker(TickReplayer(args.replay, speed=args.speed))
+        elif engine_channel:
+            attach_ticker(RemoteTicker(engine_channel))
+        else:
+            print("Initializing KiteTicker for background operation...")
+            gap_filler = GapFiller(kite, tick_store, instrument_index.symbol_for, subscriptions.tokens)
+            attach_ticker(TickerPool(lambda i: KiteTicker(API_KEY, kite.access_token, reconnect=True, reconnect_max_tries=50, reconnect_max_delay=60), connections=TICKER_CONNECTIONS))
+        subscribe_initial_input_symbols() # sent by on_connect_background once the socket is up
         kws_thread = threading.Thread(target=lambda: kws.connect(threaded=True)) 
         kws_thread.daemon = True 
         kws_thread.start()
-        time.sleep(5) 
-        if kws.is_connected():
-            initial_excel_symbols_main  = inp.range("A2:A201").value or []
-            initial_tokens_to_subscribe_main_list = []
-            for i_main, symbol_text_main_init in enumerate(initial_excel_symbols_main):
-                excel_row_num_main_init = i_main + 2 
-                current_excel_sym_main_init = None
-                if isinstance(symbol_text_main_init, str) and ":" in symbol_text_main_init:
-                    current_excel_sym_main_init = symbol_text_main_init.strip().upper()
-                previous_symbol_in_row[excel_row_num_main_init] = current_excel_sym_main_init 
-                if current_excel_sym_main_init:
-                    token_main_init_val = get_instrument_token_from_cache(current_excel_sym_main_init)
-                    if token_main_init_val and token_main_init_val not in subscribed_tokens: 
-                        initial_tokens_to_subscribe_main_list.append(token_main_init_val)
-            if initial_tokens_to_subscribe_main_list:
-                kws.subscribe(initial_tokens_to_subscribe_main_list) 
-                kws.set_mode(kws.MODE_FULL, initial_tokens_to_subscribe_main_list) 
-                subscribed_tokens.update(initial_tokens_to_subscribe_main_list)
-        else:
-            print(f"[{dt_now_str()}] WARNING: KiteTicker did NOT connect after 5s.")
     except Exception as e_kws_startup_block:
         print(f"CRITICAL ERROR Initializing or Starting KiteTicker: {e_kws_startup_block}")
         import traceback; traceback.print_exc()
     print("Starting MAIN PROCESSING LOOP. Ctrl+C to exit.")
-    last_general_sheets_update_timestamp = 0
 
     try:
-        while True:
-            items_processed_in_main_loop_iter = 0
-            while not refresh_queue.empty():
-                if items_processed_in_main_loop_iter >= 1: break
-                try:
-                    row_req_from_q, sym_vba_sent_from_q = refresh_queue.get_nowait()
-                    temp_current_positions_for_row_refresh = []
-                    try: temp_current_positions_for_row_refresh = kite.positions().get("net", [])
-                    except Exception as e_temp_pos_main_loop_refresh_iter: pass
-                    process_single_row_refresh_in_main_thread(row_req_from_q, sym_vba_sent_from_q, temp_current_positions_for_row_refresh)
-                    items_processed_in_main_loop_iter +=1
-                except queue.Empty: break
-                except Exception as e_main_q_item_processing_loop: pass
-            try:
-                current_main_loop_live_ticks_copy = {}
-                with live_ticks_lock: 
-                    current_main_loop_live_ticks_copy = live_ticks.copy()
-                
-                if current_main_loop_live_ticks_copy:
-                    try: 
-                        current_positions = kite.positions().get("net", [])
-                        current_holdings = fetch_holdings(kite)
-                    except Exception: 
-                        current_positions, current_holdings = [], []
-                    update_input_sheet(inp, kite, current_holdings, current_main_loop_live_ticks_copy, current_positions)
-            except Exception as e_realtime_update: 
-                pass
-
-            if time.time() - last_general_sheets_update_timestamp > GENERAL_UPDATE_INTERVAL_SECONDS:
-                current_main_loop_live_ticks_copy = {}
-                with live_ticks_lock: current_main_loop_live_ticks_copy = live_ticks.copy()
-                general_update_main_loop_positions, general_update_main_loop_holdings = [], []
-                try:
-                    general_update_main_loop_positions = kite.positions().get("net", [])
-                    general_update_main_loop_holdings = fetch_holdings(kite)
-                except Exception as e_gen_update_data_fetch_main_loop_iter: pass
-                try:
-                    clear_today = should_clear_today(config_file)
-                    autofill_input_sheet_with_portfolio_holdings(inp, general_update_main_loop_positions, general_update_main_loop_holdings, max_rows=200, clear_all=clear_today)
-                    set_input_sheet_defaults(inp, max_rows=200)
-                    update_portfolio_sheet(port, general_update_main_loop_positions, current_main_loop_live_ticks_copy)
-                    update_holdings_sheet(hold, general_update_main_loop_holdings, current_main_loop_live_ticks_copy)
-                    update_orders_sheet(ords, kite, clear_all=clear_today)
-                    if clear_today: wb.save()
-                    process_order_modifications(ords, kite)
-                    try: update_settings_sheet(sett, kite)
-                    except Exception as e_gen_update_margin_main_loop_iter: pass
-                except Exception as e_general_sheet_update_main_loop_iter: pass
-                try:
-                    process_input_sheet_orders(inp, kite, order_id_map) 
-                except Exception as e_input_orders:
-                    pass
-                last_general_sheets_update_timestamp = time.time()
-            
-            time.sleep(0.01)
+        run_main_loop()
     except KeyboardInterrupt: print("\nUser exit (Ctrl+C from main loop).")
     except Exception as e_main_loop_critical_outermost:
         print(f"CRITICAL UNHANDLED ERROR in main processing loop: {e_main_loop_critical_outermost}")
         import traceback; traceback.print_exc()
     finally: 
         print("Initiating final shutdown sequence...")
+        if engine_channel:
+            print_shutdown_stats()
+            stop_engine()
+        else:
+            if order_dispatcher:
+                order_dispatcher.shutdown()
+            if rest_scheduler:
+                rest_scheduler.stop()
+            if tick_recorder:
+                tick_recorder.stop()
+            print_shutdown_stats()
         if kws and kws.is_connected(): 
             try: kws.stop_retry(); kws.close(1000, "Program shutdown")
-            except Exception as e_ws_final_shutdown_main_thread: pass
+            except Exception as e_ws_final_shutdown_main_thread:
+                print(f"[{dt_now_str()}] Error closing websocket: {e_ws_final_shutdown_main_thread}")
         if wb: 
             try: wb.close()
-            except Exception as e_wb_final_shutdown_main_thread: pass
+            except Exception as e_wb_final_shutdown_main_thread:
+                print(f"[{dt_now_str()}] Error closing workbook: {e_wb_final_shutdown_main_thread}")
         print("Program exited.")